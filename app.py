@@ -7,7 +7,8 @@ from flask.ext.cors import CORS
 
 from local_settings import POSTGRES
 import pymongo
-import psycopg2
+
+import pg
 
 app = Flask(__name__)
 app.config['PROPAGATE_EXCEPTIONS'] = True
@@ -20,4 +21,5 @@ cache = Cache(app, config={'CACHE_TYPE': 'simple'})
 
 db = pymongo.MongoClient().raduga
 
-psql = psycopg2.connect(POSTGRES)
+# Postgres connections, checked out per request (see pg.py)
+pool = pg.Pool(POSTGRES)
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+"""
+Barrel distortion of the cloud mask, done in-process.
+
+This replaces:
+
+    convert cloud_mask.png -virtual-pixel black \
+            -filter point -interpolate NearestNeighbor \
+            -distort Barrel "0.0 0.0 0.025 0.975 X Y" +antialias ...
+
+ImageMagick’s barrel distortion looks up, for every pixel of the output,
+the pixel of the input at
+
+    Rsrc = Rdest * (A * Rdest^3 + B * Rdest^2 + C * Rdest + D)
+
+where the radius is taken from the centre X, Y and normalised to half the
+smallest side of the image. Pixels are sampled at their centres (i + 0.5),
+with nearest neighbour interpolation; source pixels outside of the image
+are black.
+
+The lookup only depends on the size of the image and on the centre. As
+water.py always moves the sun to the middle column, the centre is fully
+determined by the row of the sun, and we keep the lookup table per row.
+Within one day the sun hardly changes rows, so a few tables are enough.
+Tables are built TILE_ROWS rows at a time, to keep the temporary arrays
+small on the finer grids.
+"""
+
+from functools import lru_cache
+
+import numpy as np
+
+COEFFICIENTS = (0.0, 0.0, 0.025, 0.975)
+
+TILE_ROWS = 64
+
+
+@lru_cache(maxsize=8)
+def remap_table(nx, ny, center_y, coefficients=COEFFICIENTS):
+    """
+    For an image of nx × ny pixels distorted around (nx // 2, center_y),
+    return the flat index of the source pixel of every output pixel, as an
+    (ny, nx) array. Pixels that come from outside the image get the index
+    nx * ny.
+    """
+    a, b, c, d = coefficients
+    rscale = 2.0 / min(nx, ny)
+    a *= rscale ** 3
+    b *= rscale ** 2
+    c *= rscale
+
+    center_x = nx // 2
+    dx = (np.arange(nx, dtype=np.float64) + 0.5 - center_x)[np.newaxis, :]
+    table = np.empty((ny, nx), dtype=np.int32)
+    for top in range(0, ny, TILE_ROWS):
+        dy = (np.arange(top, min(top + TILE_ROWS, ny), dtype=np.float64) + 0.5 - center_y)[:, np.newaxis]
+        r = np.sqrt(dx * dx + dy * dy)
+        f = ((a * r + b) * r + c) * r + d
+
+        sx = np.floor(dx * f + center_x).astype(np.int64)
+        sy = np.floor(dy * f + center_y).astype(np.int64)
+        inside = (sx >= 0) & (sx < nx) & (sy >= 0) & (sy < ny)
+        table[top:top + TILE_ROWS] = np.where(inside, sy * nx + sx, nx * ny)
+    table.setflags(write=False)
+    return table
+
+
+def distort(layer, center_y, coefficients=COEFFICIENTS):
+    """
+    Barrel distort a 2-D uint8 array around (nx // 2, center_y),
+    filling in black where the source falls outside of the image.
+
+    For a stack of layers (n, ny, nx), `center_y` holds the centre row of
+    every layer. Layers with the same centre are distorted together.
+    """
+    layer = np.asarray(layer, dtype=np.uint8)
+    if layer.ndim == 2:
+        return distort(layer[np.newaxis], [center_y], coefficients)[0]
+
+    n, ny, nx = layer.shape
+    center_y = np.asarray(center_y, dtype=np.int64)
+    source = np.zeros((n, nx * ny + 1), dtype=np.uint8)
+    source[:, :nx * ny] = layer.reshape(n, nx * ny)
+    distorted = np.empty_like(layer)
+    for row in np.unique(center_y):
+        same = np.flatnonzero(center_y == row)
+        table = remap_table(nx, ny, int(row), tuple(coefficients))
+        distorted[same] = np.take(source[same], table, axis=1)
+    return distorted
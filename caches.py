@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+"""
+Small in-process caches for the app.
+
+FileCache keeps what was read from a file, and only reads it again when
+the file has changed: when its mtime, inode or size are different. As the
+pipeline replaces its files with a rename, a new file always has a new
+inode. To not even look at the file on every request, it is checked at
+most once every `check_interval` seconds.
+
+TTLCache keeps a value for `ttl` seconds, or until it is invalidated.
+
+Every uwsgi process has its own caches.
+"""
+
+import os
+import time
+import threading
+
+
+class FileCache(object):
+
+    def __init__(self, path, load, default=None, check_interval=1.0):
+        self.path = path
+        self.load = load
+        self.default = default
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.value = default
+        self.key = None
+        self.checked = 0
+
+    def get(self):
+        """ The value of `load(path)`, or `default` when there is no file """
+        if time.time() - self.checked < self.check_interval:
+            return self.value
+        with self.lock:
+            self.checked = time.time()
+            try:
+                stat = os.stat(self.path)
+                key = (stat.st_mtime_ns, stat.st_ino, stat.st_size)
+            except OSError:
+                key = None
+            if key != self.key:
+                if key is None:
+                    self.value = self.default
+                else:
+                    try:
+                        self.value = self.load(self.path)
+                    except (IOError, ValueError):
+                        # Half written? Keep what we have, and try again next time
+                        return self.value
+                self.key = key
+        return self.value
+
+
+class TTLCache(object):
+
+    def __init__(self, ttl, load):
+        self.ttl = ttl
+        self.load = load
+        self.lock = threading.Lock()
+        self.value = None
+        self.expires = 0
+
+    def get(self):
+        if time.time() < self.expires:
+            return self.value
+        with self.lock:
+            if time.time() >= self.expires:
+                self.value = self.load()
+                self.expires = time.time() + self.ttl
+        return self.value
+
+    def invalidate(self):
+        self.expires = 0
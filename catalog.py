@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+"""
+The forecasts we have, without looking through GFS_FOLDER on every request.
+
+The pipeline publishes a manifest, GFS_FOLDER/forecasts.json, whenever it
+has added something: the slug of every forecast folder with a PWAT grib
+file, and the files in it. The app keeps the manifest in memory, and only
+reads it again when it has been replaced (see caches.FileCache).
+
+When there is no manifest yet, the catalog looks through the folder itself,
+at most once every `check_interval` seconds.
+
+    python catalog.py
+
+publishes the manifest of GFS_FOLDER, for after the forecast folders have
+been changed by hand (or by cleanup.sh).
+"""
+
+import os
+import re
+import json
+from datetime import datetime
+from collections import namedtuple
+
+import pytz
+
+import caches
+import utils
+
+MANIFEST = 'forecasts.json'
+
+Forecast = namedtuple('Forecast', ['slug', 'date', 'artifacts'])
+
+
+def scan(folder):
+    """ The forecasts in `folder`, newest first: a list of {slug, artifacts} """
+    forecasts = []
+    for slug in sorted(os.listdir(folder), reverse=True):
+        path = os.path.join(folder, slug)
+        if re.match(r'\d{10}$', slug) and os.path.isdir(path):
+            artifacts = sorted(os.listdir(path))
+            if any(a.endswith('pwat.grib') for a in artifacts):
+                forecasts.append({'slug': slug, 'artifacts': artifacts})
+    return forecasts
+
+
+def publish(folder):
+    """ Write the manifest of the forecasts in `folder` """
+    path = os.path.join(folder, MANIFEST)
+    with utils.replacing(path) as tmp_path, open(tmp_path, 'w') as f:
+        json.dump({'forecasts': scan(folder)}, f, indent=1)
+
+
+def index(forecasts):
+    return [Forecast(f['slug'],
+                     datetime.strptime(f['slug'], "%Y%m%d%H").replace(tzinfo=pytz.UTC),
+                     frozenset(f['artifacts']))
+            for f in forecasts]
+
+
+def load_manifest(path):
+    with open(path) as f:
+        return index(json.load(f)['forecasts'])
+
+
+class Catalog(object):
+
+    def __init__(self, folder, check_interval=1.0):
+        self.folder = folder
+        self.manifest = caches.FileCache(os.path.join(folder, MANIFEST), load_manifest,
+                                         check_interval=check_interval)
+        self.scanned = caches.TTLCache(check_interval, lambda: index(scan(folder)))
+
+    def forecasts(self):
+        """ All forecasts, newest first """
+        forecasts = self.manifest.get()
+        if forecasts is None:
+            forecasts = self.scanned.get()
+        return forecasts
+
+    def latest(self):
+        """ (path, slug) of the newest forecast, or (None, None) """
+        forecasts = self.forecasts()
+        if not forecasts:
+            return (None, None)
+        return (os.path.join(self.folder, forecasts[0].slug), forecasts[0].slug)
+
+    def forecast_info(self, now=None):
+        """
+        The forecasts for the future, and the one for the present (the last
+        one), as a list of {slug, date, future}
+        """
+        now = now or datetime.now(pytz.utc)
+        forecast_info = []
+        for forecast in self.forecasts():
+            future = forecast.date > now
+            forecast_info.append({"slug": forecast.slug, "date": forecast.date, "future": future})
+            if not future:
+                break
+        return forecast_info
+
+    def latest_with(self, pattern, now=None):
+        """
+        The slug of the newest forecast for the present or the past that has
+        the file `pattern % slug`, or None. A forecast that is fetched again
+        loses its files until water.py and cities.py have made them again.
+        """
+        now = now or datetime.now(pytz.utc)
+        for forecast in self.forecasts():
+            if forecast.date <= now and pattern % forecast.slug in forecast.artifacts:
+                return forecast.slug
+        return None
+
+
+if __name__ == '__main__':
+    from settings import GFS_FOLDER
+    publish(GFS_FOLDER)
@@ -1,8 +1,8 @@
 # -*- coding: utf-8 -*-
 """
-Load a list of Russian cities with their coordinates
+Load the index of cities by grid cell (see city_index.py)
 
-Open the latest predicted rainbows image as created by water.py
+Open the latest predicted rainbows mask as created by water.py
 Check which cities are in one of the rainbow areas.
 
 Create a file "YYYYMMDDHH.rainbow_cities.json" that can be served
@@ -14,30 +14,65 @@ import os
 import sys
 import json
 import codecs
-import requests
-import psycopg2.extras
+import argparse
 
 from glob import glob
+from datetime import datetime, timedelta
 from PIL import Image
+import numpy as np
 
+import push
+import catalog
+import payloads
 import settings
+import city_index
+import rainbowmask
 from geo import position_to_point
 import utils
-from app import psql
+from app import pool
 
 logger = utils.install_logger()
 
-s = requests.Session()
-
-def _push(message, channels):
-    for channel in channels:
-        data = json.dumps({"to": channel, "data": {"message": message}})
-        headers = {"Content-Type": "application/json"}
-        r = s.post('https://api.pushy.me/push?api_key=' + settings.PUSHY_KEY, data=data, headers=headers)
-        logger.debug("PUSH TO {} → result: {}".format(channel, r.text.strip()))
-
-
-def send_push(city):
+try:
+    from settings import PUSHY_WORKERS
+except ImportError:
+    PUSHY_WORKERS = 8
+
+try:
+    from settings import PUSHY_MAX_TOPICS
+except ImportError:
+    PUSHY_MAX_TOPICS = 1
+
+# Only the forecasts for now and the next PUSH_HOURS hours are pushed (and
+# shown as the rainbow cities of now). A new GFS run comes every 6 hours,
+# so every forecast time is pushed once.
+try:
+    from settings import PUSH_HOURS
+except ImportError:
+    PUSH_HOURS = 3
+
+
+def is_near(slug, now=None):
+    """ Whether the forecast `slug` is for now or the next PUSH_HOURS hours """
+    now = now or datetime.utcnow()
+    date = datetime.strptime(slug, "%Y%m%d%H")
+    return now - timedelta(hours=3) < date <= now + timedelta(hours=PUSH_HOURS)
+
+
+def _push(messages):
+    """ Send a list of (message, channels) pairs to pushy.me """
+    dispatcher = push.Dispatcher(push.PUSHY_URL + settings.PUSHY_KEY,
+                                 workers=PUSHY_WORKERS, max_topics=PUSHY_MAX_TOPICS)
+    summary = dispatcher.send(messages, log=logger.debug)
+    logger.debug("delivered %d pushes in %d requests (%d retries) in %.2fs, %d failed" % (
+        summary.delivered, summary.requests, summary.retries, summary.seconds, len(summary.failed)))
+    if summary.failed:
+        logger.error(u"could not push to: %s" % ", ".join(summary.failed))
+    return summary
+
+
+def city_push(city):
+    """ The (message, channels) to send for a rainbow city """
     template = u"High chance on rainbows near {}"
     if city['country'] == 'ru':
         template = u"Радуга обнаружена на расстоянии {}"
@@ -45,56 +80,65 @@ def send_push(city):
         template = u"发现彩虹：距你 {}"
     channels = ['/topics/city-' + utils.city_id(city)]
     name = city['name']
-    logger.debug(u"Sending pushes for city: {} ({})".format(name, str(channels)).encode('utf8'))
-    _push(template.format(name), channels)
+    logger.debug(u"Sending pushes for city: {} ({})".format(name, str(channels)))
+    return template.format(name), channels
 
 
-def find_rainbow_cities(GFS_SLUG):
-    logger.debug("loading list of cities")
-    cities = json.loads(open(os.path.join(os.path.abspath(os.path.dirname(__file__)), "data", "cities.json")).read())
-
-    logger.debug("loading specified rainbow analysis image")
-    CURRENT_GFS_FOLDER = os.path.join(settings.GFS_FOLDER, GFS_SLUG)
-    rainbow_analysis_image_path = os.path.join(CURRENT_GFS_FOLDER, "GFS_half_degree.%s.pwat.png" % GFS_SLUG)
+def rainbow_grid(folder, slug):
+    """
+    Return the grid cells with rainbows as a (ny, nx) boolean array. It comes
+    from the rainbow mask, or for older forecasts from the rainbow analysis image.
+    """
     try:
-        image = Image.open(rainbow_analysis_image_path)
+        return rainbowmask.load(rainbowmask.path_for(folder, slug)).grid
     except IOError:
-        logger.error("did not find image file")
-        return False
+        pass
+    image = Image.open(os.path.join(folder, "GFS_half_degree.%s.pwat.png" % slug))
+    return np.asarray(image) == 0
 
-    access = image.load()
+
+def find_rainbow_cities(GFS_SLUG, grid=None):
+    """
+    Find the cities with rainbows in a forecast. The rainbow `grid` is read
+    from disk, unless it is given (as returned by water.find_rainclouds).
+    """
+    CURRENT_GFS_FOLDER = os.path.join(settings.GFS_FOLDER, GFS_SLUG)
+    if grid is None:
+        logger.debug("loading specified rainbow analysis")
+        try:
+            grid = rainbow_grid(CURRENT_GFS_FOLDER, GFS_SLUG)
+        except IOError:
+            logger.error("did not find rainbow mask or image file")
+            return False
 
     rainbow_cities_json_path = os.path.join(CURRENT_GFS_FOLDER, "%s.rainbow_cities.json" % GFS_SLUG)
     processed_path = os.path.join(CURRENT_GFS_FOLDER, "PROCESSED")
 
-    rainbow_cities = []
+    logger.debug("loading list of cities")
+    index = city_index.get(pool)
 
     logger.debug("checking each city against rainbow analysis")
-
-    xys = []
-    for x in range(image.size[0]):
-        for y in range(image.size[1]):
-            if access[x, y] == 0:
-                xys.append("'%dx%d'" % (x, y))
-    if len(xys) > 0:
-        cur = psql.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        cur.execute("SELECT * FROM worldcities WHERE xy IN (" + (",".join(xys)) + ")")
-        rainbow_cities = cur.fetchall()
-    else:
-        rainbow_cities = []
+    rainbow_cities = index.cities_in(grid)
 
     if len(rainbow_cities) > 0:
-        names = u', '.join((city['name_en'] for city in rainbow_cities)).encode('utf8')
+        names = u', '.join((city['name_en'] for city in rainbow_cities))
         logger.debug(u"Found rainbow cities: %s" % names)
-        [send_push(c) for c in rainbow_cities]
-        _push(u"Rainbow cities: %s" % names, ["debug"])
+        files = [rainbow_cities_json_path]
+        near = is_near(GFS_SLUG)
+        if near:
+            _push([city_push(c) for c in rainbow_cities] + [(u"Rainbow cities: %s" % names, ["debug"])])
+            files.append(os.path.join(settings.GFS_FOLDER, "rainbow_cities.json"))
+        else:
+            logger.debug("forecast %s is not for the next %d hours, not pushing" % (GFS_SLUG, PUSH_HOURS))
 
-        logger.debug(u"Wrote: %s" % rainbow_cities_json_path)
-        files = [os.path.join(settings.GFS_FOLDER, "rainbow_cities.json"), rainbow_cities_json_path]
         for fn in files:
-            with codecs.open(fn, 'w', 'utf8') as f:
+            # The app reads this file while we replace it (and with --jobs, other processes may be replacing it too)
+            with utils.replacing(fn) as tmp_path, codecs.open(tmp_path, 'w', 'utf8') as f:
                 f.write(json.dumps(rainbow_cities, indent=4, ensure_ascii=False))
             logger.debug(u"Wrote {}".format(fn))
+        if near:
+            payloads.publish(payloads.CITIES_PATH, payloads.cities_body(rainbow_cities))
+            logger.debug(u"Wrote {}".format(payloads.CITIES_PATH))
 
     else:
         logger.debug("no rainbow cities found")
@@ -106,24 +150,41 @@ def find_rainbow_cities(GFS_SLUG):
 
 def test_notifications():
     city = {'id': 'f4be2e51ef2a9c01007d0025280664b2', 'country': 'cn', 'name': 'Dawukou', 'name_en': 'Dawukou'}
-    _push(u"Test push message", ["/topics/debugging"])
-    # _push(u"Test push message", ["/topics/city-amsterdam"])
-    #send_push(city)
+    _push([(u"Test push message", ["/topics/debugging"])])
+    # _push([(u"Test push message", ["/topics/city-amsterdam"])])
+    # _push([city_push(city)])
 
-if __name__ == '__main__':
-    if len(sys.argv) > 1 and sys.argv[1] == 'test-notifications':
-        test_notifications()
-        exit(0)
 
-    logger.debug('looking for rainbow-forecasts for which to find cities')
+def cityless_slugs():
+    """
+    The rainbow-forecasts for which we have not looked for cities yet, newest
+    first (of all of them, as for water.unprocessed_slugs)
+    """
+    slugs = []
     for f in sorted(os.listdir(settings.GFS_FOLDER), reverse=True):
         slug = f
         path = os.path.join(settings.GFS_FOLDER, slug)
         if re.match(r'\d{10}', slug) and os.path.isdir(path):
-            #find_rainbow_cities(slug)
             if len(glob(os.path.join(path, 'PROCESSED'))) > 0:
-                logger.debug("encountered already processed folder %s, stop searching for rainbow-forecasts" % slug)
-                break
+                continue
             if len(glob(os.path.join(path, '*pwat.grib'))) > 0:
-                logger.debug("encountered cityless rainbow-forecast %s, start processing" % slug)
-                find_rainbow_cities(slug)
+                logger.debug("encountered cityless rainbow-forecast %s" % slug)
+                slugs.append(slug)
+    return slugs
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'test-notifications':
+        test_notifications()
+        exit(0)
+
+    parser = argparse.ArgumentParser(description="Find the cities in the rainbow-forecasts")
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+                        help="number of forecasts to process at the same time")
+    args = parser.parse_args()
+
+    logger.debug('looking for rainbow-forecasts for which to find cities')
+    for slug, succeeded in utils.process_slugs(find_rainbow_cities, cityless_slugs(), args.jobs):
+        if not succeeded:
+            logger.error("could not find the cities for rainbow-forecast %s" % slug)
+    catalog.publish(settings.GFS_FOLDER)
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+"""
+Which cities are in which cell of the GFS grid.
+
+cities.py used to ask Postgres for the cities in the rainbow cells with a
+`WHERE xy IN (...)` query, listing every cell. Instead we read the
+worldcities table once, and keep for every city the index of its grid
+cell (y * nx + x, from the `xy` column). Finding the cities in a rainbow
+mask is then a matter of looking up those cells in the mask.
+
+The index is kept in an .npz file with the cell of every city, and the
+cities themselves as JSON. Rebuild it when the worldcities table changes:
+
+    python city_index.py
+"""
+
+import os
+import json
+
+import numpy as np
+import psycopg2.extras
+
+import geo
+import settings
+import utils
+
+INDEX_PATH = settings.relative_folder('data', 'worldcities.npz')
+
+# The GFS grid at GFS_RESOLUTION: 720 × 361 for 0.5 degrees
+NX, NY = geo.grid_size()
+
+
+class CityIndex(object):
+
+    def __init__(self, cells, cities, nx, ny):
+        self.cells = cells
+        self.cities = cities
+        self.nx = nx
+        self.ny = ny
+
+    def __len__(self):
+        return len(self.cities)
+
+    def cities_in(self, grid):
+        """ The cities in the grid cells that are True in the (ny, nx) boolean `grid` """
+        if grid.shape != (self.ny, self.nx):
+            raise ValueError("the city index is for a %sx%s grid, not %sx%s" % (self.nx, self.ny, grid.shape[1], grid.shape[0]))
+        hits = np.asarray(grid, dtype=bool).ravel()[self.cells]
+        return [self.cities[i] for i in np.flatnonzero(hits)]
+
+
+def cell(xy, nx=NX):
+    """ The index in the flattened grid of a "XxY" key """
+    x, y = xy.split('x')
+    return int(y) * nx + int(x)
+
+
+def build(cities, nx=NX, ny=NY):
+    cities = list(cities)
+    cells = np.array([cell(c['xy'], nx) for c in cities], dtype=np.int32)
+    return CityIndex(cells, cities, nx, ny)
+
+
+def build_from_db(psql, nx=NX, ny=NY):
+    cur = psql.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    try:
+        cur.execute("SELECT * FROM worldcities")
+        cities = cur.fetchall()
+    finally:
+        cur.close()
+    # The xy column may still be for another resolution
+    for city in cities:
+        city['xy'] = geo.xy(city['latitude'], city['longitude'])
+    return build(cities, nx, ny)
+
+
+def save(index, path=INDEX_PATH):
+    cities = json.dumps(index.cities, ensure_ascii=False, default=float).encode('utf-8')
+    with utils.replacing(path) as tmp_path, open(tmp_path, 'wb') as f:
+        np.savez(f, cells=index.cells, cities=np.frombuffer(cities, dtype=np.uint8),
+                 shape=np.array([index.ny, index.nx]))
+
+
+def load(path=INDEX_PATH):
+    with np.load(path) as f:
+        ny, nx = f['shape']
+        cities = json.loads(f['cities'].tobytes().decode('utf-8'))
+        return CityIndex(f['cells'], cities, int(nx), int(ny))
+
+
+def get(pool, path=INDEX_PATH):
+    """
+    Load the index, building it from the worldcities table (with a
+    connection from `pool`) the first time, or when it was built for
+    another grid
+    """
+    if os.path.exists(path):
+        index = load(path)
+        if (index.nx, index.ny) == (NX, NY):
+            return index
+    with pool.connection() as psql:
+        index = build_from_db(psql)
+    save(index, path)
+    return index
+
+
+if __name__ == '__main__':
+    from app import pool
+    with pool.connection() as psql:
+        index = build_from_db(psql)
+    save(index)
+    print("%d cities written to %s" % (len(index), INDEX_PATH))
@@ -2,5 +2,9 @@
 cd "$( dirname "${BASH_SOURCE[0]}" )"
 
 # Keep last N files
-KEEP=10
+# (every GFS run gives a forecast folder for each of the FORECAST_HOURS)
+KEEP=30
 rm -rf $(ls static/gfs/20* -dt|tail -n +$KEEP)
+
+# Let the app know which forecasts are left
+python catalog.py
@@ -2,22 +2,18 @@ import json
 import utils
 import csv
 import hashlib
+import city_index
 
-from app import psql
+import psycopg2
 from psycopg2 import ProgrammingError
 
-logger = utils.install_logger()
-
-
-def position_to_point(position):
-    lng = position[0]
-    while lng < 0:
-        lng += 360
-    return (int(lng * 2), int((position[1] - 90) * -2))
+import settings
+from geo import xy
 
+logger = utils.install_logger()
 
-def xy(lat, lng):
-    return "%dx%d" % position_to_point((lng, lat))
+# A script of its own: one connection for all of it
+psql = psycopg2.connect(settings.POSTGRES)
 
 
 def install_schema():
@@ -36,7 +32,7 @@ def save(city):
     cur.execute("INSERT INTO worldcities (id, country, latitude, longitude, xy, name, name_en) SELECT %(id)s, %(country)s, %(latitude)s, %(longitude)s, %(xy)s, %(name)s, %(name_en)s WHERE NOT EXISTS (SELECT 1 FROM worldcities WHERE id = %(id)s)", city)
 
 def fill_db():
-    with open('scrape/cities.txt', 'rU') as f:
+    with open('scrape/cities.txt', 'r', encoding='utf-8') as f:
         for row in f:
             row = row.split(",")
             (country, _unused, name, _code, pop, lat, lng) = row
@@ -63,8 +59,8 @@ def fill_db_cn():
     psql.cursor().execute("DELETE FROM worldcities WHERE country = 'cn'")
     psql.commit()
     #return
-    cn_names = open('scrape/cn_names.txt').read().strip().split("\n")
-    with open('scrape/cn.csv', 'rU') as f:
+    cn_names = open('scrape/cn_names.txt', encoding='utf-8').read().strip().split("\n")
+    with open('scrape/cn.csv', 'r', encoding='utf-8') as f:
         i = 0
         for row in f:
             row = row.strip().split(",")
@@ -87,6 +83,22 @@ def fill_db_cn():
         psql.commit()
         print(f"{i} records inserted.")
 
+# geo.xy, in SQL
+XY_SQL = ("floor(mod(mod(longitude::numeric, 360) + 360, 360) / %(resolution)s)::int || 'x' || "
+          "floor((90 - latitude::numeric) / %(resolution)s)::int")
+
+
+def update_xy():
+    """
+    Set the grid position of every city for the current GFS_RESOLUTION, in
+    one statement. Only the cities placed for another resolution change.
+    """
+    cur = psql.cursor()
+    cur.execute("UPDATE worldcities SET xy = %s WHERE xy IS DISTINCT FROM %s" % (XY_SQL, XY_SQL),
+                {'resolution': settings.GFS_RESOLUTION})
+    logger.info("placed %d cities on the %s degree grid" % (cur.rowcount, settings.GFS_RESOLUTION))
+    psql.commit()
+
 try:
     cur = psql.cursor()
     cur.execute("SELECT * FROM worldcities LIMIT 1")
@@ -96,6 +108,14 @@ except ProgrammingError:
 finally:
     cur.close()
 
-#fill_db()
-#fill_db_ru()
+# The cities of the world with 50000 inhabitants or more. scrape/cities.txt
+# has none for Russia, which come from data/cities.json, with Russian names.
+# The Chinese ones are replaced by those from scrape/cn.csv, with Chinese
+# names. Cities that are in the table already are left as they are.
+fill_db()
+fill_db_ru()
 fill_db_cn()
+update_xy()
+
+# cities.py looks up the cities in this index, so keep it in sync with the table
+city_index.save(city_index.build_from_db(psql))
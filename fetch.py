@@ -1,41 +1,196 @@
 # -*- coding: utf-8 -*-
 
 import os
-from urllib.request import urlopen
-from urllib.error import HTTPError
+import time
+import hashlib
+from http.client import HTTPException
+from urllib.request import Request, urlopen
+from urllib.error import HTTPError, URLError
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 
-from settings import GFS_FOLDER
+from settings import GFS_FOLDER, GFS_RESOLUTION
+import catalog
 from utils import install_logger
 
 logger = install_logger()
 
+# The hours into the future of the forecasts to download, for every GFS run
+try:
+    from settings import FORECAST_HOURS
+except ImportError:
+    FORECAST_HOURS = range(0, 49, 3)
 
-def forecast_url(forecast_delta):
-    """ return list of (slug, url) """
-    now = datetime.utcnow()
-    d = now - timedelta(hours=forecast_delta)
-    d_rounded = d.replace(hour=(d.hour // 6)*6)
-    forecast_hour = ((d.hour % 6 + forecast_delta) // 3) * 3
-    slug = now.strftime("%Y%m%d%H")
-    slug_rounded = d_rounded.strftime("%Y%m%d%%2F%H")
+# How many forecasts to download at the same time
+try:
+    from settings import FETCH_WORKERS
+except ImportError:
+    FETCH_WORKERS = 4
 
-    url = "https://nomads.ncep.noaa.gov/cgi-bin/filter_gfs_0p50.pl?file=gfs.t%sz.pgrb2full.0p50.f%03d&lev_entire_atmosphere_%%5C%%28considered_as_a_single_layer%%5C%%29=on&var_PWAT=on&leftlon=0&rightlon=360&toplat=90&bottomlat=-90&dir=%%2Fgfs.%s" % (d_rounded.strftime("%H"), forecast_hour, slug_rounded)
+# Read downloads in chunks of this many bytes
+CHUNK_SIZE = 64 * 1024
 
+# Seconds to wait for the server
+TIMEOUT = 60
+
+# In every forecast folder: the GFS run its forecast comes from
+RUN_FILE = 'RUN'
+
+# The NOMADS filter for every GFS_RESOLUTION
+NOMADS_URLS = {
+    0.5: "https://nomads.ncep.noaa.gov/cgi-bin/filter_gfs_0p50.pl?file=gfs.t%sz.pgrb2full.0p50.f%03d&lev_entire_atmosphere_%%5C%%28considered_as_a_single_layer%%5C%%29=on&var_PWAT=on&leftlon=0&rightlon=360&toplat=90&bottomlat=-90&dir=%%2Fgfs.%s",
+    0.25: "https://nomads.ncep.noaa.gov/cgi-bin/filter_gfs_0p25.pl?file=gfs.t%sz.pgrb2.0p25.f%03d&lev_entire_atmosphere_%%5C%%28considered_as_a_single_layer%%5C%%29=on&var_PWAT=on&leftlon=0&rightlon=360&toplat=90&bottomlat=-90&dir=%%2Fgfs.%s",
+}
+NOMADS_URL = NOMADS_URLS[GFS_RESOLUTION]
+
+
+def forecast_url(run, forecast_hour):
+    """ return (slug, url) for the forecast `forecast_hour` hours after the GFS run at `run` """
+    slug = (run + timedelta(hours=forecast_hour)).strftime("%Y%m%d%H")
+    url = NOMADS_URL % (run.strftime("%H"), forecast_hour, run.strftime("%Y%m%d%%2F%H"))
     return slug, url
 
+
+def latest_runs(now=None, count=3):
+    """ The times of the last `count` GFS runs, newest first """
+    now = now or datetime.utcnow()
+    run = now.replace(hour=(now.hour // 6) * 6, minute=0, second=0, microsecond=0)
+    return [run - timedelta(hours=6 * i) for i in range(count)]
+
+
+def grib_path(slug):
+    return os.path.join(GFS_FOLDER, slug, "GFS_half_degree.%s.pwat.grib" % slug)
+
+
+def run_path(slug):
+    """ The file that says which GFS run the forecast in folder `slug` comes from """
+    return os.path.join(GFS_FOLDER, slug, RUN_FILE)
+
+
+def fetched_run(slug):
+    """ The GFS run (YYYYMMDDHH) of the forecast we have for `slug`, or None """
+    if not os.path.exists(grib_path(slug)):
+        return None
+    try:
+        with open(run_path(slug)) as f:
+            return f.read().strip()
+    except IOError:
+        # Downloaded before we kept track of the runs
+        return ''
+
+
+def is_complete(path, size=None):
+    """ Whether the GRIB file at `path` is whole: of the expected size, and ending in 7777 """
+    if os.path.getsize(path) < 8 or (size is not None and os.path.getsize(path) != size):
+        return False
+    with open(path, 'rb') as f:
+        if f.read(4) != b'GRIB':
+            return False
+        f.seek(-4, os.SEEK_END)
+        return f.read(4) == b'7777'
+
+
+def download(url, path):
+    """
+    Download `url` to `path`, streaming it to disk in chunks.
+
+    The data goes to a `.part` file first, which is only renamed to `path`
+    once it is complete. When a download is interrupted, the `.part` file
+    stays, and the next download of the same url asks the server for the
+    rest only.
+    Returns True on success.
+    """
+    folder = os.path.dirname(path)
+    if not os.path.exists(folder):
+        os.makedirs(folder, exist_ok=True)
+    part_path = "%s.%s.part" % (path, hashlib.md5(url.encode('utf-8')).hexdigest()[:8])
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+
+    request = Request(url)
+    if offset:
+        request.add_header('Range', 'bytes=%d-' % offset)
+    try:
+        logger.debug("retrieving file %s" % url)
+        res = urlopen(request, timeout=TIMEOUT)
+    except HTTPError as e:
+        if e.code == 416 and is_complete(part_path):
+            # We had it all already
+            os.rename(part_path, path)
+            return True
+        logger.debug("uri error {}: {}".format(url, e))
+        return False
+    except (URLError, OSError) as e:
+        logger.debug("uri error {}: {}".format(url, e))
+        return False
+
+    if res.status == 206 and res.headers.get('Content-Range', '').startswith('bytes %d-' % offset):
+        logger.debug("resuming file %s at %d bytes" % (path, offset))
+        mode = 'ab'
+    else:
+        offset = 0
+        mode = 'wb'
+    length = res.headers.get('Content-Length')
+    size = offset + int(length) if length is not None else None
+
+    start = time.time()
+    received = 0
+    try:
+        with open(part_path, mode) as f:
+            logger.debug("writing file %s" % path)
+            while True:
+                chunk = res.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                f.write(chunk)
+                received += len(chunk)
+    except (OSError, HTTPException) as e:
+        logger.debug("download of {} interrupted after {} bytes: {}".format(url, offset + received, e))
+        return False
+    finally:
+        res.close()
+    seconds = time.time() - start
+    logger.debug("received %d bytes in %.2fs (%.0f KB/s)" % (received, seconds, received / 1024. / max(seconds, 0.001)))
+
+    if not is_complete(part_path, size):
+        if size is not None and os.path.getsize(part_path) < size:
+            logger.debug("download of %s incomplete, keeping it to resume later" % url)
+        else:
+            logger.error("%s is not a complete GRIB file, throwing it away" % url)
+            os.remove(part_path)
+        return False
+    os.rename(part_path, path)
+    return True
+
+
+def fetch_forecast(run, slug, url):
+    """
+    Download the forecast for `slug` of the GFS run at `run`. It takes the
+    place of a forecast of an older run for the same time: what water.py
+    and cities.py made of that one goes, so they process the new one.
+    """
+    path = grib_path(slug)
+    if not download(url, path):
+        return False
+    folder = os.path.dirname(path)
+    for name in os.listdir(folder):
+        if name != os.path.basename(path):
+            os.remove(os.path.join(folder, name))
+    with open(run_path(slug), 'w') as f:
+        f.write(run.strftime("%Y%m%d%H"))
+    return True
+
 """
 This is the code that serves to download the raw precipitation data.
 
 Run it as such: python fetch.py
 
-It tries to find the most recent GRIB file as available from the
+It tries to find the most recent GRIB files as available from the
 Global Forecast System.
 
 No dependencies outside the Python Standard Library
 """
 
-def fetch_gfs():
+def fetch_gfs(now=None):
     """
     Download the latest weather forecast from the Global Forecast System.
     There are some 300 different tables in the GFS data, so we ask it to
@@ -44,36 +199,42 @@ def fetch_gfs():
     The GFS data is produced every six hours. It contains information about
     the current weather situation and for 3, 6, 9, 12 etc. hours into
     the future. Because the GFS is not immediately available (in general
-    several hours after the time indicated as ‘now’), we use the predictions
-    of 6 hours and 9 hours into the future. This way we have a time point for
-    every 3 hours.
+    several hours after the time indicated as ‘now’), we look for the latest
+    run that is, and download its forecasts for every hour in FORECAST_HOURS,
+    several at the same time. Each forecast is kept in a folder named after
+    the time it is for, and replaces the forecast of an older run for that
+    time.
+
+    Forecasts we have already of this run are not downloaded again. Returns
+    the slugs of the forecasts it downloaded.
     """
+    for run in latest_runs(now):
+        urls = [forecast_url(run, hour) for hour in FORECAST_HOURS]
+        # Forecasts we do not have, or only of an older run
+        missing = [(slug, url) for slug, url in urls if fetched_run(slug) is None or
+                   fetched_run(slug) < run.strftime("%Y%m%d%H")]
+
+        if not missing:
+            # There is no need to continue looking, as we have these files already,
+            # and apparently they are the most recent forecast.
+            logger.debug("the forecasts of the GFS run of %s exist already" % run)
+            return []
+
+        # Check whether this run is available at all, with the first forecast we miss
+        slug, url = missing.pop(0)
+        if not fetch_forecast(run, slug, url):
+            continue
+        fetched = [slug]
 
-    urls = [forecast_url(0), forecast_url(6)]
-
-    for slug, url in urls:
-        target_folder = os.path.join(GFS_FOLDER, slug)
-        output_file = os.path.join(target_folder, "GFS_half_degree.%s.pwat.grib" % slug)
-
-        if os.path.exists(output_file):
-            # There is no need to continue looking, as we have this file already,
-            # and apparently it is the most recent forecast.
-            logger.debug("file %s exists already" % output_file)
-            break
+        with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as pool:
+            results = pool.map(lambda d: fetch_forecast(run, d[0], d[1]), missing)
+            fetched.extend(slug for (slug, url), succeeded in zip(missing, results) if succeeded)
 
-        res = None
-        try:
-            logger.debug("retrieving file %s" % url)
-            res = urlopen(url)
-        except HTTPError as e:
-            logger.debug("uri error {}: {}".format(url, e))
-            continue
+        logger.debug("downloaded %d of %d forecasts of the GFS run of %s" % (len(fetched), len(urls), run))
+        return fetched
 
-        if not os.path.exists(target_folder):
-            os.makedirs(target_folder)
-        with open(output_file, 'wb') as f:
-            logger.debug("writing file %s" % output_file)
-            f.write(res.read())
+    return []
 
 if __name__ == '__main__':
     fetch_gfs()
+    catalog.publish(GFS_FOLDER)
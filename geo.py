@@ -59,12 +59,20 @@ def px2deg(x, y, zoom=4):
 These functions deal with the data we get from the Global Forecast system:
 
 the grids origin 0.0E, 90.0N
-distance between grid points: 0.5 deg lon, 0.5 deg lat
-number of grid points W-E: 720, N-S: 361
+distance between grid points: GFS_RESOLUTION deg lon, GFS_RESOLUTION deg lat
+number of grid points W-E: 720, N-S: 361 (for 0.5 degrees)
 """
 
+def grid_size(resolution=GFS_RESOLUTION):
+    """ The number of grid points (W-E, N-S) """
+    return (int(round(360 / resolution)), int(round(180 / resolution)) + 1)
+
 def point_to_position(point):
-    return (int(point[0] * .5), int(point[1] * -.5 + 90))
+    return (int(point[0] * GFS_RESOLUTION), int(point[1] * -GFS_RESOLUTION + 90))
 
 def position_to_point(position):
-    return (int(position[0] * 2), int((position[1] - 90) * -2))
+    return (int((position[0] % 360) / GFS_RESOLUTION), int((position[1] - 90) / -GFS_RESOLUTION))
+
+def xy(lat, lng):
+    """ The key of the grid point of a city, as in the xy column of the worldcities table """
+    return "%dx%d" % position_to_point((float(lng), float(lat)))
@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+
+"""
+Read the precipitable water field out of a GFS GRIB2 file.
+
+NOMADS sends us a GRIB2 file with a single message: the PWAT values on a
+regular latitude/longitude grid. Instead of converting it to JSON with the
+`grib2json` Java utility, we decode the message here, straight into a
+float32 array of shape (ny, nx), rows running from north to south.
+
+Supported are the grid definition template 3.0 (regular lat/lon) and the
+data representation templates 5.0 (simple packing), 5.2 (complex packing)
+and 5.3 (complex packing with spatial differencing), which is what the GFS
+uses. Anything else raises a GribError, so that the caller can fall back to
+`grib2json`.
+
+The header is a dictionary with the same field names grib2json uses
+(lo1, la1, dx, dy, nx, ny, ...), so code written against the JSON output
+keeps working.
+
+The GRIB format is documented at:
+http://www.nco.ncep.noaa.gov/pmb/docs/grib2/grib2_doc/
+"""
+
+import os
+import json
+import struct
+import subprocess
+
+import numpy as np
+
+import utils
+
+
+# Unpack this many values at a time
+CHUNK_SIZE = 64 * 1024
+
+
+class GribError(Exception):
+    pass
+
+
+def _signed(value, nbytes):
+    """ GRIB2 stores negative integers as sign and magnitude """
+    sign_bit = 1 << (nbytes * 8 - 1)
+    if value & sign_bit:
+        return -(value & (sign_bit - 1))
+    return value
+
+
+def _uint(buf, start, nbytes):
+    return int.from_bytes(buf[start:start + nbytes], 'big')
+
+
+def _int(buf, start, nbytes):
+    return _signed(_uint(buf, start, nbytes), nbytes)
+
+
+def _unpack_bits(buf, bit_offset, widths):
+    """
+    Read consecutive unsigned integers of the given bit widths from `buf`,
+    starting at `bit_offset`. `widths` is an array with one width per value
+    (at most 32 bits each); a width of 0 reads as 0.
+
+    The values are read CHUNK_SIZE at a time, which keeps the temporary
+    arrays small for the larger grids.
+    """
+    widths = np.asarray(widths, dtype=np.int64)
+    values = np.zeros(len(widths), dtype=np.int64)
+    if len(widths) == 0:
+        return values
+    ends = bit_offset + np.cumsum(widths)
+    padded = np.zeros(len(buf) + 8, dtype=np.uint8)
+    padded[:len(buf)] = np.frombuffer(buf, dtype=np.uint8)
+    for i in range(0, len(widths), CHUNK_SIZE):
+        chunk_widths = widths[i:i + CHUNK_SIZE]
+        starts = ends[i:i + CHUNK_SIZE] - chunk_widths
+        first_byte = starts // 8
+        # eight bytes from the first byte of every value, as one big-endian integer
+        words = padded[first_byte[:, np.newaxis] + np.arange(8)].view('>u8')[:, 0].astype(np.uint64)
+        shift = np.where(chunk_widths > 0, 64 - (starts % 8) - chunk_widths, 0).astype(np.uint64)
+        mask = ((np.uint64(1) << chunk_widths.astype(np.uint64)) - np.uint64(1)).astype(np.uint64)
+        values[i:i + CHUNK_SIZE] = (words >> shift) & mask
+    return values
+
+
+def _sections(message):
+    """ Return a dictionary of section number → section bytes """
+    if message[:4] != b'GRIB':
+        raise GribError("not a GRIB file")
+    if message[7] != 2:
+        raise GribError("GRIB edition %s is not supported" % message[7])
+    total_length = _uint(message, 8, 8)
+    sections = {0: message[:16]}
+    position = 16
+    while position < total_length:
+        if message[position:position + 4] == b'7777':
+            break
+        length = _uint(message, position, 4)
+        number = message[position + 4]
+        if number in sections:
+            raise GribError("only files with a single GRIB message are supported")
+        sections[number] = message[position:position + length]
+        position += length
+    for number in (3, 5, 7):
+        if number not in sections:
+            raise GribError("section %s missing" % number)
+    return sections
+
+
+def _grid(section):
+    """ Header fields of grid definition template 3.0 (regular lat/lon) """
+    template = _uint(section, 12, 2)
+    if template != 0:
+        raise GribError("grid definition template 3.%s is not supported" % template)
+    basic_angle = _uint(section, 38, 4)
+    subdivisions = _uint(section, 42, 4)
+    unit = 1e-6
+    if basic_angle not in (0, 0xffffffff) and subdivisions not in (0, 0xffffffff):
+        unit = float(basic_angle) / subdivisions
+    return {
+        'nx': _uint(section, 30, 4),
+        'ny': _uint(section, 34, 4),
+        'la1': _int(section, 46, 4) * unit,
+        'lo1': _int(section, 50, 4) * unit,
+        'la2': _int(section, 55, 4) * unit,
+        'lo2': _int(section, 59, 4) * unit,
+        'dx': _uint(section, 63, 4) * unit,
+        'dy': _uint(section, 67, 4) * unit,
+        'scanMode': section[71],
+    }
+
+
+def _complex_values(data, n, nbits, ng, group_width_ref, group_width_bits,
+                    group_length_ref, group_length_increment, last_group_length,
+                    group_length_bits, spatial_order, extra_octets):
+    """ Integer values packed with template 5.2 or 5.3, before scaling """
+    bit = 0
+    first_values = []
+    overall_min = 0
+    if spatial_order:
+        for i in range(spatial_order):
+            first_values.append(_int(data, i * extra_octets, extra_octets))
+        overall_min = _int(data, spatial_order * extra_octets, extra_octets)
+        bit = (spatial_order + 1) * extra_octets * 8
+
+    def octet_aligned(bit):
+        return (bit + 7) // 8 * 8
+
+    group_refs = _unpack_bits(data, bit, np.full(ng, nbits))
+    bit = octet_aligned(bit + ng * nbits)
+    group_widths = _unpack_bits(data, bit, np.full(ng, group_width_bits)) + group_width_ref
+    bit = octet_aligned(bit + ng * group_width_bits)
+    group_lengths = _unpack_bits(data, bit, np.full(ng, group_length_bits)) * group_length_increment + group_length_ref
+    group_lengths[-1] = last_group_length
+    bit = octet_aligned(bit + ng * group_length_bits)
+
+    if group_lengths.sum() != n:
+        raise GribError("group lengths do not add up to the number of data points")
+
+    values = _unpack_bits(data, bit, np.repeat(group_widths, group_lengths))
+    values += np.repeat(group_refs, group_lengths)
+
+    if spatial_order == 1:
+        values[0] = first_values[0]
+        values[1:] += overall_min
+        values = np.cumsum(values)
+    elif spatial_order == 2:
+        # the second differences add up to the first differences,
+        # which add up to the values
+        differences = values.copy()
+        differences[0] = first_values[0]
+        differences[1] = first_values[1] - first_values[0]
+        differences[2:] += overall_min
+        values = np.cumsum(np.cumsum(differences[1:]))
+        values = np.concatenate(([first_values[0]], values + first_values[0]))
+    return values
+
+
+def _values(section5, section6, section7, nx, ny):
+    """ Decode the data section into a flat float64 array """
+    n = _uint(section5, 5, 4)
+    template = _uint(section5, 9, 2)
+    if template not in (0, 2, 3):
+        raise GribError("data representation template 5.%s is not supported" % template)
+    if section6 is not None and section6[5] != 255:
+        raise GribError("bitmaps are not supported")
+    if n != nx * ny:
+        raise GribError("expected %s data points, found %s" % (nx * ny, n))
+
+    reference = struct.unpack('>f', section5[11:15])[0]
+    binary_scale = _int(section5, 15, 2)
+    decimal_scale = _int(section5, 17, 2)
+    nbits = section5[19]
+    data = bytes(section7[5:])
+
+    if nbits == 0:
+        values = np.zeros(n, dtype=np.int64)
+    elif template == 0:
+        values = _unpack_bits(data, 0, np.full(n, nbits))
+    else:
+        if section5[22] != 0:
+            raise GribError("missing value management is not supported")
+        spatial_order = 0
+        extra_octets = 0
+        if template == 3:
+            spatial_order = section5[47]
+            extra_octets = section5[48]
+            if spatial_order not in (1, 2):
+                raise GribError("order %s of spatial differencing is not supported" % spatial_order)
+        values = _complex_values(data, n, nbits,
+                                 ng=_uint(section5, 31, 4),
+                                 group_width_ref=section5[35],
+                                 group_width_bits=section5[36],
+                                 group_length_ref=_uint(section5, 37, 4),
+                                 group_length_increment=section5[41],
+                                 last_group_length=_uint(section5, 42, 4),
+                                 group_length_bits=section5[46],
+                                 spatial_order=spatial_order,
+                                 extra_octets=extra_octets)
+
+    return (reference + values * 2.0 ** binary_scale) / 10.0 ** decimal_scale
+
+
+def decode(path):
+    """
+    Decode the GRIB2 file at `path`.
+    Returns a tuple (header, data), data being a float32 array of (ny, nx).
+    """
+    with open(path, 'rb') as f:
+        sections = _sections(memoryview(f.read()))
+
+    header = _grid(sections[3])
+    nx, ny = header['nx'], header['ny']
+    if header['scanMode'] & 0x20:
+        raise GribError("column-major scanning is not supported")
+
+    data = _values(sections[5], sections.get(6), sections[7], nx, ny)
+    data = data.astype(np.float32).reshape(ny, nx)
+
+    # Rows run from north to south, and columns from west to east
+    if header['scanMode'] & 0x40:
+        data = data[::-1]
+        header['la1'], header['la2'] = header['la2'], header['la1']
+    if header['scanMode'] & 0x80:
+        data = data[:, ::-1]
+        header['lo1'], header['lo2'] = header['lo2'], header['lo1']
+    header['scanMode'] = 0
+
+    return header, np.ascontiguousarray(data)
+
+
+def cache_path(path):
+    return os.path.splitext(path)[0] + '.npy'
+
+
+def header_path(path):
+    return os.path.splitext(path)[0] + '.header.json'
+
+
+def load(path):
+    """
+    Like `decode`, but keeps the decoded grid next to the GRIB file as a
+    .npy file, which later calls map into memory instead of decoding again,
+    and its header (north to south, west to east, like the grid) as JSON.
+    """
+    npy_path = cache_path(path)
+    json_path = header_path(path)
+    if os.path.exists(npy_path) and os.path.exists(json_path) and \
+            os.path.getmtime(npy_path) >= os.path.getmtime(path):
+        with open(json_path) as f:
+            header = json.load(f)
+        return header, np.load(npy_path, mmap_mode='r')
+
+    header, data = decode(path)
+    with utils.replacing(json_path) as tmp_path, open(tmp_path, 'w') as f:
+        json.dump(header, f)
+    # The .npy file last: once it is there, so is the header
+    with utils.replacing(npy_path) as tmp_path, open(tmp_path, 'wb') as f:
+        np.save(f, data)
+    return header, data
+
+
+def load_with_grib2json(grib2json, path, json_path):
+    """
+    Decode the GRIB file by way of the `grib2json` utility, which writes
+    the JSON file `json_path`. Returns a tuple (header, data), like `load`.
+    """
+    if not os.path.exists(json_path):
+        try:
+            pipe = subprocess.Popen([grib2json, '-d', '-n', '-o', json_path, path])
+        except OSError:
+            raise GribError("`grib2json` executable not found")
+        if pipe.wait() != 0:
+            raise GribError("error in JSON conversion")
+
+    with open(json_path) as f:
+        j = json.loads(f.read())
+
+    header = j[0]['header']
+    data = np.array(j[0]['data'], dtype=np.float32).reshape(header['ny'], header['nx'])
+    return header, data
@@ -1,12 +1,15 @@
 import os
+import re
 import json
 from functools import wraps
-from flask import Flask, send_from_directory, redirect, render_template, request, Response, jsonify
+from flask import Flask, send_from_directory, redirect, render_template, request, Response, jsonify, abort
 import pymongo
 import datetime
 
 # Local imports
 import settings
+import layers
+import rainbowmask
 from app import app, db
 
 
@@ -41,14 +44,30 @@ def build():
     @app.route("/hq/gfs/<string:slug>")
     @requires_auth
     def hq_slug(slug):
-        return render_template("hq_slug.html", slug=slug)
+        rainbow_cells = None
+        try:
+            rainbow_cells = rainbowmask.load(rainbowmask.path_for(os.path.join(settings.GFS_FOLDER, slug), slug)).count()
+        except IOError:
+            pass
+        return render_template("hq_slug.html", slug=slug, rainbow_cells=rainbow_cells)
+
+    @app.route("/hq/gfs/<string:slug>/<string:filename>")
+    @requires_auth
+    def hq_debug_image(slug, filename):
+        if not re.match(r'^\d{10}$', slug):
+            abort(404)
+        folder = os.path.join(settings.GFS_FOLDER, slug)
+        path = layers.render_debug_image(folder, slug, filename)
+        if path is None:
+            abort(404)
+        return send_from_directory(folder, filename)
 
     @app.route("/hq/")
     @requires_auth
     def hq():
         logs = db.log.find(limit=500).sort("$natural", pymongo.DESCENDING)
         forecasts = settings.get_forecast_info()
-        gfs = sorted(os.listdir(settings.GFS_FOLDER))
+        gfs = sorted(f.slug for f in settings.get_catalog().forecasts())
         return render_template("hq.html", logs=logs, forecasts=forecasts, gfs=gfs)
 
     @app.route("/hq/moderate")
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+
+"""
+The image operations of the rainbow algorithm, on numpy arrays.
+
+find_rainclouds used to build every layer as a PIL image, pixel by pixel.
+These functions derive the same layers from the precipitable water grid
+with array operations, as (ny, nx) uint8 arrays. They reproduce the PIL
+operations exactly, so the PNG files written from them do not change:
+
+- putdata clips integers to 0-255
+- ImageEnhance.Contrast(image).enhance(f) blends the image with its mean:
+  mean + f * (pixel - mean), clipped to 0-255
+- ImageOps.invert is 255 - pixel
+- ImageChops.offset wraps the image around, like numpy.roll
+- pasting an image through a black and white mask copies the pixels where
+  the mask is white
+
+All layer functions also take a stack of forecasts, as (n, ny, nx) arrays,
+so that several forecast hours can be processed in one pass.
+
+The intermediary layers are kept in a bundle next to the final images: the
+black and white layers as bits, the grey ones deflated at the fastest level. The debug images that HQ shows are only drawn from this bundle
+when they are asked for (or right away, with SAVE_DEBUG_IMAGES = True).
+"""
+
+import os
+import zipfile
+from collections import namedtuple
+
+import numpy as np
+from PIL import Image
+
+import barrel
+import utils
+
+CONTRAST = 80
+THRESHOLD = 191
+
+# The debug images, and the layers they show
+DEBUG_IMAGES = [
+    ("GFS_half_degree.clouds_greyscale.%s.pwat.png", 'greyscale'),
+    ("GFS_half_degree.sun_mask.%s.pwat.png", 'sun_mask'),
+    ("GFS_half_degree.cloud_mask.%s.pwat.not-inverted.png", 'not_inverted'),
+    ("GFS_half_degree.cloud_mask.extruded.%s.pwat.png", 'extruded'),
+    ("GFS_half_degree.%s.pwat.without-sun-mask.png", 'without_sun_mask'),
+    # We stopped masking out everything but Russia, so this is the same as greymasked
+    ("GFS_half_degree.clouds_greymasked.before_russia.%s.pwat.png", 'greymasked'),
+    ("GFS_half_degree.clouds_greymasked.%s.pwat.png", 'greymasked'),
+]
+
+# The layers that are only 0 or 255, which the bundle keeps as bits
+BINARY_LAYERS = {'sun_mask', 'not_inverted', 'extruded', 'without_sun_mask'}
+
+CloudLayers = namedtuple('CloudLayers', ['greyscale', 'alpha', 'clouds'])
+RainbowLayers = namedtuple('RainbowLayers', ['not_inverted', 'extruded', 'without_sun_mask', 'rainbows', 'greymasked'])
+
+
+def _clip(values):
+    """ Truncate and clip float values in place, and return them as uint8 """
+    np.trunc(values, out=values)
+    np.clip(values, 0, 255, out=values)
+    return values.astype(np.uint8)
+
+
+def prec2color(data):
+    """ Greyscale value for the precipitable water: 255 is dry, darker is wetter """
+    values = np.multiply(data, 3, dtype=np.float64)
+    return _clip(np.subtract(255, values, out=values))
+
+
+def prec2alpha(data):
+    """ Opacity for the precipitable water: transparent where dry """
+    values = np.multiply(data, 6, dtype=np.float64)
+    np.subtract(255, values, out=values)
+    return _clip(np.subtract(255, values, out=values))
+
+
+def _means(layer):
+    """ The mean of every (ny, nx) layer, rounded as PIL does """
+    rows, columns = layer.shape[-2:]
+    sums = layer.reshape(-1, rows * columns).sum(axis=1, dtype=np.int64)
+    return (sums / float(rows * columns) + 0.5).astype(np.int64)
+
+
+def _contrast_table(mean, factor=CONTRAST):
+    """ What enhancing the contrast does to each of the 256 grey levels """
+    return np.clip(mean + factor * (np.arange(256, dtype=np.int64) - mean), 0, 255).astype(np.uint8)
+
+
+def enhance_contrast(layer, factor=CONTRAST):
+    """ The contrast is relative to the mean of every (ny, nx) layer """
+    enhanced = np.empty_like(layer)
+    for i, mean in np.ndenumerate(_means(layer).reshape(layer.shape[:-2])):
+        enhanced[i] = _contrast_table(mean, factor)[layer[i]]
+    return enhanced
+
+
+def cloud_layers(data):
+    """
+    From the precipitable water grid, calculate the greyscale image, its
+    alpha channel, and the cloud mask: 0 where it rains, 255 elsewhere.
+    """
+    if np.ndim(data) == 3:
+        # one forecast at a time: the float arrays of a whole stack do not fit in the CPU cache
+        greyscale = np.stack([prec2color(layer) for layer in data])
+        alpha = np.stack([prec2alpha(layer) for layer in data])
+    else:
+        greyscale = prec2color(data)
+        alpha = prec2alpha(data)
+    # enhancing the contrast and thresholding, as one lookup per grey level
+    clouds = np.empty_like(greyscale)
+    for i, mean in np.ndenumerate(_means(greyscale).reshape(greyscale.shape[:-2])):
+        table = np.where(_contrast_table(mean) > THRESHOLD, 255, 0).astype(np.uint8)
+        clouds[i] = table[greyscale[i]]
+    return CloudLayers(greyscale, alpha, clouds)
+
+
+def roll_columns(stack, shifts):
+    """ np.roll along the columns, by a different shift for every layer of the stack """
+    rolled = np.empty_like(stack)
+    for i, shift in enumerate(shifts):
+        rolled[i] = np.roll(stack[i], shift, axis=1)
+    return rolled
+
+
+def rainbow_layers(clouds, sun_mask, sun_x, sun_y):
+    """
+    Combine the clouds with the sun: extrude the clouds away from the sun,
+    keep only what the extrusion adds, and mask out where the sun is not
+    between 0 and 42 degrees. In the `rainbows` layer, rainbows are black.
+
+    For a stack of forecasts, `sun_x` and `sun_y` hold the sun of every one.
+
+    The cloud mask and the sun mask are all 0 or 255, and so are the layers
+    made from them: making a pixel white where another layer is white is a
+    bitwise or.
+    """
+    if clouds.clouds.ndim == 2:
+        stacked = rainbow_layers(CloudLayers(*(layer[np.newaxis] for layer in clouds)),
+                                 sun_mask[np.newaxis], [sun_x], [sun_y])
+        return RainbowLayers(*(layer[0] for layer in stacked))
+
+    n, nj, ni = clouds.clouds.shape
+    sun_x = np.asarray(sun_x)
+    sun_y = np.asarray(sun_y)
+    translate_x = ni // 2 - sun_x
+
+    # The sun pixel itself is never masked out
+    sun_mask = sun_mask.copy()
+    sun_mask[np.arange(n), sun_y, sun_x] = 255
+    # white where it is night, or where the sun is too high
+    night = ~sun_mask
+
+    # Move the sun exactly to the middle, and invert
+    inverted = ~roll_columns(clouds.clouds, translate_x)
+    extruded = ~barrel.distort(inverted, sun_y)
+    inverted |= extruded
+
+    # Move the image back to its original position
+    without_sun_mask = roll_columns(inverted, -translate_x)
+    rainbows = without_sun_mask | night
+
+    greymasked = clouds.greyscale | clouds.clouds
+    greymasked |= night
+
+    return RainbowLayers(clouds.clouds, extruded, without_sun_mask, rainbows, greymasked)
+
+
+def debug_layers_path(folder, slug):
+    return os.path.join(folder, "GFS_half_degree.%s.layers.npz" % slug)
+
+
+def save_debug_layers(folder, slug, **arrays):
+    """ Keep the intermediary layers of a forecast, to draw the debug images from """
+    path = debug_layers_path(folder, slug)
+    # np.load reads this as it read np.savez_compressed, which deflated at level 6, more than twice as slowly
+    with utils.replacing(path) as tmp_path, \
+            zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_DEFLATED, compresslevel=1) as bundle:
+        for name, layer in arrays.items():
+            if name in BINARY_LAYERS:
+                name, layer = name + '.bits', _pack(layer)
+            with bundle.open(name + '.npy', 'w', force_zip64=True) as f:
+                np.lib.format.write_array(f, np.asanyarray(layer))
+
+
+def _pack(layer):
+    """ A 0/255 layer as bits, with its shape in front """
+    return np.concatenate([np.array(layer.shape, dtype='>u4').view(np.uint8),
+                           np.packbits(layer.ravel() != 0)])
+
+
+def _unpack(bits):
+    """ The 0/255 layer that _pack packed """
+    shape = tuple(bits[:8].view('>u4'))
+    return np.unpackbits(bits[8:], count=shape[0] * shape[1]).reshape(shape) * np.uint8(255)
+
+
+def render_debug_image(folder, slug, filename):
+    """
+    Draw the debug image `filename` of a forecast from its layer bundle,
+    unless it exists already. Returns the path of the image, or None if
+    it is not a debug image or the layers are not there.
+    """
+    path = os.path.join(folder, filename)
+    if os.path.exists(path):
+        return path
+    layer = dict((pattern % slug, name) for pattern, name in DEBUG_IMAGES).get(filename)
+    layers_path = debug_layers_path(folder, slug)
+    if layer is None or not os.path.exists(layers_path):
+        return None
+    with np.load(layers_path) as bundle:
+        if layer in bundle.files:
+            image = Image.fromarray(bundle[layer])
+        elif layer + '.bits' in bundle.files:
+            image = Image.fromarray(_unpack(bundle[layer + '.bits']))
+        else:
+            return None
+    with utils.replacing(path) as tmp_path:
+        image.save(tmp_path, format="PNG")
+    return path
@@ -7,57 +7,180 @@ import time
 import datetime
 import glob
 import requests
-import psycopg2.extras
 import base64
+import hashlib
 
 # Dependencies: Flask + PIL or Pillow
+import flask
 from flask import request, jsonify, abort
 from werkzeug import secure_filename
+from werkzeug.wsgi import wrap_file
 
 # Local imports
 import settings
+import caches
+import variants
+import uploads
+import pagination
+import payloads
+import city_index
+import nearby
 import hq
 import utils
 
-from app import app, cache, db, psql
+from app import app, cache, db, pool
 
 logger = utils.install_logger()
 
+# Seconds to keep the latest photo, in the other processes than the one it was uploaded to
+try:
+    from settings import LATEST_PHOTO_TTL
+except ImportError:
+    LATEST_PHOTO_TTL = 30
+
+# How long the app and proxies may use a response before asking again (with its ETag)
+RAINBOW_CITIES_CACHE_CONTROL = 'public, max-age=60'
+PHOTOS_CACHE_CONTROL = 'public, max-age=30'
+USER_PHOTOS_CACHE_CONTROL = 'private, no-cache'
+
+
+def latest_redirect(url):
+    """ Redirect to the latest version of a file, or 404 while no forecast has it """
+    if url is None:
+        abort(404)
+    return utils.nocache_redirect(url)
+
 
 @app.route("/latest/rainbow_cities.json")
 def latest_rainbow_cities():
-    return utils.nocache_redirect(settings.get_latest_rainbow_cities_url())
+    return latest_redirect(settings.get_latest_rainbow_cities_url())
 
 
 @app.route("/latest/rainbows.json")
 def latest_rainbows():
-    return utils.nocache_redirect(settings.get_latest_rainbows_url())
+    return latest_redirect(settings.get_latest_rainbows_url())
+
+
+@app.route("/latest/rainbows.mask")
+def latest_rainbows_mask():
+    return latest_redirect(settings.get_latest_rainbows_mask_url())
 
 
 @app.route("/latest/clouds.json")
 def latest_clouds():
-    return utils.nocache_redirect(settings.get_latest_clouds_url())
+    return latest_redirect(settings.get_latest_clouds_url())
 
 
 @app.route("/app/old-rainbow-cities")
 @cache.cached(timeout=60)
 def get_rainbow_cities():
-    path = os.path.abspath(os.path.join(os.path.dirname(__file__), settings.get_latest_rainbow_cities_url()[1:]))
+    url = settings.get_latest_rainbow_cities_url()
+    if url is None:
+        abort(404)
+    path = os.path.abspath(os.path.join(os.path.dirname(__file__), url[1:]))
     return jsonify(dict(cities=json.loads(open(path).read())))
 
-@app.route("/app/rainbow-cities")
-def get_latest_rainbow_cities():
-    result = []
-    if os.path.exists(settings.GFS_FOLDER + "/rainbow_cities.json"):
-        result = json.loads(open(settings.GFS_FOLDER + "/rainbow_cities.json", "r").read())
 
+def load_rainbow_cities(path):
+    """ The first 20 rainbow cities, as the pipeline wrote them to be sent, and their version """
+    with open(path, "rb") as f:
+        body = f.read()
+    return payloads.cities_list(body), hashlib.sha1(body).hexdigest()[:16]
+
+
+def load_unpublished_rainbow_cities(path):
+    """ The same, from rainbow_cities.json, for as long as the pipeline has not written cities.json """
+    with open(path, "rb") as f:
+        body = payloads.cities_body(json.loads(f.read().decode('utf-8')))
+    return payloads.cities_list(body), hashlib.sha1(body).hexdigest()[:16]
+
+
+def photo_version(photo):
+    """ What changes in the JSON of a photo after it has been uploaded """
+    return "%s:%s" % (photo['id'], photo.get('variants_status', variants.READY))
+
+
+def photos_etag(photos, next_token):
+    versions = "|".join([photo_version(p) for p in photos] + [next_token or ''])
+    return hashlib.sha1(versions.encode('utf-8')).hexdigest()
+
+
+def find_latest_photo():
     photos = [p for p in db.photos.find().sort('created', pymongo.DESCENDING).limit(1)]
-    photo = len(photos) > 0 and map_photo(photos[0]) or None
+    return len(photos) > 0 and map_photo(photos[0]) or None
+
+
+# The rainbow cities change once per pipeline run, the latest photo with every upload
+rainbow_cities = caches.FileCache(payloads.CITIES_PATH, load_rainbow_cities)
+unpublished_rainbow_cities = caches.FileCache(payloads.RAINBOW_CITIES_PATH, load_unpublished_rainbow_cities,
+                                              default=("[]", "none"))
+latest_photo = caches.TTLCache(LATEST_PHOTO_TTL, find_latest_photo)
+
+# Resizes the uploaded photos after the upload has returned
+variant_pool = variants.VariantPool(db.photos, on_ready=lambda photo_id: latest_photo.invalidate())
+
+
+def current_rainbow_cities():
+    """ (cities, version) of the rainbow cities to show """
+    return rainbow_cities.get() or unpublished_rainbow_cities.get()
+
+
+def shown_photo():
+    """ The latest photo, if it is less than 4 hours old """
+    photo = latest_photo.get()
     if photo:
         d = datetime.datetime.utcnow() - photo['created']
         if d.days > 0 or d.seconds > 4 * 3600:
             photo = None
-    return jsonify(dict(cities=result[:20], last_photo=photo))
+    return photo
+
+
+@app.route("/app/rainbow-cities")
+def get_latest_rainbow_cities():
+    photo = shown_photo()
+    cities, version = current_rainbow_cities()
+    etag = "%s.%s" % (version, photo_version(photo) if photo else "-")
+
+    def build():
+        body = '{"cities": %s, "last_photo": %s}' % (cities, flask.json.dumps(photo))
+        return app.response_class(body, mimetype='application/json')
+    return utils.etag_response(etag, RAINBOW_CITIES_CACHE_CONTROL, build)
+
+
+@app.route("/app/cities")
+def get_cities():
+    """ The cities of /app/rainbow-cities, sent as the pipeline wrote them, compressed if the client accepts it """
+    try:
+        stat = os.stat(payloads.CITIES_PATH)
+    except OSError:
+        # Not written yet: make it from rainbow_cities.json
+        cities, version = unpublished_rainbow_cities.get()
+        body = payloads.CITIES_PREFIX + cities.encode('utf-8') + payloads.CITIES_SUFFIX
+        return utils.etag_response(version, RAINBOW_CITIES_CACHE_CONTROL,
+                                   lambda: app.response_class(body, mimetype='application/json'))
+    path, encoding = payloads.choose(payloads.CITIES_PATH, request.accept_encodings)
+    # Every encoding is a different response
+    etag = "%x-%x-%s" % (stat.st_mtime_ns, stat.st_size, encoding or "identity")
+
+    def build():
+        f = open(path, 'rb')
+        response = app.response_class(wrap_file(request.environ, f), mimetype='application/json',
+                                      direct_passthrough=True)
+        response.content_length = os.fstat(f.fileno()).st_size
+        if encoding:
+            response.content_encoding = encoding
+        return response
+    response = utils.etag_response(etag, RAINBOW_CITIES_CACHE_CONTROL, build)
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+@app.route("/app/last-photo")
+def get_last_photo():
+    """ The last_photo of /app/rainbow-cities """
+    photo = shown_photo()
+    return utils.etag_response(photo_version(photo) if photo else "-", RAINBOW_CITIES_CACHE_CONTROL,
+                               lambda: jsonify(dict(last_photo=photo)))
 
 @app.route("/app/tmp")
 def tmp():
@@ -75,31 +198,54 @@ def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1] in ['jpg', 'png', 'jpeg']
 
-def resize(src_file, width):
-    base, ext = os.path.basename(src_file).split(".", 2)
-    target_file = os.path.join(os.path.dirname(src_file), "%s_%dw.%s" % (base, width, ext))
-    cmd = "convert '%s' -auto-orient -resize %dx '%s'" % (src_file, width, target_file)
-    os.system(cmd)
-    return os.path.basename(target_file)
+
+# The worldcities table, by place. Read again when db_cities.py writes a new city index.
+nearby_cities = caches.FileCache(city_index.INDEX_PATH, nearby.load)
 
 
 def closest_cities(lat, lon):
-    q = "SELECT * FROM worldcities WHERE (point(%(lon)s, %(lat)s) <@> POINT(longitude, latitude)) / 1.60934 < 100 ORDER BY (point(%(lon)s, %(lat)s) <@> POINT(longitude, latitude)) ASC LIMIT 5"
-    cur = psql.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-    cur.execute(q, {'lat': lat, 'lon': lon})
-    c = cur.fetchall()
-    return [dict(city, id=utils.city_id(city)) for city in c]
+    """ The 5 cities closest to (lat, lon), within 100 km """
+    index = nearby_cities.get()
+    if index is None:
+        # There is no city index yet: make it
+        index = nearby.NearbyIndex(city_index.get(pool).cities)
+    return [dict(city, id=utils.city_id(city)) for city in index.closest(lat, lon)]
 
 def map_photo(p):
     return dict(created=p['created'],
                 filename=p['filename'],
                 id=p['id'],
                 variants=p['variants'],
+                variants_status=p.get('variants_status', variants.READY),
                 meta=p.get('meta', ''))
 
 
+def store_photo(user_id, file_id, src_file, mm):
+    """ Add the uploaded photo to the database, and have its variants made """
+    if 'lat' in mm:
+        print(mm)
+        c = closest_cities(mm['lat'], mm['lng'])
+        if len(c) > 0:
+            mm.update(c[0])
+    meta = json.dumps(mm)
+
+    doc = dict(id=file_id,
+               filename=os.path.basename(src_file),
+               user_id=user_id,
+               meta=meta,
+               created=datetime.datetime.utcnow(),
+               variants=variants.placeholders(os.path.basename(src_file)),
+               variants_status=variants.PENDING)
+    logger.debug("Photo upload: {}".format(doc))
+    db.photos.insert(doc)
+    latest_photo.invalidate()
+    variant_pool.submit(file_id, src_file)
+    return jsonify(map_photo(doc))
+
+
 @app.route("/app/user/<string:user_id>/photo", methods=['POST'])
 def photo_upload(user_id):
+    """ The photo as a base64 data url in a JSON body, as older versions of the app send it """
     user = db.users.find_one({'id': user_id})
 
     blocked = db.blocked_users.find_one({'user_id': user_id}) is not None
@@ -119,25 +265,24 @@ def photo_upload(user_id):
         print("bad request")
         abort(400)
 
-    variants = dict([(str(w), resize(src_file, w)) for w in (200, 400, 800)])
-
     mm = 'meta' in body and body['meta'] or {}
-    if 'lat' in mm:
-        print(mm)
-        c = closest_cities(mm['lat'], mm['lng'])
-        if len(c) > 0:
-            mm.update(c[0])
-    meta = json.dumps(mm)
+    return store_photo(user_id, file_id, src_file, mm)
 
-    doc = dict(id=file_id,
-               filename=os.path.basename(src_file),
-               user_id=user_id,
-               meta=meta,
-               created=datetime.datetime.utcnow(),
-               variants=variants)
-    logger.debug("Photo upload: {}".format(doc))
-    db.photos.insert(doc)
-    return jsonify(map_photo(doc))
+
+@app.route("/app/user/<string:user_id>/photo/stream", methods=['POST'])
+def photo_stream_upload(user_id):
+    """
+    The photo as the request body, with `meta` (JSON) as a query parameter,
+    or as the `photo` file of a multipart body, with a `meta` field
+    """
+    blocked = db.blocked_users.find_one({'user_id': user_id}) is not None
+    if blocked:
+        abort(403)
+
+    file_id = "%s_%s" % (user_id, int(time.time()))
+    src_file = os.path.join(settings.UPLOAD_FOLDER, "%s.jpg" % (file_id))
+    mm = uploads.receive(request, src_file)
+    return store_photo(user_id, file_id, src_file, mm)
 
 
 @app.route("/app/user/<string:user_id>/photos", methods=['GET'])
@@ -147,22 +292,24 @@ def user_photos(user_id):
     user = db.users.find_one({'id': user_id})
     if user is None:
         abort(403)
-    photos = db.photos.find({'user_id': user_id}).sort('created', pymongo.DESCENDING).limit(limit).skip(skip)
-    return jsonify(dict(photos=[map_photo(p) for p in photos]))
+    photos, next_token = pagination.page(db.photos, {'user_id': user_id}, limit, request.args.get('before'), skip)
+    return utils.etag_response(photos_etag(photos, next_token), USER_PHOTOS_CACHE_CONTROL,
+                               lambda: jsonify(dict(photos=[map_photo(p) for p in photos], next=next_token)))
 
 
 @app.route("/app/photos", methods=['GET'])
 def all_photos():
     limit = int(request.args.get('limit', 20))
     skip = int(request.args.get('skip', 0))
-    photos = db.photos.find().sort('created', pymongo.DESCENDING).limit(limit).skip(skip)
-    return jsonify(dict(photos=[map_photo(p) for p in photos]))
+    photos, next_token = pagination.page(db.photos, {}, limit, request.args.get('before'), skip)
+    return utils.etag_response(photos_etag(photos, next_token), PHOTOS_CACHE_CONTROL,
+                               lambda: jsonify(dict(photos=[map_photo(p) for p in photos], next=next_token)))
 
 
 @app.route("/latest/clouds.png")
 @cache.cached(timeout=60)
 def get_clouds_png():
-    return utils.nocache_redirect(settings.get_latest_clouds_alpha_url())
+    return latest_redirect(settings.get_latest_clouds_alpha_url())
 
 @app.route("/app/report/<string:photo_id>", methods=['POST'])
 def report_photo(photo_id):
@@ -179,6 +326,20 @@ def get_closest_cities():
     return jsonify(dict(cities=closest_cities(lat, lon)))
 
 
+def ensure_indexes():
+    """ Create the indexes the queries above need, when they are not there yet """
+    try:
+        db.photos.create_index(pagination.SORT)
+        db.photos.create_index([('user_id', pymongo.ASCENDING)] + pagination.SORT)
+        db.photos.create_index('id')
+        db.users.create_index('id')
+        db.blocked_users.create_index('user_id')
+        db.reports.create_index('photo_id')
+    except pymongo.errors.PyMongoError:
+        logger.exception("could not create the indexes")
+
+
+ensure_indexes()
 hq.build()
 
 if __name__ == '__main__':
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+"""
+The cities closest to a point, without asking Postgres.
+
+The cities are put in bands of BAND degrees latitude, and sorted by
+longitude within each band. For a point, only the cities in the bands
+and the longitudes that can be within `max_distance` are looked at, and
+their great circle distance worked out.
+
+The cities come from the city index (see city_index.py), which
+db_cities.py writes again whenever it changes the worldcities table.
+"""
+
+import math
+
+import numpy as np
+
+import city_index
+
+# km
+EARTH_RADIUS = 6371.0
+MAX_DISTANCE = 100
+
+# degrees latitude
+BAND = 1.0
+
+
+def distances(lat, lng, lats, lngs):
+    """ Great circle distances in km from (lat, lng) to the points in `lats`, `lngs` (haversine) """
+    lat, lng = math.radians(lat), math.radians(lng)
+    lats, lngs = np.radians(lats), np.radians(lngs)
+    a = np.sin((lats - lat) / 2) ** 2 + math.cos(lat) * np.cos(lats) * np.sin((lngs - lng) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1)))
+
+
+class NearbyIndex(object):
+
+    def __init__(self, cities):
+        self.cities = list(cities)
+        lats = np.array([float(c['latitude']) for c in self.cities])
+        lngs = np.array([(float(c['longitude']) + 180) % 360 - 180 for c in self.cities])
+        bands = np.floor(lats / BAND).astype(int)
+        order = np.lexsort((lngs, bands))
+        self.lats, self.lngs, self.bands = lats[order], lngs[order], bands[order]
+        self.order = order
+        # Where every band starts and ends in the sorted arrays
+        numbers, starts = np.unique(self.bands, return_index=True)
+        self.starts = dict(zip(numbers.tolist(), starts.tolist()))
+        self.ends = dict(zip(numbers.tolist(), np.append(starts[1:], len(order)).tolist()))
+
+    def __len__(self):
+        return len(self.cities)
+
+    def candidates(self, lat, lng, max_distance):
+        """ The positions in the sorted arrays of the cities that may be within `max_distance` """
+        dlat = math.degrees(max_distance / EARTH_RADIUS)
+        lat_max = min(90, abs(lat) + dlat)
+        # How far in longitude max_distance is, where the parallels are closest together
+        cos = math.cos(math.radians(lat_max))
+        dlng = math.degrees(max_distance / (EARTH_RADIUS * cos)) if cos > 1e-9 else 180
+        ranges = []
+        for band in range(int(math.floor((lat - dlat) / BAND)), int(math.floor((lat + dlat) / BAND)) + 1):
+            if band not in self.starts:
+                continue
+            start, end = self.starts[band], self.ends[band]
+            if dlng >= 180:
+                ranges.append((start, end))
+                continue
+            lngs = self.lngs[start:end]
+            west, east = lng - dlng, lng + dlng
+            # Across the date line, look at both ends of the band
+            for w, e in [(max(west, -180), min(east, 180))] + \
+                        ([(west + 360, 180)] if west < -180 else []) + \
+                        ([(-180, east - 360)] if east > 180 else []):
+                ranges.append((start + np.searchsorted(lngs, w, 'left'),
+                               start + np.searchsorted(lngs, e, 'right')))
+        if not ranges:
+            return np.array([], dtype=int)
+        return np.concatenate([np.arange(s, e) for s, e in ranges])
+
+    def closest(self, lat, lng, max_distance=MAX_DISTANCE, limit=5):
+        """ The `limit` cities closest to (lat, lng), within `max_distance` km, closest first """
+        lng = (lng + 180) % 360 - 180
+        positions = self.candidates(lat, lng, max_distance)
+        d = distances(lat, lng, self.lats[positions], self.lngs[positions])
+        near = np.flatnonzero(d < max_distance)
+        near = near[np.argsort(d[near], kind='stable')][:limit]
+        return [self.cities[self.order[positions[i]]] for i in near]
+
+
+def load(path=city_index.INDEX_PATH):
+    return NearbyIndex(city_index.load(path).cities)
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+"""
+Paging through the photos, newest first, without `skip`.
+
+With skip, Mongo walks past every photo on the pages before. Instead, every
+page ends with a `next` token: the `created` and `id` of its last photo.
+Asking for the photos `before` it starts where that page ended, straight
+from the (created, id) index, however deep the page is.
+
+The token is opaque to the app: base64 of "<created in ms>:<id>".
+"""
+
+import base64
+import binascii
+import calendar
+import datetime
+
+import pymongo
+from werkzeug.exceptions import BadRequest
+
+SORT = [('created', pymongo.DESCENDING), ('id', pymongo.DESCENDING)]
+
+
+def millis(d):
+    # Mongo keeps dates in milliseconds
+    return calendar.timegm(d.utctimetuple()) * 1000 + d.microsecond // 1000
+
+
+def encode_token(photo):
+    token = "%d:%s" % (millis(photo['created']), photo['id'])
+    return base64.urlsafe_b64encode(token.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_token(token):
+    """ The (created, id) in `token` """
+    try:
+        token = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode('utf-8')
+        ms, photo_id = token.split(':', 1)
+        created = datetime.datetime(1970, 1, 1) + datetime.timedelta(milliseconds=int(ms))
+    except (ValueError, TypeError, binascii.Error):
+        raise BadRequest("invalid before")
+    return created, photo_id
+
+
+def before(query, token):
+    """ `query`, for the photos that come after the one in `token` """
+    created, photo_id = decode_token(token)
+    return {'$and': [query, {'$or': [{'created': {'$lt': created}},
+                                     {'created': created, 'id': {'$lt': photo_id}}]}]}
+
+
+def page(collection, query, limit, token=None, skip=0):
+    """ A page of photos, and the token for the next page (None on the last one) """
+    if token:
+        cursor = collection.find(before(query, token)).sort(SORT).limit(limit)
+    else:
+        cursor = collection.find(query).sort(SORT).skip(skip).limit(limit)
+    photos = list(cursor)
+    next_token = encode_token(photos[-1]) if len(photos) == limit and limit > 0 else None
+    return photos, next_token
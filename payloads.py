@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+"""
+API responses made in advance, by the pipeline.
+
+cities.py writes the response of /app/cities, the first 20 rainbow cities,
+the way it is sent: minified, and compressed next to it with gzip and, when
+the brotli module is installed, brotli:
+
+    static/gfs/api/cities.json
+    static/gfs/api/cities.json.gz
+    static/gfs/api/cities.json.br
+
+The app sends the file the client accepts as it is, with its
+Content-Encoding (nginx can serve them without the app, see nginx.conf.j2).
+/app/rainbow-cities takes the cities out of cities.json as they are, and
+only adds the latest photo. Until cities.json is there, the app makes both
+from GFS_FOLDER/rainbow_cities.json.
+
+    python payloads.py
+
+writes them again from GFS_FOLDER/rainbow_cities.json (the deploy does this).
+"""
+
+import os
+import json
+import gzip
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+import settings
+import utils
+
+CITIES_PATH = os.path.join(settings.GFS_FOLDER, 'api', 'cities.json')
+
+# What cities.py writes for the app before anything else
+RAINBOW_CITIES_PATH = os.path.join(settings.GFS_FOLDER, 'rainbow_cities.json')
+
+# How many rainbow cities the app shows
+CITIES_LIMIT = 20
+
+CITIES_PREFIX = b'{"cities":'
+CITIES_SUFFIX = b'}'
+
+# Content-Encoding, extension, compress; the one to prefer first
+COMPRESSIONS = [('br', '.br', lambda body: brotli.compress(body) if brotli else None),
+                ('gzip', '.gz', lambda body: gzip.compress(body, 9))]
+
+
+def cities_body(cities):
+    """ The response of /app/cities """
+    cities = json.dumps(cities[:CITIES_LIMIT], ensure_ascii=False, separators=(',', ':'), default=float)
+    return CITIES_PREFIX + cities.encode('utf-8') + CITIES_SUFFIX
+
+
+def cities_list(body):
+    """ The list of cities in a response of /app/cities, as it is """
+    return body[len(CITIES_PREFIX):-len(CITIES_SUFFIX)].decode('utf-8')
+
+
+def write(path, data):
+    with utils.replacing(path) as tmp_path, open(tmp_path, 'wb') as f:
+        f.write(data)
+
+
+def publish(path, body):
+    """ Write the response `body` to `path`, and its compressed versions next to it """
+    folder = os.path.dirname(path)
+    if not os.path.exists(folder):
+        os.makedirs(folder, exist_ok=True)
+    # The compressed versions first: when the plain one changes, they are there
+    for encoding, extension, compress in COMPRESSIONS:
+        compressed = compress(body)
+        if compressed is None:
+            # Not for an older body either
+            if os.path.exists(path + extension):
+                os.remove(path + extension)
+        else:
+            write(path + extension, compressed)
+    write(path, body)
+
+
+def choose(path, accept_encodings):
+    """
+    The file to send for `path` to a client that accepts `accept_encodings`
+    (a werkzeug Accept), and its Content-Encoding
+    """
+    for encoding, extension, _ in COMPRESSIONS:
+        if accept_encodings[encoding] and os.path.exists(path + extension):
+            return path + extension, encoding
+    return path, None
+
+
+if __name__ == '__main__':
+    # Before cities.py has found any rainbow cities there is nothing to write
+    if os.path.exists(RAINBOW_CITIES_PATH):
+        with open(RAINBOW_CITIES_PATH, 'rb') as f:
+            publish(CITIES_PATH, cities_body(json.loads(f.read().decode('utf-8'))))
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+
+"""
+A pool of Postgres connections, shared by the threads of a process.
+
+    with pool.cursor() as cur:
+        cur.execute("SELECT ...")
+
+checks out a connection for the block, and gives it back afterwards:
+committed when the block went well, rolled back when it raised, so a
+failed query never leaves the connection in an aborted transaction. A
+connection that has been idle for `check_after` seconds is tested with
+`SELECT 1` before it is handed out, and replaced when it has gone away;
+a connection that broke during a block is thrown away.
+
+When all `size` connections are in use, the block waits for one. The pool
+counts the time spent waiting and the time connections were in use, and
+logs the waits and blocks that take longer than SLOW seconds.
+
+A process made with fork (multiprocessing) starts with an empty pool:
+it can not use the connections of its parent.
+"""
+
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+import psycopg2
+
+import utils
+
+logger = utils.install_logger()
+
+try:
+    from settings import PG_POOL_SIZE
+except ImportError:
+    PG_POOL_SIZE = 4
+
+# Seconds a connection may be idle before it is checked on checkout
+try:
+    from settings import PG_CHECK_AFTER
+except ImportError:
+    PG_CHECK_AFTER = 30
+
+# Seconds of waiting or querying worth logging
+SLOW = 0.5
+
+
+class Pool(object):
+
+    def __init__(self, dsn, size=PG_POOL_SIZE, check_after=PG_CHECK_AFTER, connect=psycopg2.connect):
+        self.dsn = dsn
+        self.size = size
+        self.check_after = check_after
+        self.connect = connect
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """ Forget all connections (without closing them: they may be our parent's) """
+        self.pid = os.getpid()
+        self.available = threading.Semaphore(self.size)
+        self.idle = []
+        self.checkouts = 0
+        self.wait_seconds = 0.
+        self.use_seconds = 0.
+        self.reconnects = 0
+
+    def stats(self):
+        return dict(size=self.size, idle=len(self.idle), checkouts=self.checkouts,
+                    wait_seconds=self.wait_seconds, use_seconds=self.use_seconds, reconnects=self.reconnects)
+
+    def healthy(self, conn, idle_since):
+        if conn.closed:
+            return False
+        if time.time() - idle_since < self.check_after:
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            cur.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def checkout(self):
+        with self.lock:
+            if self.pid != os.getpid():
+                self.reset()
+            available = self.available
+        start = time.time()
+        available.acquire()
+        waited = time.time() - start
+        try:
+            while True:
+                with self.lock:
+                    conn, idle_since = self.idle.pop() if self.idle else (None, None)
+                if conn is None:
+                    conn = self.connect(self.dsn)
+                    break
+                if self.healthy(conn, idle_since):
+                    break
+                logger.debug("replacing a broken Postgres connection")
+                self.discard(conn)
+                with self.lock:
+                    self.reconnects += 1
+        except BaseException:
+            available.release()
+            raise
+        with self.lock:
+            self.checkouts += 1
+            self.wait_seconds += waited
+        if waited > SLOW:
+            logger.debug("waited %.2fs for a Postgres connection" % waited)
+        return conn
+
+    def checkin(self, conn, broken=False):
+        with self.lock:
+            if self.pid != os.getpid():
+                # checked out before a fork; the pool has been reset since
+                return
+            if broken or conn.closed:
+                self.discard(conn)
+            else:
+                self.idle.append((conn, time.time()))
+            self.available.release()
+
+    def discard(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    @contextmanager
+    def connection(self):
+        conn = self.checkout()
+        start = time.time()
+        broken = False
+        try:
+            yield conn
+            conn.commit()
+        except BaseException as e:
+            broken = isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError))
+            if not broken and not conn.closed:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    broken = True
+            raise
+        finally:
+            used = time.time() - start
+            with self.lock:
+                self.use_seconds += used
+            if used > SLOW:
+                logger.debug("used a Postgres connection for %.2fs" % used)
+            self.checkin(conn, broken)
+
+    @contextmanager
+    def cursor(self, **kwargs):
+        with self.connection() as conn:
+            cur = conn.cursor(**kwargs)
+            try:
+                yield cur
+            finally:
+                cur.close()
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+"""
+Run the whole prediction in one process: fetch the GFS forecasts, find
+the rainclouds, and find the cities with rainbows.
+
+This replaces running fetch.py, water.py and cities.py one after the other
+(as predict.sh did). The modules, the database connections and the city
+index are loaded once, and the rainbow grids water.py computes are handed
+to cities.py directly, instead of being read back from disk.
+
+    python pipeline.py
+
+After every stage it publishes the manifest of the forecasts (see
+catalog.py), so the app sees new forecasts as soon as they are there.
+At the end it logs the wall time and the peak memory use of every stage.
+"""
+
+import time
+import resource
+from collections import namedtuple
+
+import utils
+import catalog
+import fetch
+import water
+import cities
+from settings import GFS_FOLDER
+
+logger = utils.install_logger()
+
+Timing = namedtuple('Timing', ['stage', 'seconds', 'peak_rss', 'own_peak'])
+
+
+def reset_peak():
+    """
+    Start measuring the peak memory use anew. Returns False where the
+    system does not let us (Linux does, since 4.0).
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except (IOError, OSError):
+        return False
+
+
+def peak_rss():
+    """ The most memory this process has used since reset_peak(), or else ever, in MB """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024.
+    except (IOError, OSError):
+        pass
+    # ru_maxrss is in kilobytes on Linux, and never goes down
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+
+class Stages(object):
+    """ Times the stages of the pipeline """
+
+    def __init__(self):
+        self.timings = []
+
+    def run(self, stage, function, *args):
+        own_peak = reset_peak()
+        start = time.time()
+        try:
+            return function(*args)
+        finally:
+            self.timings.append(Timing(stage, time.time() - start, peak_rss(), own_peak))
+
+    def report(self):
+        for timing in self.timings:
+            logger.debug("%-12s %8.2fs  peak RSS %7.1f MB%s" % (
+                timing.stage, timing.seconds, timing.peak_rss, "" if timing.own_peak else " (process peak so far)"))
+        logger.debug("%-12s %8.2fs" % ('total', sum(t.seconds for t in self.timings)))
+
+
+def rainclouds(slugs):
+    """ Find the rainclouds for every forecast. Returns a dict of slug → rainbow grid. """
+    try:
+        grids = water.find_rainclouds_batch(slugs)
+    except Exception:
+        logger.exception("error while processing %s" % ", ".join(slugs))
+        grids = {}
+    for slug in slugs:
+        if slug not in grids:
+            logger.error("could not process forecast %s" % slug)
+    return grids
+
+
+def rainbow_cities(slugs, grids):
+    for slug in slugs:
+        try:
+            succeeded = cities.find_rainbow_cities(slug, grids.get(slug)) is not False
+        except Exception:
+            logger.exception("error while processing %s" % slug)
+            succeeded = False
+        if not succeeded:
+            logger.error("could not find the cities for rainbow-forecast %s" % slug)
+
+
+def run():
+    stages = Stages()
+    try:
+        stages.run('fetch', fetch.fetch_gfs)
+        catalog.publish(GFS_FOLDER)
+        grids = stages.run('rainclouds', lambda: rainclouds(water.unprocessed_slugs()))
+        catalog.publish(GFS_FOLDER)
+        stages.run('cities', lambda: rainbow_cities(cities.cityless_slugs(), grids))
+        catalog.publish(GFS_FOLDER)
+    finally:
+        stages.report()
+
+
+if __name__ == '__main__':
+    run()
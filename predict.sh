@@ -2,6 +2,5 @@
 
 cd "$( dirname "${BASH_SOURCE[0]}" )"
 
-python fetch.py
-python water.py
-python cities.py
+# fetch.py, water.py and cities.py, in one process
+python pipeline.py
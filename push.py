@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+"""
+Send push notifications through pushy.me, many at the same time.
+
+A forecast with many rainbow cities means many pushes, one for every
+city topic. Instead of posting them one by one, the Dispatcher sends them
+from a small pool of threads. Every thread keeps its own HTTP session, so
+connections are reused. A push that fails with a connection error or a
+server error is retried a few times, waiting a little longer every time.
+
+Pushes with the same message can go out in one request to several topics
+(`max_topics`), if the API is set up to accept a list of recipients.
+
+    dispatcher = Dispatcher(PUSHY_URL + settings.PUSHY_KEY)
+    summary = dispatcher.send([(u"Rainbows near Moscow", ['/topics/city-moscow'])])
+"""
+
+import time
+import json
+import threading
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+PUSHY_URL = 'https://api.pushy.me/push?api_key='
+
+Summary = namedtuple('Summary', ['delivered', 'failed', 'requests', 'retries', 'seconds'])
+
+
+def batches(messages, max_topics=1):
+    """
+    Group (message, channels) pairs into (message, recipients) requests,
+    with at most `max_topics` channels per request
+    """
+    by_message = OrderedDict()
+    for message, channels in messages:
+        by_message.setdefault(message, []).extend(channels)
+    for message, channels in by_message.items():
+        for i in range(0, len(channels), max_topics):
+            yield message, channels[i:i + max_topics]
+
+
+class Dispatcher(object):
+
+    def __init__(self, url, workers=8, max_topics=1, retries=3, backoff=0.5, timeout=10):
+        self.url = url
+        self.workers = workers
+        self.max_topics = max_topics
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def session(self):
+        if not hasattr(self.local, 'session'):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def post(self, message, channels):
+        """
+        Send one request, retrying on failure.
+        Returns (delivered, number of retries, last response text or error).
+        """
+        to = channels[0] if len(channels) == 1 else channels
+        data = json.dumps({"to": to, "data": {"message": message}})
+        headers = {"Content-Type": "application/json"}
+        retries = 0
+        while True:
+            try:
+                r = self.session().post(self.url, data=data, headers=headers, timeout=self.timeout)
+                result = r.text.strip()
+                if r.status_code < 500 and r.status_code != 429:
+                    return r.status_code == 200, retries, result
+            except requests.RequestException as e:
+                result = str(e)
+            if retries >= self.retries:
+                return False, retries, result
+            time.sleep(self.backoff * 2 ** retries)
+            retries += 1
+
+    def send(self, messages, log=None):
+        """
+        Send a list of (message, channels) pairs. `log` is called with a
+        line of text for every request. Returns a Summary.
+        """
+        start = time.time()
+        requests_ = list(batches(messages, self.max_topics))
+        delivered = 0
+        failed = []
+        retries = 0
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            results = pool.map(lambda r: self.post(*r), requests_)
+            for (message, channels), (ok, tries, result) in zip(requests_, results):
+                retries += tries
+                if ok:
+                    delivered += len(channels)
+                else:
+                    failed.extend(channels)
+                if log:
+                    log(u"PUSH TO {} → result: {}".format(", ".join(channels), result))
+        return Summary(delivered, failed, len(requests_), retries, time.time() - start)
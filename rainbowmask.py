@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+"""
+The rainbow mask: where on the GFS grid water.py predicts rainbows.
+
+This is the file the stages after water.py read, instead of decoding
+GFS_half_degree.<slug>.pwat.png. It holds one bit per grid cell, 1 where
+there may be a rainbow, packed row by row from north to south. For the
+0.5 degree grid that is some 32 KB, which we map into memory.
+
+File layout (little endian):
+
+    offset  size
+    0       4     magic b'RDGM'
+    4       2     format version (1)
+    6       2     reserved
+    8       4     nx, grid points W-E
+    12      4     ny, grid points N-S
+    16      8     lo1, longitude of the grid origin (double)
+    24      8     la1, latitude of the grid origin (double)
+    32      8     dx, distance between grid points W-E in degrees (double)
+    40      8     dy, distance between grid points N-S in degrees (double)
+    48      8     time of the forecast, seconds since the epoch (UTC)
+    56      8     reserved
+    64            the bits, as written by numpy.packbits
+"""
+
+import os
+import struct
+import calendar
+from datetime import datetime
+
+import numpy as np
+import pytz
+
+import utils
+
+MAGIC = b'RDGM'
+VERSION = 1
+HEADER = struct.Struct('<4sHHIIddddq8x')
+
+
+def path_for(folder, slug):
+    return os.path.join(folder, "GFS_half_degree.%s.rainbows.mask" % slug)
+
+
+class RainbowMask(object):
+
+    def __init__(self, bits, nx, ny, lo1, la1, dx, dy, date):
+        self.bits = bits
+        self.nx = nx
+        self.ny = ny
+        self.lo1 = lo1
+        self.la1 = la1
+        self.dx = dx
+        self.dy = dy
+        self.date = date
+
+    @property
+    def grid(self):
+        """ The mask as a (ny, nx) boolean array """
+        return np.unpackbits(self.bits)[:self.nx * self.ny].reshape(self.ny, self.nx).astype(bool)
+
+    def points(self):
+        """ The (x, y) grid positions with rainbows, as two arrays """
+        ys, xs = np.nonzero(self.grid)
+        return xs, ys
+
+    def count(self):
+        """ The number of grid cells with rainbows """
+        return int(np.unpackbits(self.bits)[:self.nx * self.ny].sum())
+
+
+def write(path, grid, header, date):
+    """
+    Write the boolean (ny, nx) array `grid` to `path`. `header` holds the
+    grid description as in the GRIB header (lo1, la1, dx, dy), `date` is the
+    timezone aware time of the forecast.
+    """
+    ny, nx = grid.shape
+    timestamp = calendar.timegm(date.utctimetuple())
+    with utils.replacing(path) as tmp_path, open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, 0, nx, ny,
+                            header['lo1'], header['la1'], header['dx'], header['dy'],
+                            timestamp))
+        f.write(np.packbits(np.asarray(grid, dtype=bool)).tobytes())
+
+
+def load(path):
+    """ Map the rainbow mask at `path` into memory """
+    with open(path, 'rb') as f:
+        magic, version, _, nx, ny, lo1, la1, dx, dy, timestamp = HEADER.unpack(f.read(HEADER.size))
+    if magic != MAGIC or version != VERSION:
+        raise IOError("%s is not a rainbow mask" % path)
+    size = HEADER.size + (nx * ny + 7) // 8
+    if os.path.getsize(path) != size:
+        raise IOError("%s should be %d bytes for a %dx%d grid, not %d" % (path, size, nx, ny, os.path.getsize(path)))
+    bits = np.memmap(path, dtype=np.uint8, mode='r', offset=HEADER.size, shape=((nx * ny + 7) // 8,))
+    date = datetime.fromtimestamp(timestamp, pytz.UTC)
+    return RainbowMask(bits, nx, ny, lo1, la1, dx, dy, date)
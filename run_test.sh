@@ -1 +1,20 @@
 DBNAME=/tmp/test.db PYTHONPATH=. python test/api_test.py
+PYTHONPATH=. python test/solar_test.py
+PYTHONPATH=. python test/grib_test.py
+PYTHONPATH=. python test/barrel_test.py
+PYTHONPATH=. python test/layers_test.py
+PYTHONPATH=. python test/utils_test.py
+PYTHONPATH=. python test/rainbowmask_test.py
+PYTHONPATH=. python test/city_index_test.py
+PYTHONPATH=. python test/push_test.py
+PYTHONPATH=. python test/fetch_test.py
+PYTHONPATH=. python test/water_test.py
+PYTHONPATH=. python test/caches_test.py
+PYTHONPATH=. python test/catalog_test.py
+PYTHONPATH=. python test/variants_test.py
+PYTHONPATH=. python test/uploads_test.py
+PYTHONPATH=. python test/pagination_test.py
+PYTHONPATH=. python test/nearby_test.py
+PYTHONPATH=. python test/pg_test.py
+PYTHONPATH=. python test/payloads_test.py
+PYTHONPATH=. python test/geo_test.py
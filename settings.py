@@ -1,12 +1,9 @@
 # -*- coding: utf-8 -*-
 
 import os
-import re
 import sys
-from glob import glob
-from datetime import datetime
 
-import pytz
+import catalog
 
 SERVER_NAME = '127.0.0.1:5000'
 
@@ -20,59 +17,61 @@ def relative_folder(*parts):
 
 GFS_FOLDER = relative_folder('static', 'gfs')
 
+# The spacing of the GFS grid in degrees: 0.5 (720 × 361 points),
+# or 0.25 (1440 × 721 points) for a finer localisation of the rainbows.
+# After changing it, run db_cities.py to update the grid positions of the cities.
+GFS_RESOLUTION = 0.5
+
+# water.py keeps its intermediary layers in a bundle, and the debug images
+# in HQ are drawn from it when they are first asked for.
+# Set to True to save all debug images right away.
+SAVE_DEBUG_IMAGES = False
+
+
+_catalog = None
+
+
+def get_catalog():
+    """ The forecasts in GFS_FOLDER, see catalog.py """
+    global _catalog
+    if _catalog is None or _catalog.folder != GFS_FOLDER:
+        _catalog = catalog.Catalog(GFS_FOLDER)
+    return _catalog
+
 
 # This is to find the latest folder of the form 2014022100
 def get_latest_gfs_folder():
-    global GFS_FOLDER
-    for f in sorted(os.listdir(GFS_FOLDER), reverse=True):
-        slug = f
-        path = os.path.join(GFS_FOLDER, slug)
-        if re.match(r'\d{10}', slug) and os.path.isdir(path) and len(glob(os.path.join(path, '*pwat.grib'))) > 0:
-            return (path, slug)
-    return (None, None)
+    return get_catalog().latest()
+
 
 def get_forecast_info():
-    forecast_info = []
-    for f in sorted(os.listdir(GFS_FOLDER), reverse=True):
-        slug = f
-        path = os.path.join(GFS_FOLDER, slug)
-        if re.match(r'\d{10}', slug) and os.path.isdir(path) and len(glob(os.path.join(path, '*pwat.grib'))) > 0:
-            slug_date = datetime.strptime(slug, "%Y%m%d%H")
-            slug_date = slug_date.replace(tzinfo=pytz.UTC)
-            forecast = {
-                         "slug": slug,
-                         "date": slug_date,
-                        }
-            if slug_date > datetime.now(pytz.utc):
-                forecast['future'] = True
-                forecast_info.append(forecast)
-            else:
-                forecast['future'] = False
-                forecast_info.append(forecast)
-                break
-    return forecast_info
+    return get_catalog().forecast_info()
+
+
+# The URL of the file `pattern % slug` in the newest forecast for now that has it, or None
+def get_latest_url(pattern):
+    slug = get_catalog().latest_with(pattern)
+    if slug is None:
+        return None
+    return "/static/gfs/" + slug + "/" + pattern % slug
 
 
 def get_latest_rainbows_url():
-    slug = get_forecast_info()[-1]['slug']
-    return "/static/gfs/" + slug + "/" + slug + ".rainbows.json"
+    return get_latest_url("%s.rainbows.json")
 
 
 def get_latest_clouds_url():
-    slug = get_forecast_info()[-1]['slug']
-    return "/static/gfs/" + slug + "/" + slug + ".clouds.json"
+    return get_latest_url("%s.clouds.json")
 
 
 def get_latest_rainbow_cities_url():
-    slug = get_forecast_info()[-1]['slug']
-    return "/static/gfs/" + slug + "/" + slug + ".rainbow_cities.json"
-
-def get_latest_clouds_alpha_url():
-    slug = get_forecast_info()[-1]['slug']
-    return "/static/gfs/{}/GFS_half_degree.clouds_alpha.{}.pwat.png".format(slug, slug)
+    return get_latest_url("%s.rainbow_cities.json")
 
+def get_latest_rainbows_mask_url():
+    return get_latest_url("GFS_half_degree.%s.rainbows.mask")
 
-LATEST_GFS_FOLDER, LATEST_GFS_SLUG = get_latest_gfs_folder()
+def get_latest_clouds_alpha_url():
+    return get_latest_url("GFS_half_degree.clouds_alpha.%s.pwat.png")
 
 
 """
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+
+"""
+Solar geometry for a whole GFS grid at once.
+
+Pysolar answers one (latitude, longitude) question at a time; asking it for
+every point of the 720 × 361 grid takes a couple of hundred thousand calls.
+Here we use the same approximations as `pysolar.solar.get_altitude_fast`
+(declination and equation of time depend only on the day and the clock),
+find the subsolar point once, and then get the altitude of every grid cell
+with one spherical dot product:
+
+    sin(altitude) = sin(lat) sin(decl) + cos(lat) cos(decl) cos(lon - sun_lon)
+
+The grid is described by the GRIB header fields: origin (lo1, la1), spacing
+(dx, dy) and size (nx, ny). As in GFS data, rows run from north to south.
+The altitudes are calculated TILE_ROWS rows at a time, so that the finer
+grids do not need several full size temporary arrays.
+"""
+
+import math
+from datetime import timezone
+
+import numpy as np
+
+EARTH_AXIS_INCLINATION = 23.45
+
+# Between these altitudes (in degrees) the sun is up, but low enough to
+# make rainbows possible.
+MIN_RAINBOW_ALTITUDE = 0
+MAX_RAINBOW_ALTITUDE = 42
+
+TILE_ROWS = 64
+
+
+def declination(day):
+    """ Declination of the sun in degrees for a day of the year (1-366) """
+    return EARTH_AXIS_INCLINATION * math.sin((2 * math.pi / 365.0) * (day - 81))
+
+
+def equation_of_time(day):
+    """ Minutes to add to mean solar time to get actual solar time """
+    b = 2 * math.pi / 364.0 * (day - 81)
+    return 9.87 * math.sin(2 * b) - 7.53 * math.cos(b) - 1.5 * math.sin(b)
+
+
+def subsolar_point(when):
+    """
+    Return (latitude, longitude) in degrees of the point where the sun is
+    straight overhead at the timezone aware datetime `when`.
+    The longitude is normalised to [0, 360).
+    """
+    t = when.astimezone(timezone.utc).timetuple()
+    day = t.tm_yday
+    # solar noon is where the hour angle is zero:
+    # t.tm_hour * 60 + t.tm_min + 4 * longitude + equation_of_time == 12 * 60
+    longitude = (12 * 60 - t.tm_hour * 60 - t.tm_min - equation_of_time(day)) / 4.0
+    return declination(day), longitude % 360
+
+
+def grid_coordinates(lo1, la1, dx, dy, nx, ny):
+    """ Return the latitudes (ny,) and longitudes (nx,) of the grid in degrees """
+    latitudes = la1 - dy * np.arange(ny, dtype=np.float64)
+    longitudes = lo1 + dx * np.arange(nx, dtype=np.float64)
+    return latitudes, longitudes
+
+
+def altitude_grid(when, lo1, la1, dx, dy, nx, ny):
+    """
+    Calculate the solar altitude for every cell of the grid at `when`.
+
+    Returns a tuple (altitudes, (sun_x, sun_y)): a (ny, nx) float array in
+    degrees, and the grid position of the cell where the sun is highest.
+    """
+    sun_lat, sun_lon = subsolar_point(when)
+    latitudes, longitudes = grid_coordinates(lo1, la1, dx, dy, nx, ny)
+
+    delta = math.radians(sun_lat)
+    cos_hour_angle = np.cos(np.radians(longitudes - sun_lon))[np.newaxis, :]
+
+    altitudes = np.empty((ny, nx), dtype=np.float64)
+    for top in range(0, ny, TILE_ROWS):
+        phi = np.radians(latitudes[top:top + TILE_ROWS])[:, np.newaxis]
+        sin_altitude = np.sin(phi) * math.sin(delta) + np.cos(phi) * math.cos(delta) * cos_hour_angle
+        altitudes[top:top + TILE_ROWS] = np.degrees(np.arcsin(np.clip(sin_altitude, -1.0, 1.0)))
+
+    sun_y, sun_x = np.unravel_index(np.argmax(altitudes), altitudes.shape)
+    return altitudes, (int(sun_x), int(sun_y))
+
+
+def sun_masks(whens, lo1, la1, dx, dy, nx, ny):
+    """
+    The sun masks of the grid for several moments, without working out the
+    altitude of every cell.
+
+    Along a row, sin(altitude) = a + b cos(lon - sun_lon) with b >= 0, so the
+    altitude only goes up with cos(lon - sun_lon). The cells of a row where
+    the sun is between the limits are those where that cosine is between two
+    bounds, which we find with a binary search over the cosines of the row,
+    working out the altitude as altitude_grid does.
+
+    Returns a tuple (masks, suns): an (n, ny, nx) uint8 array, as sun_mask
+    would make from altitude_grid, and for every moment the grid position
+    (sun_x, sun_y) of the cell where the sun is highest.
+    """
+    latitudes, longitudes = grid_coordinates(lo1, la1, dx, dy, nx, ny)
+    phi = np.radians(latitudes)
+
+    masks = np.empty((len(whens), ny, nx), dtype=np.uint8)
+    suns = []
+    for i, when in enumerate(whens):
+        sun_lat, sun_lon = subsolar_point(when)
+        delta = math.radians(sun_lat)
+        a = np.sin(phi) * math.sin(delta)
+        b = np.cos(phi) * math.cos(delta)
+        cos_hour_angle = np.cos(np.radians(longitudes - sun_lon))
+        cosines = np.unique(cos_hour_angle)
+
+        def altitudes(rows, k):
+            """ The altitudes in `rows` where the cosine is cosines[k] """
+            return _altitude(a[rows] + b[rows] * cosines[k])
+
+        # For every row, the first cosine where the sun is up, and the first where it is too high
+        rows = np.arange(ny)
+        low = _first(len(cosines), ny, lambda k: altitudes(rows, k) > MIN_RAINBOW_ALTITUDE)
+        high = _first(len(cosines), ny, lambda k: altitudes(rows, k) >= MAX_RAINBOW_ALTITUDE)
+        bounds = np.append(cosines, np.inf)
+        visible = (cos_hour_angle >= bounds[low][:, np.newaxis]) & (cos_hour_angle < bounds[high][:, np.newaxis])
+        masks[i] = visible
+        masks[i] *= 255
+
+        # The sun is highest in the first row with the highest altitude, where the cosine is largest
+        sun_y = int(np.argmax(altitudes(rows, np.full(ny, len(cosines) - 1))))
+        sun_x = int(np.argmax(_altitude(a[sun_y] + b[sun_y] * cos_hour_angle)))
+        suns.append((sun_x, sun_y))
+    return masks, suns
+
+
+def _altitude(sin_altitude):
+    return np.degrees(np.arcsin(np.clip(sin_altitude, -1.0, 1.0)))
+
+
+def _first(size, n, predicate):
+    """
+    For n rows at once, the first k in range(size) where predicate(k) holds,
+    or size where it never does. predicate takes an index for every row, and
+    must be false and then true along the k of every row.
+    """
+    low = np.zeros(n, dtype=np.int64)
+    high = np.full(n, size, dtype=np.int64)
+    while True:
+        searching = low < high
+        if not searching.any():
+            return low
+        middle = np.minimum((low + high) // 2, size - 1)
+        holds = predicate(middle)
+        high = np.where(searching & holds, middle, high)
+        low = np.where(searching & ~holds, middle + 1, low)
+
+
+def sun_mask(altitudes):
+    """
+    Turn an altitude grid into a mask: 255 where the sun is between
+    0 and 42 degrees, 0 where it is night or the sun is too high.
+    """
+    visible = (altitudes > MIN_RAINBOW_ALTITUDE) & (altitudes < MAX_RAINBOW_ALTITUDE)
+    return np.where(visible, 255, 0).astype(np.uint8)
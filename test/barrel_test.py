@@ -0,0 +1,48 @@
+import unittest
+
+import numpy as np
+
+import barrel
+
+
+class BarrelTestCase(unittest.TestCase):
+
+    def test_identity(self):
+        layer = np.random.RandomState(0).randint(0, 256, (37, 72)).astype(np.uint8)
+        np.testing.assert_array_equal(barrel.distort(layer, 10, (0.0, 0.0, 0.0, 1.0)), layer)
+
+    def test_extrudes_away_from_centre(self):
+        # a white pixel to the right of the centre shows up further to the left
+        # in the distorted image: for every output pixel we sample further out
+        layer = np.zeros((361, 720), dtype=np.uint8)
+        layer[100, 700] = 255
+        distorted = barrel.distort(layer, 100)
+        ys, xs = np.nonzero(distorted)
+        self.assertTrue(len(xs) > 0)
+        self.assertTrue((xs < 700).all())
+        self.assertTrue((ys == 100).all())
+
+    def test_outside_is_black(self):
+        layer = np.full((361, 720), 255, dtype=np.uint8)
+        distorted = barrel.distort(layer, 180)
+        self.assertEqual(distorted[180, 360], 255)
+        self.assertEqual(distorted[0, 0], 0)
+        self.assertEqual(distorted[360, 719], 0)
+
+    def test_quarter_degree_grid(self):
+        # built in tiles, the table is the same as built in one go
+        table = barrel.remap_table(1440, 721, 300)
+        tile_rows = barrel.TILE_ROWS
+        barrel.TILE_ROWS = 721
+        try:
+            np.testing.assert_array_equal(barrel.remap_table.__wrapped__(1440, 721, 300), table)
+        finally:
+            barrel.TILE_ROWS = tile_rows
+
+    def test_remap_table_is_cached_per_row(self):
+        self.assertIs(barrel.remap_table(720, 361, 150), barrel.remap_table(720, 361, 150))
+        self.assertIsNot(barrel.remap_table(720, 361, 150), barrel.remap_table(720, 361, 151))
+
+
+if __name__ == '__main__':
+    unittest.main()
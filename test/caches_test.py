@@ -0,0 +1,77 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+import caches
+
+
+class CachesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'rainbow_cities.json')
+        self.loads = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def load(self, path):
+        self.loads += 1
+        with open(path) as f:
+            return json.load(f)
+
+    def write(self, cities):
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump(cities, f)
+        os.rename(self.path + '.tmp', self.path)
+
+    def test_file_cache(self):
+        cache = caches.FileCache(self.path, self.load, default=[], check_interval=0)
+        self.assertEqual(cache.get(), [])
+        self.write(['Moscow'])
+        self.assertEqual(cache.get(), ['Moscow'])
+        self.assertEqual(cache.get(), ['Moscow'])
+        self.assertEqual(self.loads, 1)
+        # a new file, even of the same size and within the same mtime tick
+        self.write(['Khimki'])
+        self.assertEqual(cache.get(), ['Khimki'])
+        self.assertEqual(self.loads, 2)
+        os.remove(self.path)
+        self.assertEqual(cache.get(), [])
+
+    def test_file_cache_check_interval(self):
+        cache = caches.FileCache(self.path, self.load, default=[], check_interval=60)
+        self.write(['Moscow'])
+        self.assertEqual(cache.get(), ['Moscow'])
+        self.write(['Khimki'])
+        self.assertEqual(cache.get(), ['Moscow'])
+        cache.checked = 0
+        self.assertEqual(cache.get(), ['Khimki'])
+
+    def test_file_cache_half_written(self):
+        cache = caches.FileCache(self.path, self.load, default=[], check_interval=0)
+        self.write(['Moscow'])
+        self.assertEqual(cache.get(), ['Moscow'])
+        with open(self.path, 'w') as f:
+            f.write('["Khi')
+        self.assertEqual(cache.get(), ['Moscow'])
+        self.write(['Khimki'])
+        self.assertEqual(cache.get(), ['Khimki'])
+
+    def test_ttl_cache(self):
+        values = iter(range(10))
+        cache = caches.TTLCache(60, lambda: next(values))
+        self.assertEqual(cache.get(), 0)
+        self.assertEqual(cache.get(), 0)
+        cache.invalidate()
+        self.assertEqual(cache.get(), 1)
+        cache.ttl = 0
+        cache.invalidate()
+        self.assertEqual(cache.get(), 2)
+        self.assertEqual(cache.get(), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+
+import pytz
+
+import catalog
+
+
+class CatalogTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.now = datetime(2016, 3, 10, 7, tzinfo=pytz.UTC)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def forecast(self, slug, *artifacts):
+        path = os.path.join(self.folder, slug)
+        os.makedirs(path)
+        for artifact in ('GFS_half_degree.%s.pwat.grib' % slug,) + artifacts:
+            open(os.path.join(path, artifact), 'w').close()
+
+    def test_scan(self):
+        self.forecast('2016031000')
+        self.forecast('2016031006', '2016031006.rainbow_cities.json')
+        os.makedirs(os.path.join(self.folder, '2016031012'))  # not fetched yet
+        os.makedirs(os.path.join(self.folder, 'cache'))
+        self.assertEqual(catalog.scan(self.folder), [
+            {'slug': '2016031006', 'artifacts': ['2016031006.rainbow_cities.json',
+                                                 'GFS_half_degree.2016031006.pwat.grib']},
+            {'slug': '2016031000', 'artifacts': ['GFS_half_degree.2016031000.pwat.grib']}])
+
+    def test_forecast_info(self):
+        for slug in ('2016030918', '2016031000', '2016031006', '2016031009', '2016031012'):
+            self.forecast(slug)
+        catalog.publish(self.folder)
+        info = catalog.Catalog(self.folder).forecast_info(self.now)
+        self.assertEqual([(f['slug'], f['future']) for f in info],
+                         [('2016031012', True), ('2016031009', True), ('2016031006', False)])
+        self.assertEqual(info[-1]['date'], datetime(2016, 3, 10, 6, tzinfo=pytz.UTC))
+
+    def test_latest_with(self):
+        mask = 'GFS_half_degree.%s.rainbows.mask'
+        self.forecast('2016031000', mask % '2016031000')
+        self.forecast('2016031003', mask % '2016031003')
+        # fetched again, not processed yet
+        self.forecast('2016031006')
+        self.forecast('2016031009', mask % '2016031009')
+        catalog.publish(self.folder)
+        c = catalog.Catalog(self.folder)
+        self.assertEqual(c.latest_with(mask, self.now), '2016031003')
+        self.assertEqual(c.latest_with(mask, datetime(2016, 3, 10, 9, tzinfo=pytz.UTC)), '2016031009')
+        self.assertIsNone(c.latest_with('%s.rainbow_cities.json', self.now))
+        self.assertIsNone(c.latest_with(mask, datetime(2016, 3, 9, tzinfo=pytz.UTC)))
+
+    def test_manifest(self):
+        self.forecast('2016031006')
+        c = catalog.Catalog(self.folder, check_interval=0)
+        # without a manifest, the catalog looks for itself
+        self.assertEqual(c.latest(), (os.path.join(self.folder, '2016031006'), '2016031006'))
+        catalog.publish(self.folder)
+        self.forecast('2016031009')
+        # only what has been published
+        self.assertEqual(c.latest()[1], '2016031006')
+        catalog.publish(self.folder)
+        self.assertEqual(c.latest()[1], '2016031009')
+        self.assertEqual(c.forecasts()[0].artifacts, frozenset(['GFS_half_degree.2016031009.pwat.grib']))
+        self.assertEqual(sorted(os.listdir(self.folder)), ['2016031006', '2016031009', catalog.MANIFEST])
+
+    def test_empty(self):
+        c = catalog.Catalog(self.folder)
+        self.assertEqual(c.latest(), (None, None))
+        self.assertEqual(c.forecast_info(self.now), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
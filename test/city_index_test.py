@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import city_index
+
+CITIES = [
+    {'id': 'a', 'country': 'ru', 'name': u'Москва', 'name_en': 'Moscow', 'latitude': 55.75, 'longitude': 37.62, 'xy': '75x68'},
+    {'id': 'b', 'country': 'cn', 'name': u'北京', 'name_en': 'Beijing', 'latitude': 39.9, 'longitude': 116.4, 'xy': '232x100'},
+    {'id': 'c', 'country': 'ru', 'name': u'Химки', 'name_en': 'Khimki', 'latitude': 55.9, 'longitude': 37.43, 'xy': '74x68'},
+    {'id': 'd', 'country': 'ru', 'name': u'Зеленоград', 'name_en': 'Zelenograd', 'latitude': 55.98, 'longitude': 37.18, 'xy': '75x68'},
+]
+
+
+class CityIndexTestCase(unittest.TestCase):
+
+    def test_cities_in(self):
+        index = city_index.build(CITIES)
+        grid = np.zeros((361, 720), dtype=bool)
+        self.assertEqual(index.cities_in(grid), [])
+        grid[68, 75] = True
+        self.assertEqual([c['name_en'] for c in index.cities_in(grid)], ['Moscow', 'Zelenograd'])
+        grid[100, 232] = True
+        self.assertEqual([c['name_en'] for c in index.cities_in(grid)], ['Moscow', 'Beijing', 'Zelenograd'])
+
+    def test_wrong_grid(self):
+        with self.assertRaises(ValueError):
+            city_index.build(CITIES).cities_in(np.zeros((721, 1440), dtype=bool))
+
+    def test_save_and_load(self):
+        folder = tempfile.mkdtemp()
+        try:
+            path = os.path.join(folder, 'worldcities.npz')
+            city_index.save(city_index.build(CITIES), path)
+            index = city_index.load(path)
+            self.assertEqual(index.cities, CITIES)
+            self.assertEqual((index.nx, index.ny), (720, 361))
+            np.testing.assert_array_equal(index.cells, [68 * 720 + 75, 100 * 720 + 232, 68 * 720 + 74, 68 * 720 + 75])
+        finally:
+            shutil.rmtree(folder)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,165 @@
+import os
+import shutil
+import logging
+import tempfile
+import threading
+import unittest
+from datetime import datetime
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+
+import fetch
+import utils
+
+logging.getLogger(utils.LOGGER_NAME).handlers = [logging.NullHandler()]
+
+
+class StubNomads(ThreadingMixIn, HTTPServer):
+    """
+    Serves /<run>/<forecast hour> for the paths in `files`, with support
+    for Range requests. When `cut` is set, it hangs up after that many bytes.
+    """
+    daemon_threads = True
+
+    def __init__(self, files, cut=None):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), StubHandler)
+        self.files = files
+        self.cut = cut
+        self.requested = []
+        self.ranges = []
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def forecast_url(self, run, forecast_hour):
+        slug, _ = original_forecast_url(run, forecast_hour)
+        return slug, 'http://127.0.0.1:%d/%s' % (self.server_port, run_path(run, forecast_hour))
+
+
+class StubHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        path = self.path.strip('/')
+        self.server.requested.append(path)
+        if path not in self.server.files:
+            self.send_error(404)
+            return
+        data = self.server.files[path]
+        start = 0
+        if 'Range' in self.headers:
+            self.server.ranges.append(self.headers['Range'])
+            start = int(self.headers['Range'][len('bytes='):].rstrip('-'))
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, len(data) - 1, len(data)))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(data) - start))
+        self.end_headers()
+        self.wfile.write(data[start:self.server.cut])
+
+    def log_message(self, *args):
+        pass
+
+
+def run_path(run, forecast_hour):
+    return '%s/f%03d' % (run.strftime('%Y%m%d%H'), forecast_hour)
+
+
+def run_files(run):
+    return dict((run_path(run, hour), grib(hour)) for hour in range(0, 49, 3))
+
+
+def grib(hour):
+    return b'GRIB' + (b'%02d' % hour) * 1000 + b'7777'
+
+
+original_forecast_url = fetch.forecast_url
+
+NOW = datetime(2015, 5, 24, 10, 30)
+
+
+class FetchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.gfs_folder = fetch.GFS_FOLDER
+        fetch.GFS_FOLDER = self.folder
+
+    def tearDown(self):
+        fetch.GFS_FOLDER = self.gfs_folder
+        fetch.forecast_url = original_forecast_url
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.folder)
+
+    def serve(self, files, cut=None):
+        self.server = StubNomads(files, cut)
+        fetch.forecast_url = self.server.forecast_url
+
+    def test_forecast_url(self):
+        self.server = StubNomads({})
+        slug, url = fetch.forecast_url(datetime(2015, 5, 24, 18), 9)
+        self.assertEqual(slug, '2015052503')
+        self.assertIn('file=gfs.t18z.pgrb2full.0p50.f009&', url)
+        self.assertTrue(url.endswith('&dir=%2Fgfs.20150524%2F18'))
+        self.assertEqual(fetch.latest_runs(NOW), [datetime(2015, 5, 24, 6), datetime(2015, 5, 24, 0), datetime(2015, 5, 23, 18)])
+
+    def test_fetch(self):
+        # the run of 06:00 is not out yet, the run of 00:00 is
+        files = run_files(datetime(2015, 5, 24, 0))
+        self.serve(files)
+        fetched = fetch.fetch_gfs(NOW)
+        self.assertEqual(sorted(fetched), ['20150524%02d' % h for h in range(0, 24, 3)] +
+                                          ['20150525%02d' % h for h in range(0, 24, 3)] + ['2015052600'])
+        with open(fetch.grib_path('2015052421'), 'rb') as f:
+            self.assertEqual(f.read(), grib(21))
+        self.assertEqual(self.server.requested[0], '2015052406/f000')
+        self.assertFalse([f for f in os.listdir(os.path.join(self.folder, '2015052421')) if f.endswith('.part')])
+
+        self.assertEqual(fetch.fetched_run('2015052421'), '2015052400')
+
+        # the run of 06:00 is out: it replaces the forecasts of 00:00 for the same times
+        processed = os.path.join(self.folder, '2015052421', 'PROCESSED')
+        open(processed, 'w').close()
+        files.update(run_files(datetime(2015, 5, 24, 6)))
+        del self.server.requested[:]
+        self.assertEqual(sorted(fetch.fetch_gfs(NOW)), ['20150524%02d' % h for h in range(6, 24, 3)] +
+                                                      ['20150525%02d' % h for h in range(0, 24, 3)] +
+                                                      ['2015052600', '2015052603', '2015052606'])
+        self.assertEqual(sorted(self.server.requested), ['2015052406/f%03d' % h for h in range(0, 49, 3)])
+        with open(fetch.grib_path('2015052421'), 'rb') as f:
+            self.assertEqual(f.read(), grib(15))
+        self.assertEqual(fetch.fetched_run('2015052421'), '2015052406')
+        self.assertEqual(fetch.fetched_run('2015052403'), '2015052400')
+        # what was made of the forecast of 00:00 goes
+        self.assertFalse(os.path.exists(processed))
+
+        # all there: nothing to do
+        del self.server.requested[:]
+        self.assertEqual(fetch.fetch_gfs(NOW), [])
+        self.assertEqual(self.server.requested, [])
+
+    def test_resume(self):
+        run = datetime(2015, 5, 24, 0)
+        self.serve(run_files(run), cut=1500)
+        slug, url = fetch.forecast_url(run, 21)
+        path = fetch.grib_path(slug)
+        self.assertFalse(fetch.download(url, path))
+        self.assertFalse(os.path.exists(path))
+        part, = os.listdir(os.path.dirname(path))
+        self.assertEqual(os.path.getsize(os.path.join(os.path.dirname(path), part)), 1500)
+
+        self.server.cut = None
+        self.assertTrue(fetch.download(url, path))
+        self.assertEqual(self.server.ranges, ['bytes=1500-'])
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), grib(21))
+        self.assertEqual(os.listdir(os.path.dirname(path)), [os.path.basename(path)])
+
+    def test_not_grib(self):
+        self.serve({'2015052400/f000': b'<html>Service Unavailable</html>'})
+        slug, url = fetch.forecast_url(datetime(2015, 5, 24, 0), 0)
+        self.assertFalse(fetch.download(url, fetch.grib_path(slug)))
+        self.assertEqual(os.listdir(os.path.join(self.folder, slug)), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
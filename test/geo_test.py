@@ -0,0 +1,40 @@
+import unittest
+
+import geo
+
+
+class GridTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.resolution = geo.GFS_RESOLUTION
+
+    def tearDown(self):
+        geo.GFS_RESOLUTION = self.resolution
+
+    def test_grid_size(self):
+        self.assertEqual(geo.grid_size(0.5), (720, 361))
+        self.assertEqual(geo.grid_size(0.25), (1440, 721))
+
+    def test_xy_half_degree(self):
+        geo.GFS_RESOLUTION = 0.5
+        self.assertEqual(geo.xy(90, 0), "0x0")
+        self.assertEqual(geo.xy(52.37, 4.89), "9x75")
+        self.assertEqual(geo.xy(-90, 359.5), "719x360")
+        self.assertEqual(geo.xy(0, -0.5), "719x180")
+
+    def test_xy_quarter_degree(self):
+        geo.GFS_RESOLUTION = 0.25
+        nx, ny = geo.grid_size(0.25)
+        self.assertEqual(geo.xy(90, 0), "0x0")
+        self.assertEqual(geo.xy(52.37, 4.89), "19x150")
+        # the last column and the south pole are the last points of the grid
+        self.assertEqual(geo.xy(-90, 359.75), "%dx%d" % (nx - 1, ny - 1))
+        self.assertEqual(geo.xy(-89.75, 359.75), "1439x719")
+        # west of Greenwich is east of 180
+        self.assertEqual(geo.xy(0, -0.25), "1439x360")
+        self.assertEqual(geo.xy(0, -180), "720x360")
+        self.assertEqual(geo.xy(0, 360), "0x360")
+
+
+if __name__ == '__main__':
+    unittest.main()
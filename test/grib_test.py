@@ -0,0 +1,79 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import grib
+
+HERE = os.path.dirname(__file__)
+GRIB_PATH = os.path.join(HERE, "pwat.grib")     # complex packing, second order spatial differencing
+JSON_PATH = os.path.join(HERE, "pwat.json")     # the same field as grib2json would write it
+
+
+class GribTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_decode_matches_grib2json(self):
+        header, data = grib.decode(GRIB_PATH)
+        json_header, json_data = grib.load_with_grib2json('grib2json', GRIB_PATH, JSON_PATH)
+        for key in ('lo1', 'la1', 'dx', 'dy', 'nx', 'ny'):
+            self.assertEqual(header[key], json_header[key])
+        self.assertEqual(data.dtype, np.float32)
+        self.assertEqual(data.shape, (19, 36))
+        np.testing.assert_allclose(data, json_data, atol=1e-4)
+
+    def test_decode_in_chunks(self):
+        header, data = grib.decode(GRIB_PATH)
+        chunk_size = grib.CHUNK_SIZE
+        grib.CHUNK_SIZE = 100
+        try:
+            np.testing.assert_array_equal(grib.decode(GRIB_PATH)[1], data)
+        finally:
+            grib.CHUNK_SIZE = chunk_size
+
+    def test_load_caches_npy(self):
+        path = os.path.join(self.tmp, "GFS_half_degree.2015052412.pwat.grib")
+        shutil.copy(GRIB_PATH, path)
+        header, data = grib.load(path)
+        npy_path = os.path.join(self.tmp, "GFS_half_degree.2015052412.pwat.npy")
+        self.assertTrue(os.path.exists(npy_path))
+
+        cached_header, cached_data = grib.load(path)
+        self.assertIsInstance(cached_data, np.memmap)
+        self.assertEqual(cached_header, header)
+        np.testing.assert_array_equal(cached_data, data)
+
+    def test_load_caches_flipped_header(self):
+        # The same field, with its rows running from south to north
+        with open(GRIB_PATH, 'rb') as f:
+            message = bytearray(f.read())
+        offset = 16
+        while message[offset + 4] != 3:
+            offset += int.from_bytes(message[offset:offset + 4], 'big')
+        message[offset + 71] |= 0x40
+        path = os.path.join(self.tmp, "GFS_half_degree.2015052412.pwat.grib")
+        with open(path, 'wb') as f:
+            f.write(message)
+
+        header, data = grib.load(path)
+        south_north, _ = grib.decode(GRIB_PATH)
+        self.assertEqual((header['la1'], header['la2']), (south_north['la2'], south_north['la1']))
+        cached_header, cached_data = grib.load(path)
+        self.assertIsInstance(cached_data, np.memmap)
+        self.assertEqual(cached_header, header)
+        np.testing.assert_array_equal(cached_data, data)
+
+    def test_not_a_grib_file(self):
+        with self.assertRaises(grib.GribError):
+            grib.decode(JSON_PATH)
+
+
+if __name__ == '__main__':
+    unittest.main()
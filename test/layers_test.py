@@ -0,0 +1,138 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+
+import numpy as np
+import pytz
+from PIL import Image, ImageOps, ImageEnhance, ImageChops
+
+import barrel
+import layers
+import solar
+
+
+def legacy_pngs(data, sun_mask_array, sun_x, sun_y):
+    """ How find_rainclouds built its images with PIL, returning them as PNG bytes """
+    nj, ni = data.shape
+    values = data.ravel().tolist()
+    pngs = {}
+
+    def png(name, image):
+        f = io.BytesIO()
+        image.save(f, format="PNG")
+        pngs[name] = f.getvalue()
+
+    cloud_layer = Image.new("L", (ni, nj))
+    cloud_layer.putdata(list(map(lambda prec: int(255 - prec * 3), values)))
+    cloud_layer_greyscale = cloud_layer
+    png("greyscale", cloud_layer_greyscale)
+
+    alpha_layer = Image.new("LA", (ni, nj))
+    alpha_layer.putdata(list(map(lambda p: (255, int(255-(255-p*6))), values)))
+    png("alpha", alpha_layer)
+
+    cloud_layer = ImageEnhance.Contrast(cloud_layer).enhance(80)
+    cloud_layer = cloud_layer.point(lambda p: p > 191 and 255)
+    cloud_layer_greyscale.paste(cloud_layer, (0, 0), cloud_layer)
+
+    sun_mask = Image.fromarray(sun_mask_array)
+    sun_mask.putpixel((sun_x, sun_y), 255)
+
+    translate_x = ni // 2 - sun_x
+    png("not_inverted", cloud_layer)
+    cloud_layer = ImageChops.offset(cloud_layer, translate_x, 0)
+    cloud_layer = ImageOps.invert(cloud_layer)
+    extruded_cloud_layer = ImageOps.invert(Image.fromarray(barrel.distort(cloud_layer, sun_y)))
+    cloud_layer.paste(extruded_cloud_layer, (0, 0), extruded_cloud_layer)
+    cloud_layer = ImageChops.offset(cloud_layer, translate_x * -1, 0)
+    png("without_sun_mask", cloud_layer)
+    cloud_layer.paste(ImageOps.invert(sun_mask), (0, 0), ImageOps.invert(sun_mask))
+    png("rainbows", cloud_layer)
+
+    cloud_layer_greyscale.paste(ImageOps.invert(sun_mask), (0, 0), ImageOps.invert(sun_mask))
+    png("greymasked", cloud_layer_greyscale)
+    return pngs
+
+
+def array_pngs(data, sun_mask, sun_x, sun_y):
+    """ The same images from layers.py """
+    nj, ni = data.shape
+    clouds = layers.cloud_layers(data)
+    rainbows = layers.rainbow_layers(clouds, sun_mask, sun_x, sun_y)
+    alpha = Image.merge("LA", (Image.new("L", (ni, nj), 255), Image.fromarray(clouds.alpha)))
+    images = {
+        "greyscale": Image.fromarray(clouds.greyscale),
+        "alpha": alpha,
+        "not_inverted": Image.fromarray(rainbows.not_inverted),
+        "without_sun_mask": Image.fromarray(rainbows.without_sun_mask),
+        "rainbows": Image.fromarray(rainbows.rainbows),
+        "greymasked": Image.fromarray(rainbows.greymasked),
+    }
+    pngs = {}
+    for name, image in images.items():
+        f = io.BytesIO()
+        image.save(f, format="PNG")
+        pngs[name] = f.getvalue()
+    return pngs
+
+
+class LayersTestCase(unittest.TestCase):
+
+    def test_pngs_are_identical_to_pil_pipeline(self):
+        random = np.random.RandomState(42)
+        for when in [datetime(2015, 5, 24, 6, 0, 0, tzinfo=pytz.UTC),
+                     datetime(2015, 11, 2, 15, 0, 0, tzinfo=pytz.UTC)]:
+            # precipitable water in kg/m², with some very wet spots beyond the colour range
+            data = (random.gamma(2.0, 9.0, (361, 720)) + random.choice([0, 60], (361, 720), p=[0.95, 0.05])).astype(np.float32)
+            altitudes, (sun_x, sun_y) = solar.altitude_grid(when, 0.0, 90.0, 0.5, 0.5, 720, 361)
+            sun_mask = solar.sun_mask(altitudes)
+
+            expected = legacy_pngs(data, sun_mask, sun_x, sun_y)
+            actual = array_pngs(data, sun_mask, sun_x, sun_y)
+            self.assertEqual(sorted(actual), sorted(expected))
+            for name in expected:
+                self.assertEqual(actual[name], expected[name], "%s differs" % name)
+
+    def test_rainbows_at_the_cloud_edge_away_from_the_sun(self):
+        when = datetime(2015, 5, 24, 6, 0, 0, tzinfo=pytz.UTC)
+        altitudes, (sun_x, sun_y) = solar.altitude_grid(when, 0.0, 90.0, 0.5, 0.5, 720, 361)
+        self.assertEqual((sun_x, sun_y), (178, 139))
+
+        data = np.zeros((361, 720), dtype=np.float32)
+        data[120:160, 300:330] = 80
+        rainbows = layers.rainbow_layers(layers.cloud_layers(data), solar.sun_mask(altitudes), sun_x, sun_y).rainbows
+        ys, xs = np.nonzero(rainbows == 0)
+        self.assertEqual(set(xs), {330})
+        self.assertEqual(set(ys), set(range(120, 160)))
+
+    def test_debug_images_are_drawn_from_the_bundle(self):
+        folder = tempfile.mkdtemp()
+        try:
+            slug = '2015052406'
+            random = np.random.RandomState(0)
+            greymasked = random.randint(0, 256, (361, 720)).astype(np.uint8)
+            extruded = (random.randint(0, 2, (361, 720)) * 255).astype(np.uint8)
+            layers.save_debug_layers(folder, slug, greymasked=greymasked, extruded=extruded)
+            self.assertEqual(os.listdir(folder), ["GFS_half_degree.2015052406.layers.npz"])
+
+            filename = "GFS_half_degree.clouds_greymasked.before_russia.2015052406.pwat.png"
+            path = layers.render_debug_image(folder, slug, filename)
+            self.assertEqual(path, os.path.join(folder, filename))
+            np.testing.assert_array_equal(np.asarray(Image.open(path)), greymasked)
+
+            # the black and white layers are kept as bits
+            filename = "GFS_half_degree.cloud_mask.extruded.2015052406.pwat.png"
+            path = layers.render_debug_image(folder, slug, filename)
+            np.testing.assert_array_equal(np.asarray(Image.open(path)), extruded)
+
+            self.assertIsNone(layers.render_debug_image(folder, slug, "GFS_half_degree.sun_mask.2015052406.pwat.png"))
+            self.assertIsNone(layers.render_debug_image(folder, slug, "GFS_half_degree.2015052406.pwat.grib"))
+        finally:
+            shutil.rmtree(folder)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import time
+import random
+import unittest
+
+import numpy as np
+
+import nearby
+
+
+def city(name, lat, lng):
+    return {'name_en': name, 'latitude': lat, 'longitude': lng}
+
+
+CITIES = [city('Moscow', 55.75, 37.62),
+          city('Khimki', 55.89, 37.44),
+          city('Podolsk', 55.43, 37.54),
+          city('Tver', 56.86, 35.9),
+          city('Anadyr', 64.73, 177.51),
+          city('Provideniya', 64.42, -173.23),
+          city('Longyearbyen', 78.22, 15.65)]
+
+
+class NearbyTestCase(unittest.TestCase):
+
+    def names(self, cities):
+        return [c['name_en'] for c in cities]
+
+    def test_closest(self):
+        index = nearby.NearbyIndex(CITIES)
+        self.assertEqual(self.names(index.closest(55.8, 37.6)), ['Moscow', 'Khimki', 'Podolsk'])
+        self.assertEqual(self.names(index.closest(55.8, 37.6, limit=2)), ['Moscow', 'Khimki'])
+        self.assertEqual(self.names(index.closest(56.8, 36.0)), ['Tver'])
+        self.assertEqual(index.closest(0, 0), [])
+
+    def test_date_line(self):
+        index = nearby.NearbyIndex(CITIES)
+        # Provideniya is some 450 km from Anadyr, across the date line
+        self.assertEqual(self.names(index.closest(64.5, 179.9, max_distance=500)), ['Anadyr', 'Provideniya'])
+        self.assertEqual(self.names(index.closest(64.5, -179.9, max_distance=500)), ['Anadyr', 'Provideniya'])
+        self.assertEqual(self.names(index.closest(64.5, -175, max_distance=500)), ['Provideniya', 'Anadyr'])
+        self.assertEqual(self.names(index.closest(64.5, 185 + 360, max_distance=500)), ['Provideniya', 'Anadyr'])
+
+    def test_brute_force(self):
+        rng = random.Random(1)
+        cities = [city(str(i), rng.uniform(-90, 90), rng.uniform(-180, 180)) for i in range(5000)]
+        lats = np.array([c['latitude'] for c in cities])
+        lngs = np.array([c['longitude'] for c in cities])
+        index = nearby.NearbyIndex(cities)
+        for _ in range(200):
+            lat, lng = rng.uniform(-90, 90), rng.uniform(-180, 180)
+            d = nearby.distances(lat, lng, lats, lngs)
+            expected = [cities[i]['name_en'] for i in np.argsort(d, kind='stable') if d[i] < 300][:5]
+            self.assertEqual(self.names(index.closest(lat, lng, max_distance=300)), expected)
+        start = time.time()
+        for _ in range(1000):
+            index.closest(55.8, 37.6)
+        self.assertLess(time.time() - start, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
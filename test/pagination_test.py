@@ -0,0 +1,33 @@
+import datetime
+import unittest
+
+from werkzeug.exceptions import BadRequest
+
+import pagination
+
+
+class PaginationTestCase(unittest.TestCase):
+
+    def test_token(self):
+        # Mongo keeps milliseconds
+        photo = {'id': 'abc:1_1460000000', 'created': datetime.datetime(2016, 4, 7, 3, 33, 20, 123000)}
+        token = pagination.encode_token(photo)
+        self.assertNotIn('=', token)
+        self.assertEqual(pagination.decode_token(token), (photo['created'], photo['id']))
+
+    def test_bad_token(self):
+        for token in ('', 'abc', 'bm8tY29sb24', 'MTIzNDV4OmFiYw', '!!!!'):
+            with self.assertRaises(BadRequest):
+                pagination.decode_token(token)
+
+    def test_before(self):
+        created = datetime.datetime(2016, 4, 7, 3, 33, 20, 123000)
+        token = pagination.encode_token({'id': 'abc_1460000000', 'created': created})
+        self.assertEqual(pagination.before({'user_id': 'abc'}, token),
+                         {'$and': [{'user_id': 'abc'},
+                                   {'$or': [{'created': {'$lt': created}},
+                                            {'created': created, 'id': {'$lt': 'abc_1460000000'}}]}]})
+
+
+if __name__ == '__main__':
+    unittest.main()
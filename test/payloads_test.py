@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+import os
+import gzip
+import json
+import shutil
+import tempfile
+import unittest
+
+from werkzeug.http import parse_accept_header
+from werkzeug.datastructures import Accept
+
+import payloads
+
+CITIES = [{'name': u'Москва', 'name_en': 'Moscow', 'latitude': 55.75, 'longitude': 37.62}] * 30
+
+
+class PayloadsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'api', 'cities.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_cities_body(self):
+        body = payloads.cities_body(CITIES)
+        self.assertEqual(json.loads(body.decode('utf-8')), {'cities': CITIES[:20]})
+        self.assertNotIn(b' ', body)
+        self.assertEqual(json.loads(payloads.cities_list(body)), CITIES[:20])
+
+    def test_publish(self):
+        body = payloads.cities_body(CITIES)
+        payloads.publish(self.path, body)
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), body)
+        with gzip.open(self.path + '.gz') as f:
+            self.assertEqual(f.read(), body)
+        self.assertLess(os.path.getsize(self.path + '.gz'), len(body) / 10)
+        self.assertEqual(os.path.exists(self.path + '.br'), payloads.brotli is not None)
+
+    def test_choose(self):
+        payloads.publish(self.path, payloads.cities_body(CITIES))
+        accept = lambda header: parse_accept_header(header, Accept)
+        self.assertEqual(payloads.choose(self.path, accept('gzip, deflate')), (self.path + '.gz', 'gzip'))
+        self.assertEqual(payloads.choose(self.path, accept('')), (self.path, None))
+        self.assertEqual(payloads.choose(self.path, accept('gzip;q=0')), (self.path, None))
+        if payloads.brotli:
+            self.assertEqual(payloads.choose(self.path, accept('gzip, br')), (self.path + '.br', 'br'))
+        else:
+            self.assertEqual(payloads.choose(self.path, accept('gzip, br')), (self.path + '.gz', 'gzip'))
+
+
+if __name__ == '__main__':
+    unittest.main()
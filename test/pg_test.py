@@ -0,0 +1,133 @@
+import logging
+import threading
+import unittest
+
+import psycopg2
+
+import pg
+import utils
+
+logging.getLogger(utils.LOGGER_NAME).handlers = [logging.NullHandler()]
+
+
+class Connection(object):
+    """ Enough of a psycopg2 connection to pool """
+
+    def __init__(self, dsn):
+        self.closed = 0
+        self.dead = False
+        self.log = []
+
+    def cursor(self, **kwargs):
+        return Cursor(self)
+
+    def commit(self):
+        self.log.append('commit')
+
+    def rollback(self):
+        self.log.append('rollback')
+
+    def close(self):
+        self.closed = 1
+
+
+class Cursor(object):
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, query, params=None):
+        if self.conn.dead:
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+        self.conn.log.append(query)
+
+    def close(self):
+        pass
+
+
+class PoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.connections = []
+        self.pool = pg.Pool('dbname=test', size=2, connect=self.connect)
+
+    def connect(self, dsn):
+        conn = Connection(dsn)
+        self.connections.append(conn)
+        return conn
+
+    def test_reuse(self):
+        with self.pool.cursor() as cur:
+            cur.execute("SELECT 1")
+        with self.pool.cursor() as cur:
+            cur.execute("SELECT 2")
+        self.assertEqual(len(self.connections), 1)
+        self.assertEqual(self.connections[0].log, ["SELECT 1", 'commit', "SELECT 2", 'commit'])
+        self.assertEqual(self.pool.stats()['checkouts'], 2)
+
+    def test_rollback(self):
+        with self.assertRaises(psycopg2.ProgrammingError):
+            with self.pool.cursor() as cur:
+                cur.execute("SELECT * FROM nowhere")
+                raise psycopg2.ProgrammingError("relation \"nowhere\" does not exist")
+        self.assertEqual(self.connections[0].log[-1], 'rollback')
+        with self.pool.cursor() as cur:
+            cur.execute("SELECT 1")
+        self.assertEqual(len(self.connections), 1)
+
+    def test_broken(self):
+        with self.assertRaises(psycopg2.OperationalError):
+            with self.pool.cursor() as cur:
+                self.connections[0].dead = True
+                cur.execute("SELECT 1")
+        self.assertTrue(self.connections[0].closed)
+        with self.pool.cursor() as cur:
+            cur.execute("SELECT 1")
+        self.assertEqual(len(self.connections), 2)
+
+    def test_health_check(self):
+        self.pool.check_after = 0
+        with self.pool.cursor() as cur:
+            cur.execute("SELECT 2")
+        # the server went away while the connection was idle
+        self.connections[0].dead = True
+        with self.pool.cursor() as cur:
+            cur.execute("SELECT 2")
+        self.assertEqual(len(self.connections), 2)
+        self.assertEqual(self.connections[1].log, ["SELECT 2", 'commit'])
+        self.assertEqual(self.pool.stats()['reconnects'], 1)
+
+    def test_wait(self):
+        held = threading.Event()
+        release = threading.Event()
+
+        def hold():
+            with self.pool.connection():
+                held.set()
+                release.wait()
+
+        threads = [threading.Thread(target=hold) for _ in range(2)]
+        for t in threads:
+            t.start()
+        held.wait()
+        threading.Timer(0.2, release.set).start()
+        with self.pool.cursor() as cur:
+            cur.execute("SELECT 1")
+        for t in threads:
+            t.join()
+        self.assertEqual(len(self.connections), 2)
+        self.assertGreater(self.pool.stats()['wait_seconds'], 0.1)
+
+    def test_fork(self):
+        with self.pool.connection():
+            pass
+        # as if this were a child process
+        self.pool.pid = -1
+        with self.pool.connection():
+            pass
+        self.assertEqual(len(self.connections), 2)
+        self.assertFalse(self.connections[0].closed)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the push dispatcher, against a stub of pushy.me on localhost.
+
+Run with `bench` to measure how many pushes a second go out:
+
+    PYTHONPATH=. python test/push_test.py bench 1000
+"""
+import sys
+import json
+import time
+import threading
+import unittest
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+
+import push
+
+
+class StubPushy(ThreadingMixIn, HTTPServer):
+    """ Accepts pushes like pushy.me, after `delay` seconds. The first `fail` requests get a 500. """
+    daemon_threads = True
+
+    def __init__(self, delay=0, fail=0):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), StubHandler)
+        self.delay = delay
+        self.fail = fail
+        self.received = []
+        self.connections = set()
+        self.lock = threading.Lock()
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d/push?api_key=' % self.server_port
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8'))
+        time.sleep(self.server.delay)
+        with self.server.lock:
+            self.server.connections.add(self.client_address)
+            if self.server.fail > 0:
+                self.server.fail -= 1
+                status = 500
+            else:
+                self.server.received.append(body)
+                status = 200
+        response = json.dumps({"success": status == 200}).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, *args):
+        pass
+
+
+class PushTestCase(unittest.TestCase):
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_send(self):
+        self.server = StubPushy()
+        messages = [(u"Радуга %d" % i, ['/topics/city-%d' % i]) for i in range(20)]
+        summary = push.Dispatcher(self.server.url + 'key', workers=4).send(messages)
+        self.assertEqual((summary.delivered, summary.failed, summary.requests, summary.retries), (20, [], 20, 0))
+        self.assertEqual(sorted(b['to'] for b in self.server.received), sorted(c[0] for m, c in messages))
+        self.assertIn({"to": "/topics/city-3", "data": {"message": u"Радуга 3"}}, self.server.received)
+        # connections are kept alive: no more than one per worker
+        self.assertLessEqual(len(self.server.connections), 4)
+
+    def test_batches(self):
+        self.server = StubPushy()
+        messages = [(u"a", ['/topics/1']), (u"b", ['/topics/2']), (u"a", ['/topics/3', '/topics/4']), (u"a", ['/topics/5'])]
+        self.assertEqual(list(push.batches(messages, 3)),
+                         [(u"a", ['/topics/1', '/topics/3', '/topics/4']), (u"a", ['/topics/5']), (u"b", ['/topics/2'])])
+        summary = push.Dispatcher(self.server.url, max_topics=3).send(messages)
+        self.assertEqual((summary.delivered, summary.requests), (5, 3))
+        self.assertIn({"to": ['/topics/1', '/topics/3', '/topics/4'], "data": {"message": u"a"}}, self.server.received)
+
+    def test_retry(self):
+        self.server = StubPushy(fail=2)
+        summary = push.Dispatcher(self.server.url, workers=1, backoff=0.01).send([(u"a", ['/topics/1'])])
+        self.assertEqual((summary.delivered, summary.retries), (1, 2))
+
+    def test_give_up(self):
+        self.server = StubPushy(fail=10)
+        log = []
+        summary = push.Dispatcher(self.server.url, retries=2, backoff=0.01).send([(u"a", ['/topics/1'])], log=log.append)
+        self.assertEqual((summary.delivered, summary.failed, summary.retries), (0, ['/topics/1'], 2))
+        self.assertEqual(log, [u'PUSH TO /topics/1 → result: {"success": false}'])
+
+
+def bench(n=1000, delay=0.02):
+    server = StubPushy(delay=delay)
+    messages = [(u"message %d" % i, ['/topics/city-%d' % i]) for i in range(n)]
+    for workers in (1, 8, 32):
+        summary = push.Dispatcher(server.url, workers=workers).send(messages)
+        print("%3d workers: %d pushes in %.2fs, %.0f/s" % (workers, summary.delivered, summary.seconds, summary.delivered / summary.seconds))
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'bench':
+        bench(*[int(a) for a in sys.argv[2:3]])
+    else:
+        unittest.main()
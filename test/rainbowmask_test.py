@@ -0,0 +1,68 @@
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+
+import numpy as np
+import pytz
+
+import rainbowmask
+
+
+class RainbowMaskTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_write_and_load(self):
+        grid = np.zeros((361, 720), dtype=bool)
+        grid[120:160, 330] = True
+        grid[0, 0] = grid[360, 719] = True
+        header = {'lo1': 0.0, 'la1': 90.0, 'dx': 0.5, 'dy': 0.5, 'nx': 720, 'ny': 361}
+        date = datetime(2015, 5, 24, 6, 0, 0, tzinfo=pytz.UTC)
+
+        path = rainbowmask.path_for(self.tmp, '2015052406')
+        rainbowmask.write(path, grid, header, date)
+        self.assertEqual(os.path.getsize(path), 64 + (720 * 361 + 7) // 8)
+
+        mask = rainbowmask.load(path)
+        self.assertIsInstance(mask.bits, np.memmap)
+        self.assertEqual((mask.nx, mask.ny, mask.lo1, mask.la1, mask.dx, mask.dy), (720, 361, 0.0, 90.0, 0.5, 0.5))
+        self.assertEqual(mask.date, date)
+        self.assertEqual(mask.count(), 42)
+        np.testing.assert_array_equal(mask.grid, grid)
+        xs, ys = mask.points()
+        self.assertEqual(sorted(zip(xs, ys))[:2], [(0, 0), (330, 120)])
+
+    def test_empty(self):
+        path = rainbowmask.path_for(self.tmp, '2015052406')
+        rainbowmask.write(path, np.zeros((361, 720), dtype=bool), {'lo1': 0.0, 'la1': 90.0, 'dx': 0.5, 'dy': 0.5},
+                          datetime(2015, 5, 24, 6, 0, 0, tzinfo=pytz.UTC))
+        mask = rainbowmask.load(path)
+        self.assertTrue(mask)
+        self.assertEqual(mask.count(), 0)
+
+    def test_truncated(self):
+        path = rainbowmask.path_for(self.tmp, '2015052406')
+        rainbowmask.write(path, np.ones((361, 720), dtype=bool), {'lo1': 0.0, 'la1': 90.0, 'dx': 0.5, 'dy': 0.5},
+                          datetime(2015, 5, 24, 6, 0, 0, tzinfo=pytz.UTC))
+        with open(path, 'r+b') as f:
+            f.truncate(1000)
+        with self.assertRaises(IOError) as e:
+            rainbowmask.load(path)
+        self.assertIn("should be 32554 bytes for a 720x361 grid, not 1000", str(e.exception))
+
+    def test_not_a_mask(self):
+        path = os.path.join(self.tmp, 'not-a-mask')
+        with open(path, 'wb') as f:
+            f.write(b'\0' * 128)
+        with self.assertRaises(IOError):
+            rainbowmask.load(path)
+
+
+if __name__ == '__main__':
+    unittest.main()
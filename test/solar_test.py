@@ -0,0 +1,66 @@
+import unittest
+from datetime import datetime
+
+import numpy as np
+import pytz
+from pysolar.solar import get_altitude_fast
+
+import solar
+
+
+DATES = [datetime(2015, 5, 24, 11, 0, 0, tzinfo=pytz.UTC),
+         datetime(2014, 12, 21, 18, 0, 0, tzinfo=pytz.UTC),
+         datetime(2016, 3, 20, 3, 30, 0, tzinfo=pytz.UTC)]
+
+
+def legacy_sun_mask(when, lo1, la1, dx, dy, nx, ny):
+    """ The loop water.py used to run, calling pysolar for every grid point """
+    latitude = la1
+    longitude = lo1
+    altitudes = []
+    for j in range(ny):
+        for i in range(nx):
+            altitudes.append(get_altitude_fast(latitude, longitude, when))
+            longitude += dx
+        latitude += dy
+    mask = np.array([255 if 42 > a > 0 else 0 for a in altitudes], dtype=np.uint8).reshape(ny, nx)
+    mask = np.roll(mask, nx // 2, axis=1)
+    sun_i = altitudes.index(max(altitudes))
+    return mask, ((sun_i + nx // 2) % nx, sun_i // nx)
+
+
+class SolarTestCase(unittest.TestCase):
+
+    def test_altitudes_match_pysolar(self):
+        for when in DATES:
+            altitudes, _ = solar.altitude_grid(when, 0.0, 90.0, 0.5, 0.5, 720, 361)
+            self.assertEqual(altitudes.shape, (361, 720))
+            for y in range(0, 361, 19):
+                for x in range(0, 720, 23):
+                    expected = get_altitude_fast(90.0 - y * 0.5, x * 0.5, when)
+                    self.assertAlmostEqual(altitudes[y, x], expected, places=6)
+
+    def test_sun_mask_and_position_match_legacy_loop(self):
+        grid = (0.0, 90.0, 2.5, 2.5, 144, 73)
+        for when in DATES:
+            altitudes, sun_position = solar.altitude_grid(when, *grid)
+            mask, legacy_sun_position = legacy_sun_mask(when, *grid)
+            np.testing.assert_array_equal(solar.sun_mask(altitudes), mask)
+            self.assertEqual(sun_position, legacy_sun_position)
+
+    def test_sun_masks_match_altitude_grid(self):
+        for grid in [(0.0, 90.0, 2.5, 2.5, 144, 73), (0.0, 90.0, 0.5, 0.5, 720, 361)]:
+            masks, suns = solar.sun_masks(DATES, *grid)
+            for when, mask, sun in zip(DATES, masks, suns):
+                altitudes, sun_position = solar.altitude_grid(when, *grid)
+                np.testing.assert_array_equal(mask, solar.sun_mask(altitudes))
+                self.assertEqual(sun, sun_position)
+
+    def test_subsolar_point(self):
+        when = DATES[0]
+        latitude, longitude = solar.subsolar_point(when)
+        self.assertAlmostEqual(get_altitude_fast(latitude, longitude, when), 90.0, places=6)
+
+
+if __name__ == '__main__':
+    unittest.main()
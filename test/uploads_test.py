@@ -0,0 +1,74 @@
+import io
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from werkzeug.test import EnvironBuilder
+from werkzeug.wrappers import Request
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge
+
+import uploads
+
+PHOTO = b'\xff\xd8\xff\xe0' + os.urandom(200 * 1024) + b'\xff\xd9'
+
+
+def request(**kwargs):
+    return Request(EnvironBuilder(method='POST', **kwargs).get_environ())
+
+
+class UploadsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'abc_1.jpg')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def stored(self):
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    def test_raw(self):
+        meta = uploads.receive(request(data=PHOTO, content_type='image/jpeg',
+                                       query_string={'meta': json.dumps({'lat': 55.7, 'lng': 37.6})}), self.path)
+        self.assertEqual(meta, {'lat': 55.7, 'lng': 37.6})
+        self.assertEqual(self.stored(), PHOTO)
+        self.assertEqual(os.listdir(self.folder), ['abc_1.jpg'])
+
+    def test_multipart(self):
+        meta = uploads.receive(request(data={'photo': (io.BytesIO(PHOTO), 'photo.jpg', 'image/jpeg'),
+                                             'meta': json.dumps({'lat': 55.7, 'lng': 37.6})}), self.path)
+        self.assertEqual(meta, {'lat': 55.7, 'lng': 37.6})
+        self.assertEqual(self.stored(), PHOTO)
+        self.assertEqual(os.listdir(self.folder), ['abc_1.jpg'])
+
+    def test_no_meta(self):
+        self.assertEqual(uploads.receive(request(data=PHOTO), self.path), {})
+
+    def test_too_large(self):
+        with self.assertRaises(RequestEntityTooLarge):
+            uploads.receive(request(data=PHOTO), self.path, limit=100 * 1024)
+        # without Content-Length, it is only found out while streaming
+        with self.assertRaises(RequestEntityTooLarge):
+            uploads.save_stream(io.BytesIO(PHOTO), self.path, limit=100 * 1024)
+        with self.assertRaises(RequestEntityTooLarge):
+            uploads.receive(request(data={'photo': (io.BytesIO(PHOTO), 'photo.jpg')}), self.path, limit=100 * 1024)
+        self.assertEqual(os.listdir(self.folder), [])
+
+    def test_bad_request(self):
+        with self.assertRaises(BadRequest):
+            uploads.receive(request(data=PHOTO, query_string={'meta': '{"lat'}), self.path)
+        with self.assertRaises(BadRequest):
+            uploads.receive(request(data={'photo': (io.BytesIO(PHOTO), 'photo.jpg'), 'meta': '[1]'}), self.path)
+        with self.assertRaises(BadRequest):
+            uploads.receive(request(data={'meta': '{}'}, content_type='multipart/form-data'), self.path)
+        with self.assertRaises(BadRequest):
+            uploads.receive(request(data=b''), self.path)
+        self.assertEqual(os.listdir(self.folder), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+import os
+import shutil
+import logging
+import tempfile
+import threading
+import unittest
+
+import flask
+
+import utils
+
+
+def process(slug):
+    logger = logging.getLogger(utils.LOGGER_NAME)
+    logger.debug("start %s" % slug)
+    if slug == '2015052406':
+        raise ValueError("broken GRIB file")
+    logger.debug("done %s" % slug)
+    return slug != '2015052412'
+
+
+class ProcessSlugsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = logging.getLogger(utils.LOGGER_NAME)
+        self.logger.setLevel(logging.DEBUG)
+        self.records = []
+        self.handler = utils.RecordingHandler(self.records)
+        self.logger.addHandler(self.handler)
+
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+
+    def check(self, jobs):
+        slugs = ['2015052418', '2015052412', '2015052406', '2015052400']
+        results = utils.process_slugs(process, slugs, jobs=jobs)
+        self.assertEqual(results, [('2015052418', True), ('2015052412', False),
+                                   ('2015052406', False), ('2015052400', True)])
+        messages = [r.msg for r in self.records]
+        self.assertEqual(messages, ['start 2015052418', 'done 2015052418',
+                                    'start 2015052412', 'done 2015052412',
+                                    'start 2015052406', 'error while processing 2015052406',
+                                    'start 2015052400', 'done 2015052400'])
+        self.assertIn("broken GRIB file", self.records[5].exc_text)
+
+    def test_serial(self):
+        self.check(jobs=1)
+
+    def test_parallel(self):
+        self.check(jobs=3)
+
+
+class EtagResponseTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = flask.Flask(__name__)
+        self.builds = 0
+
+    def build(self):
+        self.builds += 1
+        return flask.jsonify(cities=[])
+
+    def get(self, **headers):
+        with self.app.test_request_context('/app/rainbow-cities', headers=headers):
+            return utils.etag_response('abc.-', 'public, max-age=60', self.build)
+
+    def test_etag_response(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['ETag'], '"abc.-"')
+        self.assertEqual(response.headers['Cache-Control'], 'public, max-age=60')
+        response = self.get(**{'If-None-Match': '"abc.-"'})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers['ETag'], '"abc.-"')
+        self.assertEqual(response.get_data(), b'')
+        self.assertEqual(self.builds, 1)
+        self.assertEqual(self.get(**{'If-None-Match': '"abc.123:ready"'}).status_code, 200)
+        self.assertEqual(self.builds, 2)
+
+
+class ReplacingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'rainbow_cities.json')
+        with open(self.path, 'w') as f:
+            f.write('old')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def read(self):
+        with open(self.path) as f:
+            return f.read()
+
+    def test_replacing(self):
+        with utils.replacing(self.path) as tmp_path:
+            with open(tmp_path, 'w') as f:
+                f.write('new')
+            self.assertEqual(self.read(), 'old')
+        self.assertEqual(self.read(), 'new')
+        self.assertEqual(os.listdir(self.tmp), ['rainbow_cities.json'])
+
+    def test_failure_keeps_the_old_file(self):
+        with self.assertRaises(ValueError):
+            with utils.replacing(self.path) as tmp_path:
+                with open(tmp_path, 'w') as f:
+                    f.write('half')
+                raise ValueError()
+        self.assertEqual(self.read(), 'old')
+        self.assertEqual(os.listdir(self.tmp), ['rainbow_cities.json'])
+
+    def test_threads_write_their_own_files(self):
+        paths = []
+        entered = threading.Barrier(2)
+
+        def replace(text):
+            with utils.replacing(self.path) as tmp_path:
+                paths.append(tmp_path)
+                with open(tmp_path, 'w') as f:
+                    f.write(text)
+                entered.wait()
+
+        threads = [threading.Thread(target=replace, args=(text,)) for text in ('a', 'b')]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(set(paths)), 2)
+        self.assertIn(self.read(), ('a', 'b'))
+        self.assertEqual(os.listdir(self.tmp), ['rainbow_cities.json'])
+
+
+if __name__ == '__main__':
+    unittest.main()
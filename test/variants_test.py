@@ -0,0 +1,138 @@
+"""
+Run with `bench` to compare the variants to the ones ImageMagick makes, on
+your own photos or on a made up 12 megapixel one:
+
+    PYTHONPATH=. python test/variants_test.py bench [photo.jpg ...]
+"""
+import os
+import sys
+import time
+import shutil
+import datetime
+import logging
+import tempfile
+import unittest
+import subprocess
+
+from PIL import Image
+
+import utils
+import variants
+
+logging.getLogger(utils.LOGGER_NAME).handlers = [logging.NullHandler()]
+
+
+class Photos(object):
+    """ Remembers the updates to the photo documents """
+
+    def __init__(self):
+        self.updates = []
+
+    def update_one(self, query, update):
+        self.updates.append((query, update))
+
+
+def photo(path, size=(4032, 3024), orientation=None):
+    """ A JPEG like a phone makes, with a gradient so it does not compress to nothing """
+    image = Image.linear_gradient('L').resize(size).convert('RGB')
+    exif = Image.Exif()
+    if orientation:
+        exif[variants.ORIENTATION] = orientation
+    image.save(path, quality=92, exif=exif)
+    return path
+
+
+def size(path):
+    with Image.open(path) as image:
+        return image.size
+
+
+class VariantsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_placeholders(self):
+        self.assertEqual(variants.placeholders('abc_1.jpg'),
+                         {'200': 'abc_1.jpg', '400': 'abc_1.jpg', '800': 'abc_1.jpg'})
+
+    def test_make_variants(self):
+        src_file = photo(os.path.join(self.folder, 'abc_1.jpg'))
+        self.assertEqual(variants.make_variants(src_file),
+                         {'200': 'abc_1_200w.jpg', '400': 'abc_1_400w.jpg', '800': 'abc_1_800w.jpg'})
+        for width, height in ((200, 150), (400, 300), (800, 600)):
+            with Image.open(os.path.join(self.folder, 'abc_1_%dw.jpg' % width)) as image:
+                self.assertEqual(image.size, (width, height))
+                self.assertEqual(image.format, 'JPEG')
+
+    def test_orientation(self):
+        # the camera was held upright
+        src_file = photo(os.path.join(self.folder, 'abc_1.jpg'), orientation=6)
+        variants.make_variants(src_file)
+        self.assertEqual(size(os.path.join(self.folder, 'abc_1_800w.jpg')), (800, 1067))
+        self.assertEqual(size(os.path.join(self.folder, 'abc_1_200w.jpg')), (200, 267))
+
+    def test_small(self):
+        src_file = photo(os.path.join(self.folder, 'abc_1.jpg'), size=(300, 200))
+        variants.make_variants(src_file)
+        self.assertEqual(size(os.path.join(self.folder, 'abc_1_800w.jpg')), (300, 200))
+        self.assertEqual(size(os.path.join(self.folder, 'abc_1_200w.jpg')), (200, 133))
+
+    def test_ready(self):
+        photos = Photos()
+        ready = []
+        pool = variants.VariantPool(photos, on_ready=ready.append)
+        future = pool.submit('abc_1', photo(os.path.join(self.folder, 'abc_1.jpg')))
+        self.assertTrue(future.result())
+        self.assertEqual(photos.updates[0][1]['$set']['variants_status'], variants.READY)
+        self.assertEqual(ready, ['abc_1'])
+
+    def test_unfinished(self):
+        now = datetime.datetime(2015, 5, 24, 10, 30)
+        stale = {'variants_status': variants.PENDING, 'created': {'$lt': datetime.datetime(2015, 5, 24, 10, 20)}}
+        self.assertEqual(variants.unfinished(now=now), stale)
+        self.assertEqual(variants.unfinished(True, now), {'$or': [stale, {'variants_status': variants.FAILED}]})
+
+    def test_failed(self):
+        photos = Photos()
+        ready = []
+        pool = variants.VariantPool(photos, on_ready=ready.append)
+        future = pool.submit('abc_1', os.path.join(self.folder, 'abc_1.jpg'))
+        self.assertFalse(future.result())
+        self.assertEqual(photos.updates, [({'id': 'abc_1'}, {'$set': {'variants_status': variants.FAILED}})])
+        self.assertEqual(ready, [])
+
+
+def convert(src_file):
+    """ The variants the way we made them before, with ImageMagick """
+    base, ext = src_file.rsplit('.', 1)
+    for width in variants.WIDTHS:
+        subprocess.check_call(['convert', src_file, '-auto-orient', '-resize', '%dx' % width,
+                               '%s_%dw_im.%s' % (base, width, ext)])
+
+
+def bench(*photos):
+    folder = tempfile.mkdtemp()
+    if not photos:
+        photos = [photo(os.path.join(folder, 'bench_1.jpg'), orientation=6)]
+    for name, make in (('PIL', variants.make_variants), ('ImageMagick', convert)):
+        try:
+            start = time.time()
+            for src_file in photos:
+                make(src_file)
+        except OSError:
+            print("%-12s not installed" % name)
+            continue
+        seconds = time.time() - start
+        print("%-12s %d photos in %.2fs, %.0f ms a photo" % (name, len(photos), seconds, 1000 * seconds / len(photos)))
+    shutil.rmtree(folder)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'bench':
+        bench(*sys.argv[2:])
+    else:
+        unittest.main()
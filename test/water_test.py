@@ -0,0 +1,102 @@
+import os
+import shutil
+import logging
+import tempfile
+import unittest
+
+import numpy as np
+
+import utils
+import water
+
+logging.getLogger(utils.LOGGER_NAME).handlers = [logging.NullHandler()]
+
+GRIB_PATH = os.path.join(os.path.dirname(__file__), "pwat.grib")
+
+SLUGS = ['2015052400', '2015052403', '2015052406', '2015052409', '2015052412']
+
+
+class WaterTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.gfs_folder = water.GFS_FOLDER
+        water.GFS_FOLDER = self.folder
+
+    def tearDown(self):
+        water.GFS_FOLDER = self.gfs_folder
+        shutil.rmtree(self.folder)
+
+    def forecasts(self, folder, slugs):
+        for slug in slugs:
+            os.makedirs(os.path.join(folder, slug))
+            shutil.copy(GRIB_PATH, os.path.join(folder, slug, "GFS_half_degree.%s.pwat.grib" % slug))
+
+    def outputs(self, folder, slug):
+        files = {}
+        for f in sorted(os.listdir(os.path.join(folder, slug))):
+            if f.endswith('.png') or f.endswith('.mask'):
+                with open(os.path.join(folder, slug, f), 'rb') as image:
+                    files[f] = image.read()
+            elif f.endswith('.npz'):
+                with np.load(os.path.join(folder, slug, f)) as bundle:
+                    files.update((name, bundle[name]) for name in bundle.files)
+        return files
+
+    def test_batch_is_the_same_as_one_by_one(self):
+        single = os.path.join(self.folder, 'single')
+        batch = os.path.join(self.folder, 'batch')
+        self.forecasts(single, SLUGS)
+        self.forecasts(batch, SLUGS[:2] + SLUGS[3:])
+
+        water.GFS_FOLDER = single
+        grids = dict((slug, water.find_rainclouds(slug)) for slug in SLUGS)
+
+        water.GFS_FOLDER = batch
+        batch_size = water.BATCH_SIZE
+        water.BATCH_SIZE = 3
+        try:
+            batch_grids = water.find_rainclouds_batch(SLUGS)
+        finally:
+            water.BATCH_SIZE = batch_size
+
+        # the forecast without a GRIB file is left out
+        self.assertEqual(sorted(batch_grids), SLUGS[:2] + SLUGS[3:])
+        for slug in batch_grids:
+            np.testing.assert_array_equal(batch_grids[slug], grids[slug])
+            single_outputs = self.outputs(single, slug)
+            batch_outputs = self.outputs(batch, slug)
+            self.assertEqual(sorted(single_outputs), sorted(batch_outputs))
+            for name in single_outputs:
+                np.testing.assert_array_equal(np.asarray(batch_outputs[name]), np.asarray(single_outputs[name]), name)
+
+
+    def test_failing_forecast_does_not_stop_its_batch(self):
+        self.forecasts(self.folder, SLUGS)
+        load_pwat, save_rainclouds = water.load_pwat, water.save_rainclouds
+
+        def broken_load_pwat(grib_file_path, json_file_path):
+            if SLUGS[0] in grib_file_path:
+                raise OSError("permission denied")
+            header, data = load_pwat(grib_file_path, json_file_path)
+            if SLUGS[1] in grib_file_path:
+                # does not stack with the others, nor fit its own header
+                data = data[:-1]
+            return header, data
+
+        def broken_save_rainclouds(slug, *args):
+            if slug == SLUGS[2]:
+                raise IOError("disk full")
+            return save_rainclouds(slug, *args)
+
+        water.load_pwat, water.save_rainclouds = broken_load_pwat, broken_save_rainclouds
+        try:
+            grids = water.find_rainclouds_batch(SLUGS)
+        finally:
+            water.load_pwat, water.save_rainclouds = load_pwat, save_rainclouds
+        self.assertEqual(sorted(grids), SLUGS[3:])
+        for slug in SLUGS[3:]:
+            self.assertIn("GFS_half_degree.%s.pwat.png" % slug, self.outputs(self.folder, slug))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+"""
+Storing uploaded photos without holding them in memory.
+
+The photo comes either as the whole request body, with `meta` as a query
+parameter, or as the `photo` file of a multipart/form-data body, with
+`meta` as a field next to it. Either way it is written to disk in chunks
+as it comes in, and the upload is refused (413) as soon as it is larger
+than MAX_PHOTO_SIZE.
+"""
+
+import os
+import json
+import tempfile
+
+from werkzeug import formparser
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge
+
+import utils
+
+CHUNK_SIZE = 64 * 1024
+
+# Anything larger is not the photo of a rainbow
+try:
+    from settings import MAX_PHOTO_SIZE
+except ImportError:
+    MAX_PHOTO_SIZE = 20 * 1024 * 1024
+
+# meta is a bit of JSON: where and when the photo was taken
+MAX_META_SIZE = 16 * 1024
+
+# What the multipart parser may keep in memory (it reads 64 KB at a time)
+MAX_FORM_MEMORY_SIZE = 500 * 1024
+
+
+def save_stream(stream, path, limit=MAX_PHOTO_SIZE):
+    """ Copy `stream` to `path`, in chunks. Returns the number of bytes. """
+    size = 0
+    with utils.replacing(path) as tmp_path, open(tmp_path, 'wb') as f:
+        for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+            size += len(chunk)
+            if size > limit:
+                raise RequestEntityTooLarge()
+            f.write(chunk)
+    return size
+
+
+def parse_meta(meta):
+    if not meta:
+        return {}
+    if len(meta) > MAX_META_SIZE:
+        raise RequestEntityTooLarge()
+    try:
+        meta = json.loads(meta)
+    except ValueError:
+        raise BadRequest("meta is not JSON")
+    if not isinstance(meta, dict):
+        raise BadRequest("meta is not a JSON object")
+    return meta
+
+
+def receive_multipart(request, path, limit):
+    folder = os.path.dirname(path)
+    streams = []
+
+    def stream_factory(total_content_length, content_type, filename, content_length=None):
+        # Write every file in the body to disk right away
+        f = tempfile.NamedTemporaryFile(dir=folder, suffix='.part', delete=False)
+        streams.append(f)
+        return f
+
+    try:
+        _, form, files = formparser.parse_form_data(request.environ, stream_factory=stream_factory,
+                                                    max_form_memory_size=MAX_FORM_MEMORY_SIZE,
+                                                    max_content_length=limit + MAX_META_SIZE)
+        if 'photo' not in files:
+            raise BadRequest("no photo")
+        meta = parse_meta(form.get('meta'))
+        photo = files['photo'].stream
+        photo.close()
+        if os.path.getsize(photo.name) > limit:
+            raise RequestEntityTooLarge()
+        os.rename(photo.name, path)
+        return meta
+    finally:
+        for f in streams:
+            f.close()
+            if os.path.exists(f.name):
+                os.remove(f.name)
+
+
+def receive(request, path, limit=MAX_PHOTO_SIZE):
+    """ Store the photo of the upload `request` at `path`. Returns its meta. """
+    if request.content_length is not None and request.content_length > limit + MAX_META_SIZE:
+        raise RequestEntityTooLarge()
+    if request.mimetype == 'multipart/form-data':
+        meta = receive_multipart(request, path, limit)
+    else:
+        # Refuse bad meta before reading the photo
+        meta = parse_meta(request.args.get('meta'))
+        save_stream(request.stream, path, limit)
+    if not os.path.getsize(path):
+        os.remove(path)
+        raise BadRequest("no photo")
+    return meta
@@ -2,7 +2,8 @@
 """
 Utilities.
 
-For now: a logger.
+For now: a logger, a way to process forecast slugs in parallel, and a way
+to replace files that others may be reading.
 
 The logger has two possible behaviours, based on the DEBUG setting.
 
@@ -19,10 +20,15 @@ See LICENSE info below.
 
 import flask
 
+import os
 import re
 import sys
 import logging
 import getpass
+import threading
+import multiprocessing
+from contextlib import contextmanager
+from functools import partial
 
 from bson import InvalidDocument
 from datetime import datetime
@@ -100,8 +106,11 @@ class MongoHandler(logging.Handler):
                 exc_info=True)
 
 
+LOGGER_NAME = 'Радуга'
+
+
 def install_logger():
-    logger = logging.getLogger('Радуга')
+    logger = logging.getLogger(LOGGER_NAME)
     logger.setLevel(logging.DEBUG)
 
     if DEBUG:
@@ -131,7 +140,105 @@ def nocache_redirect(uri):
     return response
 
 
+def etag_response(etag, cache_control, build):
+    """
+    A 304 when the client has the version `etag` already, without calling
+    `build`; otherwise the response `build()` makes
+    """
+    if flask.request.if_none_match.contains(etag):
+        response = flask.current_app.response_class(status=304)
+    else:
+        response = build()
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+
 def city_id(city):
     if 'name_en' in city:
         city = city['name_en']
     return re.sub("[^a-z]", "", city.lower())
+
+
+@contextmanager
+def replacing(path):
+    """
+    A temporary path to write the new version of `path` to, which replaces
+    `path` at once when the block ends. If the block fails, it is removed.
+
+    Several processes, or threads, may be replacing the same file: each
+    writes its own temporary file.
+    """
+    tmp_path = "%s.%d.%d.tmp" % (path, os.getpid(), threading.current_thread().ident)
+    try:
+        yield tmp_path
+        os.rename(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class RecordingHandler(logging.Handler):
+    """ Keeps log records in a list, in a form that can be sent to another process """
+
+    def __init__(self, records):
+        logging.Handler.__init__(self)
+        self.records = records
+
+    def emit(self, record):
+        record.msg = record.getMessage()
+        record.args = ()
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        self.records.append(record)
+
+
+def _process_slug(function, slug):
+    logger = logging.getLogger(LOGGER_NAME)
+    try:
+        return function(slug) is not False
+    except Exception:
+        logger.exception("error while processing %s" % slug)
+        return False
+
+
+def _process_slug_recorded(function, slug):
+    """ In a worker process: keep the log records, to hand them to the parent """
+    logger = logging.getLogger(LOGGER_NAME)
+    records = []
+    handlers = logger.handlers
+    logger.handlers = [RecordingHandler(records)]
+    try:
+        return _process_slug(function, slug), records
+    finally:
+        logger.handlers = handlers
+
+
+def process_slugs(function, slugs, jobs=1):
+    """
+    Call `function(slug)` for every slug, in `jobs` worker processes.
+
+    An exception while processing one slug is logged, and does not stop
+    the others. The log messages of the workers are passed on slug by slug,
+    in the order of `slugs`.
+
+    Returns a list of (slug, succeeded) tuples.
+    """
+    slugs = list(slugs)
+    if jobs <= 1 or len(slugs) <= 1:
+        return [(slug, _process_slug(function, slug)) for slug in slugs]
+
+    logger = logging.getLogger(LOGGER_NAME)
+    results = []
+    pool = multiprocessing.Pool(min(jobs, len(slugs)))
+    try:
+        for slug, (succeeded, records) in zip(slugs, pool.imap(partial(_process_slug_recorded, function), slugs)):
+            for record in records:
+                logger.handle(record)
+            results.append((slug, succeeded))
+    finally:
+        pool.close()
+        pool.join()
+    return results
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+
+"""
+The smaller versions of the uploaded photos, 200, 400 and 800 pixels wide.
+
+A photo is decoded once, at the smallest scale the JPEG decoder can give
+that is still at least 800 pixels wide, and turned the right way up. Then
+every variant is scaled down from the one before it.
+
+They are made in the background, by a small pool of threads in every
+uwsgi process, so an upload returns as soon as the original is stored.
+Until then the photo document has `variants_status` 'pending', and its
+variants all point to the original. When they are ready, the document gets
+the real variants and `variants_status` 'ready' (or 'failed').
+
+Variants that were never made, because the process was restarted while
+the photo was pending, are made by
+
+    python variants.py
+
+which cron runs every 10 minutes. It leaves photos that have been pending
+for less than STALE_MINUTES alone: the app is still working on those. With
+--failed, it also tries again for the photos it could not make them for.
+"""
+
+import os
+import math
+import time
+import argparse
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageOps
+
+import utils
+
+logger = utils.install_logger()
+
+WIDTHS = (200, 400, 800)
+
+JPEG_QUALITY = 90
+
+# The EXIF tag that says which way up the camera was
+ORIENTATION = 0x0112
+
+PENDING = 'pending'
+READY = 'ready'
+FAILED = 'failed'
+
+# How many photos every uwsgi process resizes at the same time
+try:
+    from settings import PHOTO_WORKERS
+except ImportError:
+    PHOTO_WORKERS = 2
+
+# Minutes after which nobody is making the variants of a pending photo anymore
+try:
+    from settings import STALE_MINUTES
+except ImportError:
+    STALE_MINUTES = 10
+
+
+def variant_path(src_file, width):
+    base, ext = os.path.basename(src_file).split(".", 2)
+    return os.path.join(os.path.dirname(src_file), "%s_%dw.%s" % (base, width, ext))
+
+
+def decode(image, width):
+    """
+    Decode the opened `image` once, big enough for a variant `width` pixels
+    wide, and turned the way its EXIF orientation says
+    """
+    # When it is turned a quarter, our width is its height
+    turned = image.getexif().get(ORIENTATION) in (5, 6, 7, 8)
+    w, h = image.size[::-1] if turned else image.size
+    if w > width:
+        size = (width, int(math.ceil(width * h / float(w))))
+        # A JPEG decoder can scale down by 1/2, 1/4 or 1/8 right away, as long as it stays at least this big
+        image.draft('RGB', size[::-1] if turned else size)
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    return image
+
+
+def make_variants(src_file):
+    """
+    Make the variants of `src_file`, a dict of width → filename. Every
+    variant is made from the next larger one, and none is larger than the
+    original.
+    """
+    widths = sorted(WIDTHS, reverse=True)
+    with Image.open(src_file) as original:
+        image = decode(original, widths[0])
+    variants = {}
+    for width in widths:
+        if image.width > width:
+            height = max(1, int(round(image.height * width / float(image.width))))
+            image = image.resize((width, height), Image.LANCZOS)
+        target_file = variant_path(src_file, width)
+        image.save(target_file, quality=JPEG_QUALITY)
+        variants[str(width)] = os.path.basename(target_file)
+    return variants
+
+
+def placeholders(filename):
+    """ The variants to show while the real ones are being made: the original """
+    return dict([(str(w), filename) for w in WIDTHS])
+
+
+def unfinished(failed=False, now=None):
+    """ The query for the photos that have been pending for STALE_MINUTES, and with `failed` the failed ones """
+    now = now or datetime.datetime.utcnow()
+    stale = {'variants_status': PENDING, 'created': {'$lt': now - datetime.timedelta(minutes=STALE_MINUTES)}}
+    if failed:
+        return {'$or': [stale, {'variants_status': FAILED}]}
+    return stale
+
+
+class VariantPool(object):
+
+    def __init__(self, photos, workers=PHOTO_WORKERS, on_ready=None):
+        self.photos = photos
+        self.workers = workers
+        self.on_ready = on_ready
+        self.lock = threading.Lock()
+        self.executor = None
+
+    def submit(self, photo_id, src_file):
+        """ Make the variants of the photo in the background """
+        with self.lock:
+            # Only start the threads in the process that uses them (uwsgi forks)
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        return self.executor.submit(self.process, photo_id, src_file)
+
+    def process(self, photo_id, src_file):
+        """ Make the variants of the photo, and store them in its document """
+        start = time.time()
+        try:
+            variants = make_variants(src_file)
+        except Exception:
+            logger.exception("could not make the variants of photo %s" % photo_id)
+            self.photos.update_one({'id': photo_id}, {'$set': {'variants_status': FAILED}})
+            return False
+        self.photos.update_one({'id': photo_id}, {'$set': {'variants': variants, 'variants_status': READY}})
+        logger.debug("made the variants of photo %s in %.2fs" % (photo_id, time.time() - start))
+        if self.on_ready:
+            self.on_ready(photo_id)
+        return True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Make the variants of the photos that do not have them")
+    parser.add_argument('--failed', action='store_true',
+                        help="also try again for the photos it failed for before")
+    args = parser.parse_args()
+
+    from settings import UPLOAD_FOLDER
+    from app import db
+
+    pool = VariantPool(db.photos)
+    for photo in list(db.photos.find(unfinished(args.failed))):
+        pool.process(photo['id'], os.path.join(UPLOAD_FOLDER, photo['filename']))
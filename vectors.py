@@ -22,7 +22,7 @@ from PIL import Image
 import sys
 import os
 
-from settings import LATEST_GFS_FOLDER, LATEST_GFS_SLUG
+from settings import get_latest_gfs_folder
 from utils import logger
 
 class Vectorpixel:
@@ -65,6 +65,7 @@ class Vectorpixel:
         return self._format()
 
 def make_vector_pixels():
+    LATEST_GFS_FOLDER, LATEST_GFS_SLUG = get_latest_gfs_folder()
     if not LATEST_GFS_FOLDER:
         logger.debug("No GFS files found. Run fetch.py?")
         return False
@@ -6,19 +6,23 @@ This file implements the bulk of the rainbow-finding algorithm.
 Please consult README.md for an overview.
 """
 
-import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from glob import glob
-import json
-import sys
+import argparse
 import os
 import re
 
+import numpy as np
 import pytz
-import pysolar
-from PIL import Image, ImageOps, ImageEnhance, ImageChops
-
-from settings import GFS_FOLDER
+from PIL import Image
+
+from settings import GFS_FOLDER, SAVE_DEBUG_IMAGES
+import catalog
+import grib
+import layers
+import rainbowmask
+import solar
 import utils
 
 logger = utils.install_logger()
@@ -29,62 +33,124 @@ try:
 except ImportError:
     grib2json = 'grib2json'
 
+# How many forecasts to process in one pass
+try:
+    from settings import BATCH_SIZE
+except ImportError:
+    BATCH_SIZE = 8
 
-def find_rainclouds(THIS_GFS_SLUG):
-    global grib2json
+# Set GRIB_BACKEND = 'grib2json' in local_settings.py to always use grib2json
+try:
+    from settings import GRIB_BACKEND
+except ImportError:
+    GRIB_BACKEND = 'native'
 
-    THIS_GFS_FOLDER = os.path.join(GFS_FOLDER, THIS_GFS_SLUG)
-    if not THIS_GFS_FOLDER:
-        logger.debug("no grib files found. Run fetch.py?")
-        return False
 
-    logger.debug("starting cloud analysis with grib information from %s" % THIS_GFS_SLUG)
+def load_pwat(grib_file_path, json_file_path):
+    """
+    Read the precipitable water grid from the GRIB file, returning a tuple
+    (header, data). We decode it ourselves, and only use grib2json for
+    GRIB files our decoder does not understand.
+    """
+    if GRIB_BACKEND == 'grib2json':
+        return grib.load_with_grib2json(grib2json, grib_file_path, json_file_path)
+    try:
+        return grib.load(grib_file_path)
+    except grib.GribError as e:
+        logger.debug("could not decode GRIB file (%s), converting it with grib2json instead" % e)
+    return grib.load_with_grib2json(grib2json, grib_file_path, json_file_path)
+
 
-    DATE = datetime.strptime(THIS_GFS_SLUG, "%Y%m%d%H")       # strptime can’t handle timezones, what up with that?
-    DATE = DATE.replace(tzinfo=pytz.UTC)                        # we know it’s UTC so we add that info http://stackoverflow.com/questions/7065164/how-to-make-an-unaware-datetime-timezone-aware-in-python
+def find_rainclouds(THIS_GFS_SLUG):
+    """
+    Predict the rainbows for a forecast, writing the rainbow image and mask.
+    Returns the rainbow grid as a (ny, nx) boolean array, or False.
+    """
+    return find_rainclouds_batch([THIS_GFS_SLUG]).get(THIS_GFS_SLUG, False)
 
-    logger.debug("date = {}".format(DATE))
 
+def load_forecast(THIS_GFS_SLUG):
+    """ Return (header, data) of the precipitable water of a forecast, or None """
+    THIS_GFS_FOLDER = os.path.join(GFS_FOLDER, THIS_GFS_SLUG)
     grib_file_path = os.path.join(THIS_GFS_FOLDER, "GFS_half_degree.%s.pwat.grib" % THIS_GFS_SLUG)
     json_file_path = os.path.join(THIS_GFS_FOLDER, "GFS_half_degree.%s.pwat.json" % THIS_GFS_SLUG)
-    png_file_path  = os.path.join(THIS_GFS_FOLDER, "GFS_half_degree.%s.pwat.png" % THIS_GFS_SLUG)
-
-    png_sun_mask_file_path                          = os.path.join(THIS_GFS_FOLDER, "GFS_half_degree.sun_mask.%s.pwat.png" % THIS_GFS_SLUG)
-    png_clouds_greyscale_file_path                  = os.path.join(THIS_GFS_FOLDER, "GFS_half_degree.clouds_greyscale.%s.pwat.png" % THIS_GFS_SLUG)
-    png_clouds_alpha_file_path                       = os.path.join(THIS_GFS_FOLDER, "GFS_half_degree.clouds_alpha.%s.pwat.png" % THIS_GFS_SLUG)
-    png_clouds_greymasked_file_path                 = os.path.join(THIS_GFS_FOLDER, "GFS_half_degree.clouds_greymasked.%s.pwat.png" % THIS_GFS_SLUG)
-    png_clouds_greymasked_before_russia_file_path   = os.path.join(THIS_GFS_FOLDER, "GFS_half_degree.clouds_greymasked.before_russia.%s.pwat.png" % THIS_GFS_SLUG)
-    png_cloud_mask_file_path                        = os.path.join(THIS_GFS_FOLDER, "GFS_half_degree.cloud_mask.%s.pwat.png" % THIS_GFS_SLUG)
-    png_cloud_mask_extruded_file_path               = os.path.join(THIS_GFS_FOLDER, "GFS_half_degree.cloud_mask.extruded.%s.pwat.png" % THIS_GFS_SLUG)
 
     if not os.path.exists(grib_file_path):
         logger.debug("expected GRIB file not foud")
-        return False
-    if os.path.exists(json_file_path):
-        logger.debug("corresponding JSON found, skipping JSON conversion")
-    else:
-        logger.debug("converting GRIB into JSON file: %s" % json_file_path)
+        return None
+
+    try:
+        return load_pwat(grib_file_path, json_file_path)
+    except grib.GribError as e:
+        logger.error("could not read GRIB file: %s" % e)
+        return None
+
+
+def find_rainclouds_batch(slugs):
+    """
+    Predict the rainbows for several forecasts in one pass, stacking their
+    grids into (n, ny, nx) arrays, BATCH_SIZE forecasts at a time.
+    Writes the same files for every forecast as find_rainclouds, and returns
+    a dictionary slug → rainbow grid of the forecasts that succeeded.
+
+    A forecast that fails does not stop the others: when a batch fails, its
+    forecasts are processed again one by one.
+    """
+    grids = {}
+    batch = []
+    for THIS_GFS_SLUG in slugs:
+        logger.debug("starting cloud analysis with grib information from %s" % THIS_GFS_SLUG)
         try:
-            pipe = subprocess.Popen([grib2json, '-d', '-n',
-                             '-o', json_file_path,
-                             grib_file_path])
-        except OSError:
-            logger.error("`grib2json` executable not found")
-            sys.exit()
-        c = pipe.wait()
-        if c != 0:
-            logger.error("error in JSON conversion")
-            sys.exit()
-
-    with open(json_file_path) as f:
-        j = json.loads(f.read())
+            forecast = load_forecast(THIS_GFS_SLUG)
+        except Exception:
+            logger.exception("error while loading %s" % THIS_GFS_SLUG)
+            continue
+        if forecast is None:
+            continue
+        header, data = forecast
+        if batch and not same_grid(batch[0][1], header):
+            grids.update(rainclouds_or_one_by_one(batch))
+            batch = []
+        batch.append((THIS_GFS_SLUG, header, data))
+        if len(batch) == BATCH_SIZE:
+            grids.update(rainclouds_or_one_by_one(batch))
+            batch = []
+    if batch:
+        grids.update(rainclouds_or_one_by_one(batch))
+    return grids
+
+
+def rainclouds_or_one_by_one(batch):
+    """ rainclouds(batch), or when that fails, rainclouds of every forecast on its own """
+    try:
+        return rainclouds(batch)
+    except Exception:
+        logger.exception("error while processing %s" % ", ".join(slug for slug, _, _ in batch))
+        if len(batch) == 1:
+            return {}
+    logger.debug("processing %s one by one" % ", ".join(slug for slug, _, _ in batch))
+    grids = {}
+    for forecast in batch:
+        grids.update(rainclouds_or_one_by_one([forecast]))
+    return grids
+
+
+def same_grid(header, other):
+    return all(header[key] == other[key] for key in ('lo1', 'la1', 'dx', 'dy', 'nx', 'ny'))
+
+
+def rainclouds(batch):
+    """ The rainbow analysis of a list of (slug, header, data) on the same grid """
+    header = batch[0][1]
+
+    # strptime can’t handle timezones, what up with that?
+    # we know it’s UTC so we add that info http://stackoverflow.com/questions/7065164/how-to-make-an-unaware-datetime-timezone-aware-in-python
+    DATES = [datetime.strptime(slug, "%Y%m%d%H").replace(tzinfo=pytz.UTC) for slug, _, _ in batch]
+    logger.debug("dates = {}".format(", ".join(str(DATE) for DATE in DATES)))
 
     # The logic of plotting the data was partly copied from the JavaScript here:
     # https://github.com/cambecc/earth/blob/e7be4d6810f211217956daf544111502fc57a868/public/libs/earth/1.0.0/products.js#L607
 
-    header = j[0]['header']
-    data   = j[0]['data']
-
     # the grid's origin (e.g., 0.0E, 90.0N)
     l0 = header['lo1']
     ph0 = header['la1']
@@ -97,136 +163,111 @@ def find_rainclouds(THIS_GFS_SLUG):
     ni = header['nx']
     nj = header['ny']
 
-    logger.debug("read %s points" % len(data))
+    logger.debug("read %s points for %s forecasts" % (ni * nj, len(batch)))
     logger.debug("the grids origin %sE, %sN" % (l0, ph0))
     logger.debug("distance between grid points: %s deg lon, %s deg lat" % (dl, dph))
     logger.debug("number of grid points W-E: %s, N-S: %s" % (ni, nj))
 
-    latitude = ph0
-    longitude = l0
+    logger.debug("Converting data to color, pushing the contrast and then tresholding the clouds")
+    clouds = layers.cloud_layers(np.stack([data for _, _, data in batch]))
+
+    logger.debug("Calculating the solar altitudes for all combinations of latitude and longitude, and the colours based on the altitudes")
+    sun_masks, suns = solar.sun_masks(DATES, l0, ph0, dl, dph, ni, nj)
 
-    def prec2color(prec):
-#        return int(255 - prec * 60)
-        return int(255 - prec * 3)
+    logger.debug("Found the sun at %s" % ", ".join("%s, %s" % sun for sun in suns))
+    logger.debug("Barrel distorting the clouds around the sun, leaving only rainbow area, "
+                 "and masking where it is night or where the sun is too high to see rainbows")
+    rainbows = layers.rainbow_layers(clouds, sun_masks, [x for x, y in suns], [y for x, y in suns])
 
-    logger.debug("Converting data to color, and writing it to canvas")
-    cloud_layer = Image.new("L", (ni, nj))
-    cloud_layer.putdata(list(map(prec2color, data)))
+    # Most of the time goes into compressing the images and layers, which
+    # numpy and PIL do without holding the GIL: write the forecasts side by side
+    def save(i):
+        THIS_GFS_SLUG, header, _ = batch[i]
+        try:
+            return save_rainclouds(THIS_GFS_SLUG, header, DATES[i],
+                                   layers.CloudLayers(*(layer[i] for layer in clouds)),
+                                   sun_masks[i],
+                                   layers.RainbowLayers(*(layer[i] for layer in rainbows)))
+        except Exception:
+            logger.exception("error while saving %s" % THIS_GFS_SLUG)
+            return None
+
+    with ThreadPoolExecutor(max_workers=len(batch)) as pool:
+        grids = zip([slug for slug, _, _ in batch], pool.map(save, range(len(batch))))
+        return dict((slug, grid) for slug, grid in grids if grid is not None)
 
-    cloud_layer_greyscale = cloud_layer
-    # Intermediary debug image:
-    cloud_layer_greyscale.save(png_clouds_greyscale_file_path)
+
+def save_rainclouds(THIS_GFS_SLUG, header, DATE, clouds, sun_mask, rainbows):
+    """ Write the images, the rainbow mask and the debug layers of a forecast. Returns the rainbow grid. """
+    THIS_GFS_FOLDER = os.path.join(GFS_FOLDER, THIS_GFS_SLUG)
+    png_file_path  = os.path.join(THIS_GFS_FOLDER, "GFS_half_degree.%s.pwat.png" % THIS_GFS_SLUG)
+    png_clouds_alpha_file_path = os.path.join(THIS_GFS_FOLDER, "GFS_half_degree.clouds_alpha.%s.pwat.png" % THIS_GFS_SLUG)
 
     # Output the alpha image
-    alpha_layer = Image.new("LA", (ni, nj))
-    alpha_layer.putdata(list(map(lambda p: (255, int(255-(255-p*6))), data)))
+    ni, nj = header['nx'], header['ny']
+    alpha_layer = Image.merge("LA", (Image.new("L", (ni, nj), 255), Image.fromarray(clouds.alpha)))
     alpha_layer.save(png_clouds_alpha_file_path)
-    
-    logger.debug("Pushing the contrast and then tresholding the clouds")
-    enhancer = ImageEnhance.Contrast(cloud_layer)
-    cloud_layer = enhancer.enhance(80)
-    threshold = 191
-    cloud_layer = cloud_layer.point(lambda p: p > threshold and 255)
-
-    cloud_layer_greyscale.paste(cloud_layer, (0,0), cloud_layer)
-
-    logger.debug("Calculating the solar altitudes for all combinations of latitude and longitude @ {}".format(DATE))
-    #DATE = datetime(2015, 5, 24, 11, 0, 0)
-    #logger.debug("{}".format(DATE))
-
-    altitudes = []
-    for j in range(nj):
-        for i in range(ni):
-            altitudes.append(pysolar.solar.get_altitude_fast(latitude, longitude, DATE))
-            longitude += dl
-        latitude += dph
-
-    def altitude2colors(altitude):
-        if 42 > altitude > 0:
-            return 255
-        else:
-            return 0
-
-    sun_mask = Image.new("L", (ni, nj))
-    logger.debug("Calculating the colours based on the altitudes")
-    colors = map(altitude2colors, altitudes)
-    sun_mask.putdata(list(colors))
-
-    sun_mask = ImageChops.offset(sun_mask, ni // 2, 0)
-
-    # Intermediary debug image:
-    sun_mask.save(png_sun_mask_file_path)
-
-    # Calculate where the sun is in the image
-    sun_i = altitudes.index(max(altitudes))
-    sun_y = sun_i // ni
-    sun_x = (sun_i + ni // 2) % ni
-    logger.debug("Found the sun at index %s corresponding to %s, %s" % (sun_i, sun_x, sun_y))
-    sun_mask.putpixel((sun_x, sun_y), 255)
-
-    middle = ni // 2
-    translate_x = middle - sun_x
-    logger.debug("Moving the image %s pixels to the right to have the sun exactly in the middle" % translate_x)
-    # Intermediary debug image:
-    cloud_layer.save(png_cloud_mask_file_path.replace(".png", ".not-inverted.png"))
-
-    cloud_layer = ImageChops.offset(cloud_layer, translate_x, 0)
-
-    cloud_layer = ImageOps.invert(cloud_layer)
-    cloud_layer.save(png_cloud_mask_file_path)
-
-    logger.debug("Barrel distorting the clouds")
-    barrel_distortion = "0.0 0.0 0.025 0.975 %s %s" % (sun_x + translate_x, sun_y)
-    pipe = subprocess.Popen(['convert', png_cloud_mask_file_path,
-                         '-virtual-pixel', 'black',
-                         '-filter','point', '-interpolate', 'NearestNeighbor',
-                         '-distort', 'Barrel', barrel_distortion,
-                         '+antialias',
-                         '-negate',
-                         png_cloud_mask_extruded_file_path])
-    pipe.wait()
-
-    logger.debug("Adding the distorted clouds to the original, leaving only rainbow area")
-    extruded_cloud_layer = Image.open(png_cloud_mask_extruded_file_path)
-    cloud_layer.paste(extruded_cloud_layer, (0, 0), extruded_cloud_layer)
-
-    logger.debug("Moving the image back to its original position")
-    cloud_layer = ImageChops.offset(cloud_layer, translate_x * -1, 0)
-
-    # Intermediary debug image:
-    cloud_layer.save(png_file_path.replace(".png", ".without-sun-mask.png"))
-    logger.debug("Masking where it is night or where the sun is too high to see rainbows")
-    cloud_layer.paste(ImageOps.invert(sun_mask), (0, 0), ImageOps.invert(sun_mask))
-
-    # Intermediary debug image:
-    #cloud_layer.save(png_clouds_greymasked_before_russia_file_path)
-    #logger.debug("Showing only rainbows over Russian soil")
-    #cloud_layer.paste(russia_layer, (0, 0), russia_layer)
 
     logger.debug("Written cloud layer image file")
-    cloud_layer.save(png_file_path)
-
-    cloud_layer_greyscale.paste(ImageOps.invert(sun_mask), (0, 0), ImageOps.invert(sun_mask))
-    #cloud_layer_greyscale.paste(russia_layer, (0, 0), russia_layer)
-    cloud_layer_greyscale.save(png_clouds_greymasked_file_path)
+    Image.fromarray(rainbows.rainbows).save(png_file_path)
+    grid = rainbows.rainbows == 0
+    rainbowmask.write(rainbowmask.path_for(THIS_GFS_FOLDER, THIS_GFS_SLUG), grid, header, DATE)
+
+    # Intermediary layers, for the debug images in HQ
+    layers.save_debug_layers(THIS_GFS_FOLDER, THIS_GFS_SLUG,
+                             greyscale=clouds.greyscale,
+                             sun_mask=sun_mask,
+                             not_inverted=rainbows.not_inverted,
+                             extruded=rainbows.extruded,
+                             without_sun_mask=rainbows.without_sun_mask,
+                             greymasked=rainbows.greymasked)
+    if SAVE_DEBUG_IMAGES:
+        for pattern, _ in layers.DEBUG_IMAGES:
+            layers.render_debug_image(THIS_GFS_FOLDER, THIS_GFS_SLUG, pattern % THIS_GFS_SLUG)
+
+    return grid
+
+
+def unprocessed_slugs():
+    """
+    The forecasts that have not been processed yet, newest first. A newer
+    GFS run replaces forecasts in between processed ones (see fetch.py), so
+    we look through all of them.
+    """
+    slugs = []
+    for f in sorted(os.listdir(GFS_FOLDER), reverse=True):
+        slug = f
+        path = os.path.join(GFS_FOLDER, slug)
+        if re.match(r'\d{10}', slug) and os.path.isdir(path):
+            if len(glob(os.path.join(path, '*pwat.png'))) > 0:
+                continue
+            if len(glob(os.path.join(path, '*pwat.grib'))) > 0:
+                logger.debug("encountered forecast %s" % slug)
+                slugs.append(slug)
+    return slugs
 
 
 if __name__ == '__main__':
-    if len(sys.argv) > 1:
-        # specify one ar more slugs in the form YYYYMMDDHH as command line arguments
-        for slug in sys.argv[1:]:
-            find_rainclouds(slug)
+    parser = argparse.ArgumentParser(description="Find the rainclouds for GFS forecasts")
+    parser.add_argument('slugs', nargs='*', metavar='YYYYMMDDHH',
+                        help="forecasts to process (default: the unprocessed ones)")
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+                        help="number of forecasts to process at the same time")
+    args = parser.parse_args()
+
+    if args.slugs:
+        slugs = args.slugs
     else:
         # This is the default behaviour
-        # Goes back in time tho find the most recent unprocessed grib file
         logger.debug('looking for forecasts to process')
-        for f in sorted(os.listdir(GFS_FOLDER), reverse=True):
-            slug = f
-            path = os.path.join(GFS_FOLDER, slug)
-            if re.match(r'\d{10}', slug) and os.path.isdir(path):
-                if len(glob(os.path.join(path, '*pwat.png'))) > 0:
-                    logger.debug("encountered already processed forecast %s, stop searching for forecasts" % slug)
-                    break
-                if len(glob(os.path.join(path, '*pwat.grib'))) > 0:
-                    logger.debug("encountered forecast %s, start processing" % slug)
-                    find_rainclouds(slug)
+        slugs = unprocessed_slugs()
+
+    if args.jobs > 1:
+        results = utils.process_slugs(find_rainclouds, slugs, args.jobs)
+    else:
+        grids = find_rainclouds_batch(slugs)
+        results = [(slug, slug in grids) for slug in slugs]
+    for slug, succeeded in results:
+        if not succeeded:
+            logger.error("could not process forecast %s" % slug)
+    catalog.publish(GFS_FOLDER)